@@ -3,18 +3,54 @@ Inpaint-Web 后端 API 服务
 提供图像超分辨率（4x 放大）功能
 支持 NVIDIA GPU (CUDA)、Mac M 芯片 (MPS) 和 CPU
 """
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import Response, JSONResponse
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Request
+from fastapi.responses import Response, JSONResponse, StreamingResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
+import argparse
+import asyncio
 import io
+import os
 import time
+import uuid
 import gc
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import quote
+import numpy as np
 import uvicorn
-import torch
 
-from models import get_model, get_inpaint_model, DeviceDetector
+try:
+    import torch
+except ImportError:  # ONNX Runtime 部署可不安装 torch
+    torch = None
+
+from models import (
+    get_model, get_inpaint_model, get_fast_model, get_plans, enhance_faces, get_face_enhancer_info, DeviceDetector
+)
+from models.tiling import clip_roi
+from serving import (
+    WorkerPool, NoCapableWorkerError, SharedArrayPool, Pipeline, PipelineResult, build_worker_specs, borrow
+)
+from serving.workers import LARGE_UPSCALE_BYTES_PER_PIXEL, parse_size
+from serving.canvas import DiskCanvas, default_large_image_dir, encode_canvas
+from serving.sessions import SessionStore, SessionNotFoundError, composite, stroke_region
+from serving.uploads import (
+    UploadStore, UploadNotFoundError, DigestMismatchError, default_upload_dir, is_valid_digest
+)
+from serving.batch import BatchItem, MultipartWriter, iter_archive, pair_masks, run_pipelined
+from serving.admission import AdmissionController, AdmissionRejected, CostModel, Ticket, retry_after_header
+from serving.cancel import CancelRegistry, CancelToken, RequestCancelled
+from serving.degradation import (
+    TIER_FAST, TIER_FULL, DegradationPolicy, TierDecision, memory_pressure, stage_name, tier_op
+)
+from serving.profiling import (
+    ProfilingPolicy, Trace, TraceStore, default_profile_dir, is_valid_trace_id, profile_model, trace_span
+)
 
 # 创建 FastAPI 应用
 app = FastAPI(
@@ -30,18 +66,57 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["*"],  # 前端需要读取 X-Region 等自定义响应头
 )
 
 # 全局变量
 model = None  # RealESRGAN 超分辨率模型
 inpaint_model = None  # MI-GAN Inpaint 模型
+fast_models = {}  # 降级档位的轻量模型(进程内推理),op -> 模型
 device_info = None
+worker_pool = None  # 多进程推理 Worker 池(INPAINT_WORKERS > 0 时启用)
+shm_pool = None  # 前端与 Worker 之间的共享内存池
+pipeline = None  # 解码 -> 推理 -> 编码 分阶段流水线
+upload_store = None  # 按 SHA-256 寻址的上传存储
+admission = None  # 准入控制与按客户端的公平排队
+trace_store = None  # 按请求采集的性能剖析 trace
+profiling_policy = ProfilingPolicy.from_env()
+# 负载高时把请求切换到降级档位(更轻的模型与更快的编码设置)
+degradation = DegradationPolicy.from_env()
+# 识别客户端的请求头(如反向代理设置的 X-Forwarded-For 或 API Key),为空时使用来源地址
+ADMISSION_CLIENT_HEADER = os.environ.get("ADMISSION_CLIENT_HEADER", "")
+# 进行中的请求(客户端断开或显式取消时停止计算)
+cancel_registry = CancelRegistry()
+# 检查客户端是否已断开的间隔(秒)
+CANCEL_POLL_INTERVAL = float(os.environ.get("CANCEL_POLL_INTERVAL", "0.25"))
+# 客户端已取消请求时的状态码(同 nginx 的 499 Client Closed Request)
+STATUS_CLIENT_CLOSED = 499
+# 大图模式:输出超过阈值时写入磁盘画布并流式编码,进程内存不随输出尺寸增长
+LARGE_IMAGE_DIR = default_large_image_dir()
+LARGE_IMAGE_THRESHOLD = parse_size(os.environ.get("LARGE_IMAGE_THRESHOLD", "1G"))
+# 大图模式瓦片结果按模型原生倍数直接写入画布,只支持默认模型(RealESRGAN_x4plus)的倍数
+LARGE_IMAGE_SCALE = 4
+# 输出格式 -> MIME 类型
+OUTPUT_FORMATS = {"png": "image/png", "tiff": "image/tiff"}
+# 增量 Inpaint 会话(保存每个会话的最新结果)
+session_store = SessionStore(
+    ttl=float(os.environ.get("INPAINT_SESSION_TTL", "600")),
+    max_bytes=parse_size(os.environ.get("INPAINT_SESSION_MAX_BYTES", "1G")),
+    max_sessions=int(os.environ.get("INPAINT_SESSION_MAX", "64")),
+)
+
+# 进程内推理时每个模型一个单线程执行器:推理不阻塞事件循环,
+# 同一模型的调用仍然串行(超分模型在显存不足重试时会修改实例上的 tile,不是线程安全的)
+inference_executors = {
+    "upscale": ThreadPoolExecutor(max_workers=1, thread_name_prefix="upscale"),
+    "inpaint": ThreadPoolExecutor(max_workers=1, thread_name_prefix="inpaint"),
+}
 
 
 @app.on_event("startup")
 async def startup_event():
     """应用启动时初始化"""
-    global model, inpaint_model, device_info
+    global model, inpaint_model, device_info, worker_pool, shm_pool, pipeline, upload_store, admission, trace_store
     
     print("=" * 60)
     print("🚀 Inpaint-Web GPU Backend 启动中...")
@@ -53,6 +128,47 @@ async def startup_event():
     for key, value in device_info.items():
         print(f"   {key}: {value}")
     
+    # 上传存储:客户端按哈希上传一次图片,之后的请求只传哈希
+    upload_store = UploadStore(
+        default_upload_dir(),
+        max_bytes=parse_size(os.environ.get("UPLOAD_MAX_BYTES", "2G")),
+        cache_bytes=parse_size(os.environ.get("UPLOAD_CACHE_BYTES", "1G")),
+        decoder=decode_image,
+    )
+    # 性能剖析 trace 保存目录(按数量与总大小淘汰最旧的)
+    trace_store = TraceStore(
+        default_profile_dir(),
+        max_traces=int(os.environ.get("PROFILE_MAX_TRACES", "100")),
+        max_bytes=parse_size(os.environ.get("PROFILE_MAX_BYTES", "256M")),
+    )
+    
+    # 多 Worker 模式:模型加载在 Worker 进程中,前端进程不加载模型
+    num_workers = int(os.environ.get("INPAINT_WORKERS", "0"))
+    if num_workers > 0:
+        specs = build_worker_specs(
+            num_workers,
+            devices=os.environ.get("INPAINT_WORKER_DEVICES", ""),
+            cpu_sets=os.environ.get("INPAINT_WORKER_CPUSETS", ""),
+            memory=os.environ.get("INPAINT_WORKER_MEMORY", ""),
+        )
+        print(f"\n📦 启动 {num_workers} 个推理 Worker...")
+        for spec in specs:
+            print(f"   Worker {spec.index}: device={spec.device}, cpu_set={spec.cpu_set}")
+        shm_bytes = parse_size(os.environ.get("INPAINT_SHM_BYTES", "2G"))
+        if shm_bytes > 0:
+            shm_pool = SharedArrayPool(shm_bytes)
+            print(f"   共享内存池上限: {shm_bytes / 1024 ** 3:.1f}GB")
+        worker_pool = WorkerPool(specs, shm_pool=shm_pool)
+        worker_pool.start()
+        await worker_pool.wait_ready()
+        # 每个 Worker 同时处理一个请求,推理阶段并发数与 Worker 数一致
+        pipeline = Pipeline.from_env({"upscale": num_workers, "inpaint": num_workers})
+        admission = _create_admission(specs[0].device.split(":")[0], num_workers)
+        print("\n" + "=" * 60)
+        print("✓ 服务启动完成，API 文档: http://localhost:8000/docs")
+        print("=" * 60 + "\n")
+        return
+    
     # 加载模型
     print(f"\n📦 加载 Real-ESRGAN 模型...")
     try:
@@ -80,11 +196,510 @@ async def startup_event():
         print(f"\n  Inpaint 功能将禁用")
         inpaint_model = None
     
+    # 降级档位的轻量模型在启动时加载:负载高时再加载会进一步增加延迟和内存压力
+    if degradation.enabled:
+        for op, loaded in (("upscale", model), ("inpaint", inpaint_model)):
+            if loaded is None:
+                continue
+            try:
+                fast_models[op] = get_fast_model(op)
+                print(f"✓ {op} 降级模型: {fast_models[op].get_info()['name']}")
+            except Exception as e:
+                print(f"⚠️  {op} 降级模型不可用,降级时只使用更快的编码设置: {e}")
+    
+    # 进程内推理:每个模型一个单线程执行器
+    pipeline = Pipeline.from_env({"upscale": 1, "inpaint": 1})
+    admission = _create_admission(device_info['type'], 1)
+    
     print("\n" + "=" * 60)
     print("✓ 服务启动完成，API 文档: http://localhost:8000/docs")
     print("=" * 60 + "\n")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时停止 Worker 进程和流水线线程池"""
+    if pipeline is not None:
+        pipeline.shutdown()
+    if worker_pool is not None:
+        worker_pool.shutdown()
+    if shm_pool is not None:
+        shm_pool.close()
+
+
+def _create_admission(device_type: str, parallelism: int) -> AdmissionController:
+    """按推理后端创建成本模型与准入控制器"""
+    if os.environ.get("INPAINT_MOCK_MODELS", "0").lower() in ("1", "true", "yes"):
+        backends = {"upscale": "mock", "inpaint": "mock"}
+    else:
+        backends = {
+            "upscale": f"{os.environ.get('UPSCALE_BACKEND', 'torch')}-{device_type}",
+            "inpaint": device_type,
+        }
+    # 降级档位的耗时单独估计
+    backends.update({tier_op(op, TIER_FAST): backend for op, backend in backends.items()})
+    controller = AdmissionController.from_env(CostModel(backends), parallelism)
+    print(f"   准入控制: 同时执行 {controller.max_active} 个请求, "
+          f"每个客户端最多 {controller.client_max_requests} 个 / {controller.client_max_cost:.0f} 秒")
+    return controller
+
+
+def client_id(request: Request) -> str:
+    """识别请求来自哪个客户端,用于预算与公平排队"""
+    if ADMISSION_CLIENT_HEADER:
+        value = request.headers.get(ADMISSION_CLIENT_HEADER)
+        if value:
+            return value.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def admit(request: Request, op: str, pixels: int) -> Ticket:
+    """按成本排队,客户端超出预算返回 429,服务端队列已满返回 503"""
+    try:
+        return admission.submit(client_id(request), op, pixels)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=str(e),
+            headers={"Retry-After": retry_after_header(e.retry_after)}
+        )
+
+
+def choose_tier(quality: str) -> TierDecision:
+    """按当前负载选择质量档位:quality=full 时不降级,fast 时总是降级;参数错误返回 400"""
+    queued, predicted_wait = admission.load()
+    memory = memory_pressure() if degradation.memory_percent > 0 else None
+    try:
+        return degradation.decide(quality, queued, predicted_wait, memory)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _watch_disconnect(request: Request, token: CancelToken):
+    """定期检查客户端是否已断开,断开后取消请求"""
+    while not token.cancelled:
+        if await request.is_disconnected():
+            token.cancel("disconnect")
+            return
+        await asyncio.sleep(CANCEL_POLL_INTERVAL)
+
+
+@asynccontextmanager
+async def cancellation(request: Request):
+    """
+    为请求创建取消令牌:客户端断开,或通过 DELETE /api/requests/{X-Request-ID} 显式取消时触发
+    """
+    token = cancel_registry.open(request.headers.get("X-Request-ID"), client_id(request))
+    watcher = asyncio.create_task(_watch_disconnect(request, token))
+    try:
+        yield token
+    finally:
+        watcher.cancel()
+        cancel_registry.close(token)
+
+
+async def run_admitted(ticket: Ticket, op, cancel: CancelToken,
+                       trace: Optional[Trace] = None, **stages) -> PipelineResult:
+    """
+    等待公平队列放行后执行流水线,并用实际推理耗时修正成本模型
+    op 为推理阶段名,依次经过多个推理阶段时为阶段名列表(凭据的操作为 "a+b" 形式,按步骤修正)
+    请求取消时立即停止等待(排队中的请求退出队列),抛出 RequestCancelled
+    采集性能剖析时 trace 记录排队与流水线各阶段的区间
+    """
+    entered = False
+
+    async def run():
+        nonlocal entered
+        start = time.perf_counter()
+        entered = True  # 之后由 admitted() 负责释放凭据
+        async with admission.admitted(ticket):
+            if trace is not None:
+                trace.add("admission_wait", start, time.perf_counter(), "wait")
+            return await pipeline.run(op, cancel=cancel, trace=trace, **stages)
+
+    try:
+        cancel.check()
+        task = asyncio.ensure_future(run())
+        cancel.add_callback(task.cancel)
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if not cancel.cancelled:
+                # 调用方本身被取消(流式响应的客户端断开):记为断开并继续向上传播
+                cancel.cancel("disconnect")
+                raise
+            cancel.check()
+        finally:
+            cancel.remove_callback(task.cancel)
+    finally:
+        if not entered:
+            # 开始之前已取消(已取消批量任务的剩余项),或任务第一步之前被取消(已断开的客户端)
+            admission.withdraw(ticket)
+    if "+" in ticket.op:
+        for step in ticket.op.split("+"):
+            admission.observe(ticket, result.timings[stage_name(step)], step)
+    else:
+        admission.observe(ticket, result.timings["infer"])
+    return result
+
+
+def _cancelled(e: RequestCancelled) -> HTTPException:
+    return HTTPException(status_code=STATUS_CLIENT_CLOSED, detail=str(e))
+
+
+def start_trace(request: Request, op: str) -> Optional[Trace]:
+    """授权的调用方(X-Profile 头)或被抽样的请求采集性能剖析,否则返回 None"""
+    reason = profiling_policy.decide(request.headers.get("X-Profile"))
+    if reason is None:
+        return None
+    trace = Trace("api")
+    trace.meta.update(op=op, reason=reason, request_id=request.headers.get("X-Request-ID"))
+    return trace
+
+
+async def save_trace(trace: Optional[Trace], result: PipelineResult) -> dict:
+    """
+    保存 trace,返回下载地址响应头
+    只有授权开启的请求才返回下载地址,被抽样的请求只保存,不告知调用方
+    """
+    if trace is None:
+        return {}
+    trace.meta["timings"] = {key: round(value, 4) for key, value in result.timings.items()}
+    loop = asyncio.get_running_loop()
+    trace_id = await loop.run_in_executor(None, trace_store.save, trace)
+    if trace.meta.get("reason") != "requested":
+        return {}
+    return {"X-Profile-Id": trace_id, "X-Profile-URL": f"/api/profiles/{trace_id}"}
+
+
+def _feature_available(op: str) -> bool:
+    """判断某项功能(upscale / inpaint)当前是否可用"""
+    if worker_pool is not None:
+        return any(w["ready"] and op in w["ops"] for w in worker_pool.stats())
+    return (model if op == "upscale" else inpaint_model) is not None
+
+
+async def run_upscale(image: Image.Image, scale: int, face_enhance: bool = False,
+                      cancel: Optional[CancelToken] = None, trace: Optional[Trace] = None,
+                      roi: Optional[Tuple[int, int, int, int]] = None, tier: str = TIER_FULL):
+    """
+    执行超分辨率推理(Worker 池或进程内执行器)
+
+    Args:
+        face_enhance: 超分后对人脸区域做 GFPGAN 增强
+        roi: 只放大的区域 (x, y, 宽, 高),已裁剪到图片范围内;只推理与其相交的瓦片
+        tier: 质量档位,降级档位使用轻量模型(未加载时使用默认模型)
+        cancel: 取消令牌,进程内推理时在每个瓦片之前检查(Worker 池通过任务取消通知 Worker)
+        trace: 性能剖析 trace,记录每个瓦片与推理后端自带 profiler 的结果
+
+    Returns:
+        (放大后的 PIL Image(指定 roi 时为该区域), 实际执行的设备, 人脸增强统计(未启用时为 None))
+    """
+    if worker_pool is not None:
+        width, height = image.size if roi is None else roi[2:]
+        payload = {"image": np.asarray(image), "scale": scale}
+        if roi is not None:
+            payload["roi"] = roi
+        if tier == TIER_FAST:
+            payload["tier"] = tier
+        if face_enhance:
+            payload["face_enhance"] = True
+        if trace is not None:
+            payload["profile"] = True
+        output, worker = await worker_pool.run(
+            "upscale", payload,
+            pixels=width * height,
+            output_shape=(int(height * scale), int(width * scale), len(image.getbands()))
+        )
+        with borrow(output) as array:
+            # RGBA 的 fromarray 直接引用共享内存,先拷贝,之后即可释放共享内存
+            output_image = Image.fromarray(array).copy()
+        if trace is not None:
+            trace.extend(worker.get("trace", []))
+        return output_image, f"{worker['device']} (worker {worker['worker']})", worker.get("face")
+
+    cancel_check = cancel.check if cancel is not None else None
+    upscaler = fast_models.get("upscale", model) if tier == TIER_FAST else model
+
+    def infer():
+        with trace_span(trace, "upscale", "model"), profile_model(trace, upscaler):
+            output = upscaler.enhance(image, outscale=scale, cancel_check=cancel_check,
+                                   on_tile=trace.on_tile if trace is not None else None, roi=roi)
+        if not face_enhance:
+            return output, None
+        if cancel_check is not None:
+            cancel_check()
+        original = image
+        if roi is not None:
+            x, y, w, h = roi
+            original = image.crop((x, y, x + w, y + h))
+        # 人脸增强与超分在同一执行器中串行执行,共用同一设备
+        with trace_span(trace, "face_enhance", "model"):
+            array, face = enhance_faces(np.asarray(original), np.array(output))
+        return Image.fromarray(array), face
+
+    loop = asyncio.get_running_loop()
+    output, face = await loop.run_in_executor(inference_executors["upscale"], infer)
+    return output, device_info['type'], face
+
+
+async def run_upscale_large(image: Image.Image, scale: int, canvas: DiskCanvas,
+                            cancel: Optional[CancelToken] = None, trace: Optional[Trace] = None) -> str:
+    """
+    大图模式超分:瓦片结果直接写入磁盘画布 canvas(形状为放大后的 HWC),写完的行刷盘并释放
+
+    Returns:
+        实际执行的设备
+    """
+    width, height = image.size
+    if worker_pool is not None:
+        payload = {"image": np.asarray(image), "scale": scale, "canvas": canvas.path}
+        if trace is not None:
+            payload["profile"] = True
+        _, worker = await worker_pool.run(
+            "upscale", payload,
+            pixels=width * height,
+            memory_bytes=width * height * LARGE_UPSCALE_BYTES_PER_PIXEL
+        )
+        if trace is not None:
+            trace.extend(worker.get("trace", []))
+        return f"{worker['device']} (worker {worker['worker']})"
+
+    cancel_check = cancel.check if cancel is not None else None
+
+    def infer():
+        with trace_span(trace, "upscale", "model"), profile_model(trace, model):
+            model.enhance_to(np.asarray(image), canvas.array, cancel_check=cancel_check,
+                             on_tile=trace.on_tile if trace is not None else None,
+                             on_rows=canvas.release)
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(inference_executors["upscale"], infer)
+    return device_info['type']
+
+
+def server_timing(result: PipelineResult, ticket: Ticket) -> str:
+    """Server-Timing 响应头:排队与流水线各阶段耗时(毫秒),浏览器开发者工具可直接显示"""
+    metrics = [("queue", ticket.waited)] + [
+        (name, seconds) for name, seconds in result.timings.items() if name != "infer"
+    ]
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in metrics)
+
+
+def face_headers(face: Optional[dict]) -> dict:
+    """人脸增强的响应头:检测到的人脸数与各步骤耗时"""
+    if face is None:
+        return {}
+    if "error" in face:
+        return {"X-Face-Enhance": "unavailable"}
+    return {
+        "X-Face-Enhance": "applied" if face["faces"] else "no-faces",
+        "X-Face-Count": str(face["faces"]),
+        "X-Face-Time": f"detect={face['detect']:.3f}, restore={face['restore']:.3f}, paste={face['paste']:.3f}",
+    }
+
+
+async def run_inpaint(image: Image.Image, mask: Image.Image, cancel: Optional[CancelToken] = None,
+                      trace: Optional[Trace] = None, tier: str = TIER_FULL):
+    """
+    执行 Inpaint 推理(Worker 池或进程内执行器)
+    Inpaint 模型整图推理,取消令牌只在开始推理之前检查;降级档位使用轻量模型(未加载时使用默认模型)
+
+    Returns:
+        (修复后的 PIL Image, 实际执行的设备)
+    """
+    if worker_pool is not None:
+        width, height = image.size
+        payload = {"image": np.asarray(image), "mask": np.asarray(mask)}
+        if tier == TIER_FAST:
+            payload["tier"] = tier
+        if trace is not None:
+            payload["profile"] = True
+        output, worker = await worker_pool.run(
+            "inpaint", payload,
+            pixels=width * height,
+            output_shape=(height, width, 3)
+        )
+        with borrow(output) as array:
+            output_image = Image.fromarray(array)
+        if trace is not None:
+            trace.extend(worker.get("trace", []))
+        return output_image, f"{worker['device']} (worker {worker['worker']})"
+
+    inpainter = fast_models.get("inpaint", inpaint_model) if tier == TIER_FAST else inpaint_model
+
+    def infer():
+        if cancel is not None:
+            cancel.check()  # 在执行器中排队期间已取消
+        with trace_span(trace, "inpaint", "model"), profile_model(trace, inpainter):
+            return inpainter.inpaint(image, mask)
+
+    loop = asyncio.get_running_loop()
+    output = await loop.run_in_executor(inference_executors["inpaint"], infer)
+    return output, inpainter.actual_device
+
+
+class ImageDecodeError(ValueError):
+    """上传的图片无法解码"""
+
+
+class InvalidRegionError(ImageDecodeError):
+    """ROI 与图片没有交集"""
+
+
+def parse_roi(value: Optional[str]) -> Optional[Tuple[int, int, int, int]]:
+    """解析 ROI 参数 "x,y,宽,高"(原图坐标),格式错误时返回 400"""
+    if not value:
+        return None
+    try:
+        x, y, w, h = (int(v) for v in value.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"roi 格式应为 x,y,宽,高: {value}")
+    if w <= 0 or h <= 0:
+        raise HTTPException(status_code=400, detail=f"roi 宽高必须大于 0: {value}")
+    return x, y, w, h
+
+
+def clip_region(image: Image.Image, roi: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+    """解码后把 ROI 裁剪到图片范围内"""
+    try:
+        return clip_roi(roi, *image.size)
+    except ValueError as e:
+        raise InvalidRegionError(str(e))
+
+
+def decode_image(data: bytes, mode: str = 'RGB') -> Image.Image:
+    """解码图片字节并转换为指定模式,PIL 无法识别时回退到 OpenCV"""
+    if len(data) == 0:
+        raise ImageDecodeError("图片文件为空")
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Exception as e:
+        import cv2
+        img_cv = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if img_cv is None:
+            raise ImageDecodeError(f"无法识别图片格式: {e}")
+        image = Image.fromarray(cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB))
+    if image.mode != mode:
+        image = image.convert(mode)
+    return image
+
+
+def image_pixels(data: bytes) -> int:
+    """只读取文件头得到图片像素数,无法识别时返回 0(之后解码阶段会报错)"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.size[0] * image.size[1]
+    except Exception:
+        return 0
+
+
+def decode_image_and_mask(image, mask_bytes: bytes):
+    """
+    解码 inpaint 的图片与遮罩,遮罩尺寸与图片不一致时缩放到图片尺寸
+
+    Args:
+        image: 图片字节,或已解码的 RGB PIL Image
+        mask_bytes: 遮罩字节
+    """
+    image_pil = decode_image(image, 'RGB') if isinstance(image, bytes) else image
+    mask_pil = decode_image(mask_bytes, 'L')
+    # CRITICAL: 确保 mask 和 image 尺寸完全一致
+    if mask_pil.size != image_pil.size:
+        print(f"⚠️  Mask 尺寸 {mask_pil.size} 与 Image 尺寸 {image_pil.size} 不一致,自动调整...")
+        mask_pil = mask_pil.resize(image_pil.size, Image.LANCZOS)
+    return image_pil, mask_pil
+
+
+def encode_png(image: Image.Image, optimize: bool = True, compress_level: Optional[int] = None) -> bytes:
+    """将 PIL Image 编码为 PNG 字节;指定 compress_level 时使用该压缩级别(不做 optimize)"""
+    output_buffer = io.BytesIO()
+    if compress_level is not None:
+        image.save(output_buffer, format='PNG', compress_level=compress_level)
+    else:
+        image.save(output_buffer, format='PNG', optimize=optimize)
+    return output_buffer.getvalue()
+
+
+def encode_image(image: Image.Image, output_format: str = "png", compress_level: Optional[int] = None) -> bytes:
+    """按输出格式(png / tiff)编码,TIFF 不压缩"""
+    if output_format == "tiff":
+        output_buffer = io.BytesIO()
+        image.save(output_buffer, format='TIFF')
+        return output_buffer.getvalue()
+    return encode_png(image, compress_level=compress_level)
+
+
+async def image_loader(upload: Optional[UploadFile], digest: Optional[str],
+                       field: str) -> Tuple[Callable[[str], Image.Image], int]:
+    """
+    返回 (图片解码函数 mode -> PIL Image, 像素数)
+    解码函数在流水线解码阶段调用;像素数只读取文件头得到,用于估算请求成本
+
+    提供哈希时从上传存储读取(解码结果有缓存),否则读取本次上传的文件
+    """
+    if digest:
+        try:
+            pixels = upload_store.image_pixels(digest)
+        except UploadNotFoundError:
+            raise HTTPException(
+                status_code=404,
+                detail=f"未找到哈希为 {digest} 的上传,请先 PUT /api/uploads/{digest}",
+                headers={"X-Upload-Missing": digest}
+            )
+        return (lambda mode: upload_store.load_image(digest, mode)), pixels
+    if upload is None:
+        raise HTTPException(status_code=400, detail=f"请上传 {field} 或提供 {field}_hash")
+    if upload.content_type and not upload.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail=f"{field} 必须是图片文件")
+    data = await upload.read()
+    return (lambda mode: decode_image(data, mode)), image_pixels(data)
+
+
+def _upload_missing(e: UploadNotFoundError) -> HTTPException:
+    """上传在读取前被淘汰,客户端需要重新 PUT"""
+    digest = e.args[0]
+    return HTTPException(
+        status_code=404,
+        detail=f"哈希为 {digest} 的上传已过期,请重新上传",
+        headers={"X-Upload-Missing": digest}
+    )
+
+
+# 渐进式预览的最长边(像素):预览只用于首屏显示,不需要完整输出分辨率
+PREVIEW_MAX_SIDE = int(os.environ.get("PREVIEW_MAX_SIDE", "1024"))
+
+
+def encode_preview(image: Image.Image, scale: float) -> Tuple[bytes, Tuple[int, int]]:
+    """
+    生成超分预览:双三次插值放大到输出尺寸(最长边不超过 PREVIEW_MAX_SIDE),编码为 JPEG
+
+    Returns:
+        (JPEG 字节, 预览尺寸)
+    """
+    width, height = image.size
+    ratio = min(scale, PREVIEW_MAX_SIDE / max(width, height))
+    size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+    preview = image.resize(size, Image.BICUBIC) if size != image.size else image
+    output_buffer = io.BytesIO()
+    preview.save(output_buffer, format='JPEG', quality=80)
+    return output_buffer.getvalue(), size
+
+
+# 批量接口单次请求的最大图片数与同时在途的图片数
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "200"))
+BATCH_MAX_INFLIGHT = int(os.environ.get("BATCH_MAX_INFLIGHT", "4"))
+# 压缩包中单个文件与所有文件解压后的大小上限(防止压缩炸弹占满内存)
+BATCH_MAX_ENTRY_BYTES = parse_size(os.environ.get("BATCH_MAX_ENTRY_BYTES", "256M"))
+BATCH_MAX_ARCHIVE_BYTES = parse_size(os.environ.get("BATCH_MAX_ARCHIVE_BYTES", "2G"))
+
+
+def read_archive(archive: UploadFile):
+    """逐个读取上传压缩包中的图片 (文件名, 内容, 错误),带解压大小上限;阻塞读取,需在线程池中迭代"""
+    return iter_archive(archive.file, archive.filename or "", BATCH_MAX_ENTRY_BYTES, BATCH_MAX_ARCHIVE_BYTES)
+
+
 @app.get("/")
 async def root():
     """根路径"""
@@ -106,10 +721,10 @@ async def health_check():
     """健康检查"""
     return {
         "status": "healthy",
-        "model_loaded": model is not None,
+        "model_loaded": _feature_available("upscale"),
         "features": {
-            "upscale": model is not None,
-            "inpaint": inpaint_model is not None
+            "upscale": _feature_available("upscale"),
+            "inpaint": _feature_available("inpaint")
         },
         "device": device_info
     }
@@ -118,128 +733,455 @@ async def health_check():
 @app.get("/api/info")
 async def get_info():
     """获取模型和设备信息"""
+    if worker_pool is not None:
+        return {
+            "device": device_info,
+            "capabilities": DeviceDetector.get_capabilities(),
+            "workers": worker_pool.stats(),
+            "shared_memory": shm_pool.stats() if shm_pool is not None else None,
+            "pipeline": pipeline.stats(),
+            "inpaint_sessions": session_store.stats(),
+            "uploads": upload_store.stats(),
+            "admission": admission.stats(),
+            "degradation": degradation.stats(),
+            "cancellation": cancel_registry.stats(),
+            "profiling": profiling_stats()
+        }
+    
     if model is None:
         raise HTTPException(status_code=503, detail="模型未加载")
     
     return {
         "device": device_info,
-        "model": model.get_info()
+        "capabilities": DeviceDetector.get_capabilities(),
+        "inference_plans": get_plans(),
+        "model": model.get_info(),
+        "face_enhance": get_face_enhancer_info(),
+        "pipeline": pipeline.stats(),
+        "inpaint_sessions": session_store.stats(),
+        "uploads": upload_store.stats(),
+        "admission": admission.stats(),
+        "degradation": {
+            **degradation.stats(),
+            "models": {op: fast.get_info() for op, fast in fast_models.items()}
+        },
+        "cancellation": cancel_registry.stats(),
+        "profiling": profiling_stats()
     }
 
 
+@app.get("/api/queue")
+async def get_queue(request: Request):
+    """当前客户端的排队情况:排队位置、预计等待时间与剩余预算"""
+    return admission.status(client_id(request))
+
+
+def profiling_stats() -> dict:
+    return {
+        "sample_rate": profiling_policy.sample_rate,
+        "on_request": bool(profiling_policy.token),
+        **trace_store.stats(),
+    }
+
+
+@app.get("/api/profiles")
+async def list_profiles(request: Request):
+    """列出保存的性能剖析 trace(需要 X-Profile 授权头)"""
+    if not profiling_policy.authorized(request.headers.get("X-Profile")):
+        raise HTTPException(status_code=403, detail="需要 X-Profile 授权")
+    return {"profiles": trace_store.list()}
+
+
+@app.get("/api/profiles/{trace_id}")
+async def download_profile(trace_id: str, request: Request):
+    """
+    下载性能剖析 trace(Chrome trace JSON,可用 chrome://tracing 或 https://ui.perfetto.dev 打开)
+    trace ID 见被采集请求的 X-Profile-Id 响应头,需要 X-Profile 授权头
+    """
+    if not profiling_policy.authorized(request.headers.get("X-Profile")):
+        raise HTTPException(status_code=403, detail="需要 X-Profile 授权")
+    path = trace_store.path(trace_id) if is_valid_trace_id(trace_id) else None
+    if path is None or not path.exists():
+        raise HTTPException(status_code=404, detail="trace 不存在或已被淘汰")
+    return FileResponse(path, media_type="application/json", filename=f"{trace_id}.json")
+
+
+@app.delete("/api/requests/{request_id}")
+async def cancel_request(request_id: str, request: Request):
+    """
+    取消进行中的请求(请求需带 X-Request-ID 头,只能取消同一客户端的请求)
+    排队中的请求直接退出队列,推理中的请求在下一个瓦片之前停止,被取消的请求返回 499
+    """
+    token = cancel_registry.cancel(client_id(request), request_id)
+    if token is None:
+        raise HTTPException(status_code=404, detail="请求不存在或已完成")
+    return {"cancelled": True, "stage": token.stage}
+
+
+@app.head("/api/uploads/{digest}")
+async def head_upload(digest: str):
+    """查询哈希对应的图片是否已上传:已上传返回 200,否则 404"""
+    if not is_valid_digest(digest):
+        raise HTTPException(status_code=400, detail="哈希必须是 64 位小写十六进制 SHA-256")
+    try:
+        size = upload_store.size(digest)
+    except UploadNotFoundError:
+        return Response(status_code=404)
+    return Response(status_code=200, headers={"Content-Length": str(size)})
+
+
+@app.put("/api/uploads/{digest}")
+async def put_upload(digest: str, request: Request):
+    """
+    按 SHA-256 上传图片(请求体为图片原始字节)
+
+    服务端校验内容哈希,之后的 upscale / inpaint 请求可以用 *_hash 字段引用该图片。
+    新保存返回 201,已存在返回 200
+    """
+    if not is_valid_digest(digest):
+        raise HTTPException(status_code=400, detail="哈希必须是 64 位小写十六进制 SHA-256")
+    if upload_store.contains(digest):
+        return JSONResponse({"sha256": digest, "size": upload_store.size(digest)}, status_code=200)
+
+    # 声明的长度超过上限时直接拒绝,不读取请求体
+    length = request.headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > upload_store.max_bytes:
+        raise HTTPException(
+            status_code=413, detail=f"文件超过上传存储上限 {upload_store.max_bytes / 1024 ** 2:.0f}MB"
+        )
+
+    # 边接收边写入磁盘,累计字节数超过上限时立即中止
+    upload = await run_in_threadpool(upload_store.begin, digest)
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                await run_in_threadpool(upload.write, chunk)
+        upload.close()
+        try:
+            # 只读取文件头,确认是可识别的图片
+            with Image.open(upload.path):
+                pass
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"无法识别图片格式: {e}")
+        created = await run_in_threadpool(upload.commit)
+    except DigestMismatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except MemoryError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    finally:
+        await run_in_threadpool(upload.abort)
+    print(f"✓ 上传 {digest[:12]}: {upload.size} bytes")
+    return JSONResponse({"sha256": digest, "size": upload.size}, status_code=201 if created else 200)
+
+
 @app.post("/api/upscale")
 async def upscale_image(
-    file: UploadFile = File(..., description="要放大的图片文件"),
-    scale: int = 4
+    request: Request,
+    file: UploadFile = File(None, description="要放大的图片文件"),
+    file_hash: str = Form(None, description="已通过 /api/uploads 上传的图片 SHA-256,代替 file"),
+    scale: int = 4,
+    face_enhance: bool = False,
+    roi: str = None,
+    large: Optional[bool] = None,
+    output_format: str = "png",
+    quality: str = "auto",
+    keep_alpha: bool = True
 ):
     """
     图像超分辨率（4x 放大）
     
     Args:
         file: 上传的图片文件（支持 PNG, JPG, WEBP 等格式）
+        file_hash: 已上传图片的 SHA-256（与 file 二选一）
         scale: 放大倍数（默认 4，当前仅支持 4）
+        face_enhance: 对人脸区域做 GFPGAN 增强（默认关闭）
+        roi: 只放大原图中的区域 "x,y,宽,高"(超出图片的部分会被裁掉),只推理与其相交的瓦片
+        large: 大图模式(输出写入磁盘画布并流式编码,只支持 scale=4);默认在输出超过 LARGE_IMAGE_THRESHOLD 时自动启用
+        output_format: 输出格式 png / tiff(TIFF 不压缩,编码快但文件大)
+        quality: 质量档位 auto(负载高时降级,默认)/ full(不降级)/ fast(总是使用降级档位)
+        keep_alpha: 保留透明通道(默认开启):模型只推理 RGB,alpha 用引导滤波放大,完全透明的瓦片不推理;
+                    大图模式不支持,输出 RGB
     
     Returns:
-        放大后的图片（PNG 格式）
+        放大后的图片（指定 roi 时只有该区域,实际区域见 X-ROI;保留透明通道时为 RGBA,见 X-Alpha）;
+        排队信息见 X-Queue-Position / X-Estimated-Wait / X-Queue-Wait,
+        人脸增强结果见 X-Face-Enhance / X-Face-Count / X-Face-Time,
+        质量档位见 X-Quality-Tier / X-Degrade-Reason
     """
-    if model is None:
+    if not _feature_available("upscale"):
         raise HTTPException(status_code=503, detail="模型未加载")
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的输出格式: {output_format},可选: {list(OUTPUT_FORMATS)}")
     
-    # 验证文件类型
-    if not file.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail="文件类型必须是图片")
-    
+    region = parse_roi(roi)
+    load, pixels = await image_loader(file, file_hash, "file")
+    if large is None:
+        large = region is None and not face_enhance and scale == LARGE_IMAGE_SCALE \
+            and pixels * scale * scale * 3 > LARGE_IMAGE_THRESHOLD
+    elif large and (region is not None or face_enhance):
+        raise HTTPException(status_code=400, detail="大图模式不支持 roi 与 face_enhance")
+    elif large and scale != LARGE_IMAGE_SCALE:
+        raise HTTPException(status_code=400, detail=f"大图模式只支持 scale={LARGE_IMAGE_SCALE}")
+    if region is not None:
+        # 成本按 ROI 面积估算(文件头无法识别时 pixels 为 0)
+        pixels = min(pixels, region[2] * region[3]) if pixels else region[2] * region[3]
+    tier = choose_tier(quality)
+    if large:
+        # 大图模式按默认模型的原生倍数写入画布,降级时仍使用默认模型,只降低编码设置
+        tier = degradation.encode_only(tier)
+    ticket = admit(request, tier.op("upscale"), pixels)
+    trace = start_trace(request, "upscale")
+
+    def decode():
+        if keep_alpha and not large:
+            image = load('RGBA')
+            if image.getextrema()[3] == (255, 255):
+                image = image.convert('RGB')  # 完全不透明,按 RGB 处理
+        else:
+            image = load('RGB')
+        return image, clip_region(image, region) if region is not None else None
+
+    # 大图模式:推理结果写入磁盘画布,编码阶段从画布流式写出到文件,响应直接发送文件
+    canvases: List[DiskCanvas] = []
+    encoded_path = os.path.join(LARGE_IMAGE_DIR, f"upscale-{uuid.uuid4().hex}.{output_format}")
+
+    async def infer_large(decoded):
+        width, height = decoded[0].size
+        canvas = DiskCanvas.create(LARGE_IMAGE_DIR, (height * scale, width * scale, 3))
+        canvases.append(canvas)
+        device = await run_upscale_large(decoded[0], scale, canvas, cancel, trace)
+        return canvas, device, None
+
     try:
-        # 读取图片
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        
-        # 转换为 RGB（如果是 RGBA 或其他格式）
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        original_size = image.size
-        print(f"📥 收到图片: {original_size[0]}x{original_size[1]}")
-        
-        # 记录开始时间
-        start_time = time.time()
-        
-        # 执行超分辨率
-        print(f"🔄 开始处理...")
-        output_image = model.enhance(image, outscale=scale)
+        # 解码、推理、编码分别在流水线的三个阶段执行
+        async with cancellation(request) as cancel:
+            if large:
+                result = await run_admitted(
+                    ticket, "upscale", cancel, trace,
+                    decode=decode,
+                    infer=infer_large,
+                    encode=lambda output: encode_canvas(output[0], encoded_path, output_format,
+                                                        tier.png_compress_level),
+                )
+            else:
+                result = await run_admitted(
+                    ticket, "upscale", cancel, trace,
+                    decode=decode,
+                    infer=lambda decoded: run_upscale(decoded[0], scale, face_enhance, cancel, trace,
+                                                      decoded[1], tier.tier),
+                    encode=lambda output: encode_image(output[0], output_format, tier.png_compress_level),
+                )
+        output_image, device, face = result.output
+        profile_headers = await save_trace(trace, result)
+        original_size = result.decoded[0].size
+        clipped = result.decoded[1]
+        output_size = (output_image.shape[1], output_image.shape[0]) if large else output_image.size
+        process_time = result.timings["infer"]
         
-        # 计算处理时间
-        process_time = time.time() - start_time
-        output_size = output_image.size
-        
-        print(f"✓ 处理完成: {output_size[0]}x{output_size[1]} (耗时 {process_time:.2f}秒)")
-        
-        # 转换为字节流
-        output_buffer = io.BytesIO()
-        output_image.save(output_buffer, format='PNG', optimize=True)
-        output_buffer.seek(0)
+        print(f"✓ 处理完成: {original_size[0]}x{original_size[1]} -> {output_size[0]}x{output_size[1]} "
+              f"(推理 {process_time:.2f}秒, 解码 {result.timings['decode']:.2f}秒, 编码 {result.timings['encode']:.2f}秒)"
+              f"{' [大图模式]' if large else ''}{' [降级: ' + tier.reason + ']' if tier.degraded else ''}")
+        if clipped is not None:
+            print(f"   ROI: {clipped[2]}x{clipped[3]} @ ({clipped[0]}, {clipped[1]})")
+        if face is not None and face.get("faces"):
+            print(f"   人脸增强: {face['faces']} 张 (检测 {face['detect']:.2f}秒, "
+                  f"修复 {face['restore']:.2f}秒, 贴回 {face['paste']:.2f}秒)")
+
+        headers = {
+            "X-Process-Time": f"{process_time:.2f}",
+            "X-Original-Size": f"{original_size[0]}x{original_size[1]}",
+            "X-Output-Size": f"{output_size[0]}x{output_size[1]}",
+            "X-Device": device,
+            **({"X-ROI": ",".join(map(str, clipped))} if clipped is not None else {}),
+            **({"X-Large-Image": "disk"} if large else {}),
+            **({"X-Alpha": "guided"} if not large and output_image.mode == "RGBA" else {}),
+            **tier.headers(),
+            **face_headers(face),
+            **profile_headers,
+            **ticket.headers()
+        }
+        if large:
+            # 文件发送完成后删除
+            return FileResponse(
+                encoded_path, media_type=OUTPUT_FORMATS[output_format], headers=headers,
+                background=BackgroundTask(_remove_file, encoded_path)
+            )
         
         # 返回图片
-        return Response(
-            content=output_buffer.getvalue(),
-            media_type="image/png",
-            headers={
-                "X-Process-Time": f"{process_time:.2f}",
-                "X-Original-Size": f"{original_size[0]}x{original_size[1]}",
-                "X-Output-Size": f"{output_size[0]}x{output_size[1]}",
-                "X-Device": device_info['type']
-            }
-        )
+        return Response(content=result.encoded, media_type=OUTPUT_FORMATS[output_format], headers=headers)
     
+    except ImageDecodeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadNotFoundError as e:
+        raise _upload_missing(e)
+    except NoCapableWorkerError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except RequestCancelled as e:
+        _remove_file(encoded_path)
+        raise _cancelled(e)
     except Exception as e:
+        _remove_file(encoded_path)
         print(f"❌ 处理失败: {e}")
         # 清理 CUDA 缓存
-        if torch.cuda.is_available():
+        if torch is not None and torch.cuda.is_available():
             torch.cuda.empty_cache()
             gc.collect()
         raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
+    finally:
+        # 画布只在推理与编码之间使用
+        for canvas in canvases:
+            canvas.delete()
+
+
+def _remove_file(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+@app.post("/api/upscale/progressive")
+async def upscale_progressive(
+    request: Request,
+    file: UploadFile = File(None, description="要放大的图片文件"),
+    file_hash: str = Form(None, description="已通过 /api/uploads 上传的图片 SHA-256,代替 file"),
+    scale: int = 4,
+    face_enhance: bool = False,
+    quality: str = "auto"
+):
+    """
+    渐进式图像超分辨率
+
+    以 multipart/mixed 流式返回两个分段(分段头 X-Stage 区分):
+    1. preview: 解码后立即发送的双三次插值预览(JPEG),不等待模型推理
+    2. final: 模型推理完成后的完整结果(PNG)
+    处理失败时最后一个分段为 application/json 的错误信息
+    quality 与 /api/upscale 相同,质量档位见响应头 X-Quality-Tier
+    """
+    if not _feature_available("upscale"):
+        raise HTTPException(status_code=503, detail="模型未加载")
+
+    load, pixels = await image_loader(file, file_hash, "file")
+    tier = choose_tier(quality)
+    ticket = admit(request, tier.op("upscale"), pixels)
+    events: asyncio.Queue = asyncio.Queue()
+
+    def decode():
+        image = load('RGB')
+        return image, encode_preview(image, scale)
+
+    async def produce():
+        try:
+            async with cancellation(request) as cancel:
+                result = await run_admitted(
+                    ticket, "upscale", cancel,
+                    decode=decode,
+                    infer=lambda decoded: run_upscale(decoded[0], scale, face_enhance, cancel, tier=tier.tier),
+                    encode=lambda output: encode_png(output[0], compress_level=tier.png_compress_level),
+                    on_decoded=lambda decoded: events.put_nowait(("preview", decoded)),
+                )
+            events.put_nowait(("final", result))
+        except Exception as e:
+            events.put_nowait(("error", e))
+
+    task = asyncio.create_task(produce())
+
+    # 解码失败时直接返回 400,而不是 200 + 错误分段
+    kind, value = await events.get()
+    if kind == "error":
+        if isinstance(value, ImageDecodeError):
+            raise HTTPException(status_code=400, detail=str(value))
+        if isinstance(value, UploadNotFoundError):
+            raise _upload_missing(value)
+        if isinstance(value, NoCapableWorkerError):
+            raise HTTPException(status_code=413, detail=str(value))
+        if isinstance(value, RequestCancelled):
+            raise _cancelled(value)
+        raise HTTPException(status_code=500, detail=f"处理失败: {value}")
+
+    writer = MultipartWriter()
+
+    async def body():
+        try:
+            image, (preview_bytes, preview_size) = value
+            width, height = image.size
+            output_size = (int(width * scale), int(height * scale))
+            yield writer.part({
+                "X-Stage": "preview",
+                "Content-Type": "image/jpeg",
+                "X-Preview-Size": f"{preview_size[0]}x{preview_size[1]}",
+                "X-Output-Size": f"{output_size[0]}x{output_size[1]}",
+            }, preview_bytes)
+
+            kind, result = await events.get()
+            if kind == "error":
+                print(f"❌ 处理失败: {result}")
+                yield writer.part({"X-Stage": "error", "Content-Type": "application/json"},
+                                  JSONResponse({"error": str(result)}).body)
+            else:
+                output_image, device, face = result.output
+                print(f"✓ 渐进式处理完成: {output_image.size[0]}x{output_image.size[1]} "
+                      f"(推理 {result.timings['infer']:.2f}秒)")
+                yield writer.part({
+                    "X-Stage": "final",
+                    "Content-Type": "image/png",
+                    "X-Process-Time": f"{result.timings['infer']:.2f}",
+                    "X-Original-Size": f"{width}x{height}",
+                    "X-Output-Size": f"{output_image.size[0]}x{output_image.size[1]}",
+                    "X-Device": device,
+                    **face_headers(face),
+                }, result.encoded)
+            yield writer.close()
+        finally:
+            # 客户端提前断开时不再等待结果
+            task.cancel()
+
+    # 预览在放行并解码后才发送,此时排队信息已确定
+    return StreamingResponse(body(), media_type=writer.content_type,
+                             headers={**tier.headers(), **ticket.headers()})
 
 
 @app.post("/api/upscale-info")
-async def upscale_with_info(file: UploadFile = File(...)):
+async def upscale_with_info(request: Request, file: UploadFile = File(...), face_enhance: bool = False):
     """
     图像超分辨率（带详细信息）
     返回 JSON 格式，包含 base64 编码的图片和处理信息
     """
-    if model is None:
+    if not _feature_available("upscale"):
         raise HTTPException(status_code=503, detail="模型未加载")
     
+    contents = await file.read()
+    ticket = admit(request, "upscale", image_pixels(contents))
+    
     try:
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        original_size = image.size
-        start_time = time.time()
-        
-        output_image = model.enhance(image, outscale=4)
-        process_time = time.time() - start_time
-        
-        # 转换为 base64
-        output_buffer = io.BytesIO()
-        output_image.save(output_buffer, format='PNG')
-        
         import base64
-        img_base64 = base64.b64encode(output_buffer.getvalue()).decode()
+        async with cancellation(request) as cancel:
+            result = await run_admitted(
+                ticket, "upscale", cancel,
+                decode=lambda: decode_image(contents, 'RGB'),
+                infer=lambda image: run_upscale(image, 4, face_enhance, cancel),
+                encode=lambda output: base64.b64encode(encode_png(output[0], optimize=False)).decode(),
+            )
+        output_image, device, face = result.output
         
         return JSONResponse({
             "success": True,
-            "image": f"data:image/png;base64,{img_base64}",
+            "image": f"data:image/png;base64,{result.encoded}",
             "info": {
-                "original_size": original_size,
+                "original_size": result.decoded.size,
                 "output_size": output_image.size,
-                "process_time": round(process_time, 2),
-                "device": device_info['type']
+                "process_time": round(result.timings["infer"], 2),
+                "queue_wait": round(ticket.waited, 2),
+                "device": device,
+                "face_enhance": face
             }
         })
     
+    except RequestCancelled as e:
+        return JSONResponse({
+            "success": False,
+            "error": str(e)
+        }, status_code=STATUS_CLIENT_CLOSED)
     except Exception as e:
         return JSONResponse({
             "success": False,
@@ -249,8 +1191,11 @@ async def upscale_with_info(file: UploadFile = File(...)):
 
 @app.post("/api/inpaint")
 async def inpaint_image(
-    image: UploadFile = File(..., description="原始图片"),
-    mask: UploadFile = File(..., description="遮罩图片,白色=需要修复的区域")
+    request: Request,
+    image: UploadFile = File(None, description="原始图片"),
+    mask: UploadFile = File(..., description="遮罩图片,白色=需要修复的区域"),
+    image_hash: str = Form(None, description="已通过 /api/uploads 上传的图片 SHA-256,代替 image"),
+    quality: str = "auto"
 ):
     """
     图像 Inpaint(智能消除/修复)
@@ -258,133 +1203,80 @@ async def inpaint_image(
     Args:
         image: 原始图片文件
         mask: 遮罩图片文件(白色部分会被修复)
+        image_hash: 已上传图片的 SHA-256(与 image 二选一)
+        quality: 质量档位 auto(负载高时降级,默认)/ full(不降级)/ fast(总是使用降级档位)
     
     Returns:
-        修复后的图片(PNG 格式)
+        修复后的图片(PNG 格式);质量档位见 X-Quality-Tier / X-Degrade-Reason
     """
-    if inpaint_model is None:
+    if not _feature_available("inpaint"):
         raise HTTPException(
             status_code=503, 
             detail="Inpaint 模型未加载,功能不可用"
         )
     
     # 验证文件类型
-    if not image.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail="image 必须是图片文件")
     if not mask.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="mask 必须是图片文件")
+    load, pixels = await image_loader(image, image_hash, "image")
     
     try:
-        # 读取图片
-        image_bytes = await image.read()
         mask_bytes = await mask.read()
-        
-        print(f"📊 接收到的数据: image={len(image_bytes)} bytes, mask={len(mask_bytes)} bytes")
-        print(f"   Content-Type: image={image.content_type}, mask={mask.content_type}")
+        print(f"📊 接收到的数据: image={'hash ' + image_hash[:12] if image_hash else 'upload'}, mask={len(mask_bytes)} bytes")
         
         # 检查数据是否为空
-        if len(image_bytes) == 0:
-            raise HTTPException(status_code=400, detail="image 文件为空")
         if len(mask_bytes) == 0:
             raise HTTPException(status_code=400, detail="mask 文件为空")
         
-        # 尝试打开图片
-        try:
-            image_pil = Image.open(io.BytesIO(image_bytes))
-            # 验证图片是否有效
-            image_pil.load()
-        except Exception as e:
-            print(f"❌ PIL 无法打开 image: {e}")
-            # 尝试强制转换
-            try:
-                print(f"   尝试强制解析图片...")
-                from io import BytesIO
-                img_data = BytesIO(image_bytes)
-                img_data.seek(0)
-                image_pil = Image.open(img_data)
-                # 强制加载并转换为 RGB
-                image_pil = image_pil.convert('RGB')
-                print(f"   强制解析成功")
-            except Exception as e2:
-                print(f"❌ 强制解析失败: {e2}")
-                # 尝试使用 OpenCV 作为备用
-                try:
-                    print(f"   尝试使用 OpenCV 解析...")
-                    import cv2
-                    import numpy as np
-                    nparr = np.frombuffer(image_bytes, np.uint8)
-                    img_cv = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                    if img_cv is not None:
-                        # OpenCV 读取的是 BGR，转换为 RGB
-                        img_rgb = cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB)
-                        image_pil = Image.fromarray(img_rgb)
-                        print(f"   OpenCV 解析成功: {image_pil.size}")
-                    else:
-                        raise Exception("OpenCV 解码返回 None")
-                except Exception as e3:
-                    print(f"❌ OpenCV 解析也失败: {e3}")
-                    # 打印原始数据的前几个字节用于调试
-                    print(f"   数据头部: {image_bytes[:20].hex() if len(image_bytes) > 20 else image_bytes.hex()}")
-                    raise HTTPException(status_code=400, detail=f"无法识别 image 文件格式，请尝试转换为 PNG 或 JPG 格式后重试。原始错误: {str(e)}")
-        
-        try:
-            mask_pil = Image.open(io.BytesIO(mask_bytes))
-            mask_pil.load()
-        except Exception as e:
-            print(f"❌ 无法打开 mask: {e}")
-            raise HTTPException(status_code=400, detail=f"无法识别 mask 文件格式: {str(e)}")
-        
-        # 转换格式
-        if image_pil.mode != 'RGB':
-            image_pil = image_pil.convert('RGB')
-        if mask_pil.mode != 'L':  # 遮罩转灰度
-            mask_pil = mask_pil.convert('L')
-        
-        # CRITICAL: 确保 mask 和 image 尺寸完全一致
-        # 如果尺寸不同,将 mask 调整为与 image 相同的尺寸
-        if mask_pil.size != image_pil.size:
-            print(f"⚠️  Mask 尺寸 {mask_pil.size} 与 Image 尺寸 {image_pil.size} 不一致,自动调整...")
-            mask_pil = mask_pil.resize(image_pil.size, Image.LANCZOS)
-            print(f"✓ Mask 已调整为 {mask_pil.size}")
-        
-        original_size = image_pil.size
-        print(f"📥 收到 Inpaint 请求: {original_size[0]}x{original_size[1]}")
-        
-        # 记录开始时间
-        start_time = time.time()
-        
-        # 执行 Inpaint
-        print(f"🔄 开始 Inpaint 处理...")
-        result_image = inpaint_model.inpaint(image_pil, mask_pil)
-        
-        # 计算处理时间
-        process_time = time.time() - start_time
-        print(f"✓ Inpaint 完成 (耗时 {process_time:.2f}秒)")
-        
-        # 转换为字节流
-        output_buffer = io.BytesIO()
-        result_image.save(output_buffer, format='PNG', optimize=True)
-        output_buffer.seek(0)
+        tier = choose_tier(quality)
+        ticket = admit(request, tier.op("inpaint"), pixels)
+        trace = start_trace(request, "inpaint")
+        # 解码、推理、编码分别在流水线的三个阶段执行
+        async with cancellation(request) as cancel:
+            result = await run_admitted(
+                ticket, "inpaint", cancel, trace,
+                decode=lambda: decode_image_and_mask(load('RGB'), mask_bytes),
+                infer=lambda decoded: run_inpaint(*decoded, cancel, trace, tier.tier),
+                encode=lambda output: encode_png(output[0], compress_level=tier.png_compress_level),
+            )
+        result_image, device = result.output
+        profile_headers = await save_trace(trace, result)
+        original_size = result.decoded[0].size
+        process_time = result.timings["infer"]
+        print(f"✓ Inpaint 完成: {original_size[0]}x{original_size[1]} "
+              f"(推理 {process_time:.2f}秒, 解码 {result.timings['decode']:.2f}秒, 编码 {result.timings['encode']:.2f}秒)"
+              f"{' [降级: ' + tier.reason + ']' if tier.degraded else ''}")
         
         # 返回图片
         return Response(
-            content=output_buffer.getvalue(),
+            content=result.encoded,
             media_type="image/png",
             headers={
                 "X-Process-Time": f"{process_time:.2f}",
                 "X-Image-Size": f"{original_size[0]}x{original_size[1]}",
-                "X-Device": inpaint_model.actual_device
+                "X-Device": device,
+                **tier.headers(),
+                **profile_headers,
+                **ticket.headers()
             }
         )
         
     except HTTPException:
         raise
+    except ImageDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"{e}，请尝试转换为 PNG 或 JPG 格式后重试")
+    except UploadNotFoundError as e:
+        raise _upload_missing(e)
+    except NoCapableWorkerError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except RequestCancelled as e:
+        raise _cancelled(e)
     except Exception as e:
         print(f"❌ Inpaint 处理失败: {e}")
         import traceback
         traceback.print_exc()
         # 清理 CUDA 缓存
-        if torch.cuda.is_available():
+        if torch is not None and torch.cuda.is_available():
             torch.cuda.empty_cache()
             gc.collect()
         raise HTTPException(
@@ -393,13 +1285,450 @@ async def inpaint_image(
         )
 
 
+@app.post("/api/inpaint-upscale")
+async def inpaint_upscale_image(
+    request: Request,
+    image: UploadFile = File(None, description="原始图片"),
+    mask: UploadFile = File(..., description="遮罩图片,白色=需要修复的区域"),
+    image_hash: str = Form(None, description="已通过 /api/uploads 上传的图片 SHA-256,代替 image"),
+    scale: int = 4,
+    face_enhance: bool = False,
+    quality: str = "auto"
+):
+    """
+    Inpaint 后直接超分(一次请求完成两步)
+
+    修复结果留在服务端内存中直接送入超分,不经过中间结果的 PNG 编码、传输与再次解码;
+    两个推理步骤分别占用流水线的 inpaint / upscale 阶段,与其他请求交错执行
+
+    Args:
+        image: 原始图片文件
+        mask: 遮罩图片文件(白色部分会被修复)
+        image_hash: 已上传图片的 SHA-256(与 image 二选一)
+        scale: 放大倍数(默认 4)
+        face_enhance: 超分后对人脸区域做 GFPGAN 增强(默认关闭)
+        quality: 质量档位 auto / full / fast,降级时两个步骤都使用轻量模型
+
+    Returns:
+        修复并放大后的图片(PNG 格式);各阶段耗时见 Server-Timing 与 X-Stage-Timings
+    """
+    for op in ("inpaint", "upscale"):
+        if not _feature_available(op):
+            raise HTTPException(status_code=503, detail=f"{op} 模型未加载,功能不可用")
+
+    if not mask.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="mask 必须是图片文件")
+    load, pixels = await image_loader(image, image_hash, "image")
+    mask_bytes = await mask.read()
+    if len(mask_bytes) == 0:
+        raise HTTPException(status_code=400, detail="mask 文件为空")
+
+    tier = choose_tier(quality)
+    ticket = admit(request, tier.op("inpaint+upscale"), pixels)
+    trace = start_trace(request, "inpaint+upscale")
+    devices: List[str] = []
+
+    async def inpaint(decoded):
+        output, device = await run_inpaint(*decoded, cancel, trace, tier.tier)
+        devices.append(device)
+        return output
+
+    async def upscale(inpainted):
+        output, device, face = await run_upscale(inpainted, scale, face_enhance, cancel, trace, tier=tier.tier)
+        devices.append(device)
+        return output, face
+
+    try:
+        async with cancellation(request) as cancel:
+            result = await run_admitted(
+                ticket, ["inpaint", "upscale"], cancel, trace,
+                decode=lambda: decode_image_and_mask(load('RGB'), mask_bytes),
+                infer=[inpaint, upscale],
+                encode=lambda output: encode_png(output[0], compress_level=tier.png_compress_level),
+            )
+        output_image, face = result.output
+        profile_headers = await save_trace(trace, result)
+        original_size = result.decoded[0].size
+        output_size = output_image.size
+        timings = result.timings
+        print(f"✓ Inpaint + 超分完成: {original_size[0]}x{original_size[1]} -> {output_size[0]}x{output_size[1]} "
+              f"(修复 {timings['inpaint']:.2f}秒, 超分 {timings['upscale']:.2f}秒, "
+              f"解码 {timings['decode']:.2f}秒, 编码 {timings['encode']:.2f}秒)")
+
+        return Response(
+            content=result.encoded,
+            media_type="image/png",
+            headers={
+                "X-Process-Time": f"{timings['infer']:.2f}",
+                "X-Stage-Timings": ", ".join(
+                    f"{name}={timings[name]:.3f}" for name in ("decode", "inpaint", "upscale", "encode")
+                ),
+                "Server-Timing": server_timing(result, ticket),
+                "X-Original-Size": f"{original_size[0]}x{original_size[1]}",
+                "X-Output-Size": f"{output_size[0]}x{output_size[1]}",
+                "X-Device": ", ".join(devices),
+                **tier.headers(),
+                **face_headers(face),
+                **profile_headers,
+                **ticket.headers()
+            }
+        )
+
+    except ImageDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"{e}，请尝试转换为 PNG 或 JPG 格式后重试")
+    except UploadNotFoundError as e:
+        raise _upload_missing(e)
+    except NoCapableWorkerError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except RequestCancelled as e:
+        raise _cancelled(e)
+    except Exception as e:
+        print(f"❌ Inpaint + 超分处理失败: {e}")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+            gc.collect()
+        raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
+
+
+@app.post("/api/inpaint/session")
+async def create_inpaint_session(
+    image: UploadFile = File(None, description="原始图片"),
+    image_hash: str = Form(None, description="已通过 /api/uploads 上传的图片 SHA-256,代替 image")
+):
+    """
+    创建增量 Inpaint 会话
+
+    服务端保存图片(之后保存每次修复后的最新结果),之后每一笔只需上传新笔画的遮罩
+    到 /api/inpaint/session/{session_id}
+    """
+    if not _feature_available("inpaint"):
+        raise HTTPException(status_code=503, detail="Inpaint 模型未加载,功能不可用")
+
+    load, _ = await image_loader(image, image_hash, "image")
+    loop = asyncio.get_running_loop()
+    try:
+        image_pil = await loop.run_in_executor(None, load, 'RGB')
+        session = session_store.create(np.array(image_pil))
+    except ImageDecodeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadNotFoundError as e:
+        raise _upload_missing(e)
+    except MemoryError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    print(f"✓ 创建 Inpaint 会话 {session.session_id[:8]}: {image_pil.size[0]}x{image_pil.size[1]}")
+    return {
+        "session_id": session.session_id,
+        "width": image_pil.size[0],
+        "height": image_pil.size[1],
+        "ttl": session_store.ttl
+    }
+
+
+@app.post("/api/inpaint/session/{session_id}")
+async def inpaint_session_stroke(
+    request: Request,
+    session_id: str,
+    mask: UploadFile = File(..., description="新笔画的遮罩(增量),白色=需要修复的区域")
+):
+    """
+    增量 Inpaint:只对新笔画周围的区域重新推理,并合成到会话的最新结果上
+
+    遮罩尺寸与图片不同时自动缩放。返回修复区域的 PNG,
+    X-Region 响应头给出该区域在整图中的位置 "x,y,宽,高";遮罩为空时返回 204
+    """
+    try:
+        session = session_store.get(session_id)
+    except SessionNotFoundError:
+        raise HTTPException(status_code=404, detail="会话不存在或已过期")
+
+    mask_bytes = await mask.read()
+
+    # 同一会话的笔画按顺序应用
+    async with session.lock:
+        height, width = session.image.shape[:2]
+
+        def decode():
+            mask_pil = decode_image(mask_bytes, 'L')
+            if mask_pil.size != (width, height):
+                mask_pil = mask_pil.resize((width, height), Image.LANCZOS)
+            mask_np = np.array(mask_pil)
+            region = stroke_region(mask_np)
+            if region is None:
+                return None
+            x0, y0, x1, y1 = region
+            return region, Image.fromarray(session.image[y0:y1, x0:x1]), mask_np[y0:y1, x0:x1]
+
+        async def infer(decoded):
+            _, crop, crop_mask = decoded
+            output_image, device = await run_inpaint(crop, Image.fromarray(crop_mask), cancel)
+            return decoded, output_image, device
+
+        def encode(output):
+            ((x0, y0, x1, y1), crop, crop_mask), output_image, _ = output
+            patch = composite(np.asarray(crop), np.asarray(output_image), crop_mask)
+            session.image[y0:y1, x0:x1] = patch
+            return encode_png(Image.fromarray(patch))
+
+        # 遮罩很小,先解码出笔画区域:空遮罩无需排队,成本按区域而不是整图估算
+        loop = asyncio.get_running_loop()
+        try:
+            decoded = await loop.run_in_executor(None, decode)
+        except ImageDecodeError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if decoded is None:
+            return Response(status_code=204)
+        x0, y0, x1, y1 = decoded[0]
+        ticket = admit(request, "inpaint", (x1 - x0) * (y1 - y0))
+
+        try:
+            # 取消发生在编码(合成到会话)之前,会话保持不变
+            async with cancellation(request) as cancel:
+                result = await run_admitted(ticket, "inpaint", cancel,
+                                            decode=lambda: decoded, infer=infer, encode=encode)
+        except NoCapableWorkerError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except RequestCancelled as e:
+            raise _cancelled(e)
+        except Exception as e:
+            print(f"❌ 增量 Inpaint 失败: {e}")
+            raise HTTPException(status_code=500, detail=f"Inpaint 处理失败: {str(e)}")
+        session.strokes += 1
+
+    device = result.output[2]
+    print(f"✓ 增量 Inpaint 完成 (会话 {session_id[:8]} 第 {session.strokes} 笔): "
+          f"区域 {x1 - x0}x{y1 - y0} / 整图 {width}x{height} (推理 {result.timings['infer']:.2f}秒)")
+    return Response(
+        content=result.encoded,
+        media_type="image/png",
+        headers={
+            "X-Region": f"{x0},{y0},{x1 - x0},{y1 - y0}",
+            "X-Image-Size": f"{width}x{height}",
+            "X-Process-Time": f"{result.timings['infer']:.2f}",
+            "X-Device": device,
+            **ticket.headers()
+        }
+    )
+
+
+@app.get("/api/inpaint/session/{session_id}")
+async def get_inpaint_session(session_id: str):
+    """获取会话当前的完整结果(PNG)"""
+    try:
+        session = session_store.get(session_id)
+    except SessionNotFoundError:
+        raise HTTPException(status_code=404, detail="会话不存在或已过期")
+    async with session.lock:
+        image = Image.fromarray(session.image.copy())
+    loop = asyncio.get_running_loop()
+    data = await loop.run_in_executor(None, encode_png, image)
+    return Response(content=data, media_type="image/png")
+
+
+@app.delete("/api/inpaint/session/{session_id}")
+async def delete_inpaint_session(session_id: str):
+    """结束会话,释放服务端保存的图片"""
+    return {"deleted": session_store.delete(session_id)}
+
+
+def _limit_items(items):
+    """限制批量任务的图片数量(压缩包按读取顺序截断前会报错)"""
+    for count, item in enumerate(items):
+        if count >= BATCH_MAX_ITEMS:
+            raise ValueError(f"单次批量最多 {BATCH_MAX_ITEMS} 张图片")
+        yield item
+
+
+async def _stream_batch(request: Request, items, process):
+    """
+    以 multipart/mixed 流式返回批量结果,每张图片完成后立即发送一个分段
+    分段头 X-Index / X-Name 标识对应的输入,失败的图片返回 application/json 分段
+
+    整批共用一个取消令牌,process(item, cancel) 处理单张图片;
+    批量被取消后不再处理剩余图片,最后一个分段为取消信息
+    """
+    writer = MultipartWriter()
+
+    async def body():
+        ok = failed = 0
+        start_time = time.time()
+        try:
+            async with cancellation(request) as cancel:
+                async for item, result, error in run_pipelined(
+                    items, lambda item: process(item, cancel), BATCH_MAX_INFLIGHT
+                ):
+                    if cancel.cancelled:
+                        break
+                    headers = {
+                        "X-Index": str(item.index),
+                        "X-Name": quote(item.name),
+                    }
+                    if error is None:
+                        data, extra_headers = result
+                        ok += 1
+                        headers["Content-Type"] = "image/png"
+                        headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(item.name)}"
+                        headers.update(extra_headers)
+                        yield writer.part(headers, data)
+                    else:
+                        failed += 1
+                        print(f"❌ 批量任务 {item.name} 失败: {error}")
+                        headers["Content-Type"] = "application/json"
+                        yield writer.part(headers, JSONResponse({"error": str(error)}).body)
+                if cancel.cancelled:
+                    print(f"⚠️  批量任务已取消 ({cancel.reason})")
+                    yield writer.part({"Content-Type": "application/json"},
+                                      JSONResponse({"error": f"请求已取消 ({cancel.reason})"}).body)
+        except ValueError as e:
+            # 输入错误(压缩包格式、遮罩配对、数量超限等)作为最后一个分段返回
+            yield writer.part({"Content-Type": "application/json"}, JSONResponse({"error": str(e)}).body)
+        print(f"✓ 批量处理完成: 成功 {ok}, 失败 {failed} (耗时 {time.time() - start_time:.2f}秒)")
+        yield writer.close()
+
+    return StreamingResponse(body(), media_type=writer.content_type)
+
+
+@app.post("/api/upscale/batch")
+async def upscale_batch(
+    request: Request,
+    files: List[UploadFile] = File(None, description="要放大的图片文件(可多个)"),
+    archive: UploadFile = File(None, description="包含图片的 zip / tar 压缩包"),
+    scale: int = 4,
+    face_enhance: bool = False
+):
+    """
+    批量图像超分辨率
+
+    图片可以作为多个 files 字段上传,也可以打包成一个 zip / tar 压缩包。
+    解码、推理和编码在多张图片之间流水线执行,结果以 multipart/mixed 流式返回,
+    每张图片完成后立即发送。
+    """
+    if not _feature_available("upscale"):
+        raise HTTPException(status_code=503, detail="模型未加载")
+    if not files and archive is None:
+        raise HTTPException(status_code=400, detail="请上传 files 或 archive")
+    if files and len(files) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单次批量最多 {BATCH_MAX_ITEMS} 张图片")
+
+    if archive is not None:
+        # 压缩包在线程池中边解压边读取,不阻塞事件循环
+        items = iterate_in_threadpool(_limit_items(
+            BatchItem(index=i, name=name, image=data, error=error)
+            for i, (name, data, error) in enumerate(read_archive(archive))
+        ))
+    else:
+        items = [
+            BatchItem(index=i, name=f.filename or f"image_{i}.png", image=await f.read())
+            for i, f in enumerate(files)
+        ]
+
+    client = client_id(request)
+
+    async def process(item: BatchItem, cancel: CancelToken):
+        # 批量任务超出客户端预算时等待已有图片完成,而不是让单张图片失败
+        ticket = await admission.submit_when_allowed(client, "upscale", image_pixels(item.image))
+        result = await run_admitted(
+            ticket, "upscale", cancel,
+            decode=lambda: decode_image(item.image, 'RGB'),
+            infer=lambda image: run_upscale(image, scale, face_enhance, cancel),
+            encode=lambda output: encode_png(output[0]),
+        )
+        image = result.decoded
+        output_image, device, face = result.output
+        return result.encoded, {
+            "X-Process-Time": f"{result.timings['infer']:.2f}",
+            "X-Original-Size": f"{image.size[0]}x{image.size[1]}",
+            "X-Output-Size": f"{output_image.size[0]}x{output_image.size[1]}",
+            "X-Device": device,
+            **face_headers(face),
+            **ticket.headers(),
+        }
+
+    return await _stream_batch(request, items, process)
+
+
+@app.post("/api/inpaint/batch")
+async def inpaint_batch(
+    request: Request,
+    images: List[UploadFile] = File(None, description="原始图片(可多个)"),
+    masks: List[UploadFile] = File(None, description="遮罩图片,与 images 按顺序一一对应"),
+    archive: UploadFile = File(None, description="zip / tar 压缩包,遮罩命名为 <图片名>_mask.png")
+):
+    """
+    批量图像 Inpaint
+
+    图片与遮罩可以作为 images / masks 字段按顺序上传,也可以打包成压缩包
+    (photo.jpg 对应的遮罩为 photo_mask.png)。结果以 multipart/mixed 流式返回。
+    """
+    if not _feature_available("inpaint"):
+        raise HTTPException(status_code=503, detail="Inpaint 模型未加载,功能不可用")
+
+    if archive is not None:
+        try:
+            items = await run_in_threadpool(lambda: pair_masks(read_archive(archive)))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    elif images and masks:
+        if len(images) != len(masks):
+            raise HTTPException(status_code=400, detail="images 与 masks 数量必须一致")
+        items = [
+            BatchItem(index=i, name=img.filename or f"image_{i}.png",
+                      image=await img.read(), mask=await msk.read())
+            for i, (img, msk) in enumerate(zip(images, masks))
+        ]
+    else:
+        raise HTTPException(status_code=400, detail="请上传 images + masks 或 archive")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单次批量最多 {BATCH_MAX_ITEMS} 张图片")
+
+    client = client_id(request)
+
+    async def process(item: BatchItem, cancel: CancelToken):
+        ticket = await admission.submit_when_allowed(client, "inpaint", image_pixels(item.image))
+        result = await run_admitted(
+            ticket, "inpaint", cancel,
+            decode=lambda: decode_image_and_mask(item.image, item.mask),
+            infer=lambda decoded: run_inpaint(*decoded, cancel),
+            encode=lambda output: encode_png(output[0]),
+        )
+        image_pil = result.decoded[0]
+        _, device = result.output
+        return result.encoded, {
+            "X-Process-Time": f"{result.timings['infer']:.2f}",
+            "X-Image-Size": f"{image_pil.size[0]}x{image_pil.size[1]}",
+            "X-Device": device,
+            **ticket.headers(),
+        }
+
+    return await _stream_batch(request, items, process)
+
+
 if __name__ == "__main__":
     # 直接运行服务
     # 默认端口改为 8888（避免与其他服务冲突）
+    parser = argparse.ArgumentParser(description="Inpaint-Web 后端服务")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8888")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("INPAINT_WORKERS", "0")),
+                        help="推理 Worker 进程数,0 表示在服务进程内推理")
+    parser.add_argument("--devices", default=os.environ.get("INPAINT_WORKER_DEVICES", ""),
+                        help="Worker 设备列表,如 cuda:0,cuda:1 或 cpu")
+    parser.add_argument("--cpu-sets", default=os.environ.get("INPAINT_WORKER_CPUSETS", ""),
+                        help="Worker CPU 核心集合,如 0-3;4-7")
+    parser.add_argument("--worker-memory", default=os.environ.get("INPAINT_WORKER_MEMORY", ""),
+                        help="Worker 内存容量,如 8G,8G(默认自动探测)")
+    args = parser.parse_args()
+    
+    # 通过环境变量传递给 uvicorn 导入的 api_server 模块
+    os.environ["INPAINT_WORKERS"] = str(args.workers)
+    os.environ["INPAINT_WORKER_DEVICES"] = args.devices
+    os.environ["INPAINT_WORKER_CPUSETS"] = args.cpu_sets
+    os.environ["INPAINT_WORKER_MEMORY"] = args.worker_memory
+    
     uvicorn.run(
         "api_server:app",
-        host="0.0.0.0",
-        port=8888,  # 改为 8888，可通过环境变量覆盖
+        host=args.host,
+        port=args.port,
         reload=False,  # 生产环境设为 False
         log_level="info"
     )
@@ -0,0 +1,102 @@
+"""
+Real-ESRGAN CPU 推理模式质量 / 速度检查
+以 fp32 输出为参考,报告各模式的 PSNR 与耗时
+onnx / onnx-int8 模式需要先运行 export_onnx.py [--int8] 导出模型
+
+用法:
+    python cpu_quality_check.py --modes fp32,bf16,onnx,onnx-int8 --threads 8
+    python cpu_quality_check.py --image photo.jpg --size 384 --runs 3
+"""
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+from models.realesrgan_model import RealESRGANModel
+
+DEFAULT_IMAGE = Path(__file__).parent.parent / "public" / "examples" / "bird.jpeg"
+
+
+def psnr(reference: np.ndarray, candidate: np.ndarray) -> float:
+    """计算两张 uint8 图片的 PSNR(dB),完全相同时返回 inf"""
+    diff = reference.astype(np.float64) - candidate.astype(np.float64)
+    mse = np.mean(diff ** 2)
+    if mse == 0:
+        return float("inf")
+    return 10 * np.log10(255.0 ** 2 / mse)
+
+
+def load_test_image(path: Path, size: int) -> Image.Image:
+    """读取测试图片并缩放到最长边为 size"""
+    image = Image.open(path).convert("RGB")
+    image.thumbnail((size, size), Image.LANCZOS)
+    return image
+
+
+def build_model(mode: str, threads: int, tile: int):
+    """按模式创建模型,当前环境不支持该模式时返回 None"""
+    if mode in ("onnx", "onnx-int8"):
+        from models.realesrgan_onnx import RealESRGANONNXModel
+
+        suffix = "_int8" if mode == "onnx-int8" else ""
+        model_path = Path(__file__).parent / "weights" / f"RealESRGAN_x4plus{suffix}.onnx"
+        if not model_path.exists():
+            return None
+        return RealESRGANONNXModel(str(model_path), device="cpu", tile=tile, num_threads=threads)
+
+    model = RealESRGANModel(device=torch.device("cpu"), cpu_mode=mode, cpu_threads=threads, tile=tile)
+    return model if model.cpu_mode == mode else None
+
+
+def benchmark(model, image: Image.Image, runs: int):
+    """预热一次后运行 runs 次,返回 (输出数组, 平均耗时秒)"""
+    output = model.enhance(image)
+    start = time.perf_counter()
+    for _ in range(runs):
+        output = model.enhance(image)
+    return np.asarray(output), (time.perf_counter() - start) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Real-ESRGAN CPU 模式质量检查")
+    parser.add_argument("--image", type=Path, default=DEFAULT_IMAGE, help="测试图片")
+    parser.add_argument("--size", type=int, default=256, help="测试图片最长边")
+    parser.add_argument("--modes", default="fp32,bf16,onnx,onnx-int8", help="待检查的 CPU 模式,逗号分隔")
+    parser.add_argument("--threads", type=int, default=0, help="推理线程数,0 为默认")
+    parser.add_argument("--tile", type=int, default=400, help="瓦片大小")
+    parser.add_argument("--runs", type=int, default=2, help="每个模式的计时次数")
+    parser.add_argument("--min-psnr", type=float, default=40.0, help="低于该 PSNR 视为不合格")
+    args = parser.parse_args()
+
+    image = load_test_image(args.image, args.size)
+    pixels = image.size[0] * image.size[1]
+    print(f"测试图片: {args.image.name} ({image.size[0]}x{image.size[1]})")
+
+    reference, ref_time = benchmark(build_model("fp32", args.threads, args.tile), image, args.runs)
+    print(f"\n{'模式':<12}{'耗时(s)':>10}{'MPix/s':>10}{'加速比':>8}{'PSNR(dB)':>10}")
+    print(f"{'fp32 (参考)':<12}{ref_time:>10.2f}{pixels / 1e6 / ref_time:>10.3f}{1.0:>8.2f}{'-':>10}")
+
+    failed = []
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip() and m.strip() != "fp32"]:
+        model = build_model(mode, args.threads, args.tile)
+        if model is None:
+            print(f"{mode:<12}{'不支持,已跳过':>10}")
+            continue
+        output, elapsed = benchmark(model, image, args.runs)
+        score = psnr(reference, output)
+        print(f"{mode:<12}{elapsed:>10.2f}{pixels / 1e6 / elapsed:>10.3f}"
+              f"{ref_time / elapsed:>8.2f}{score:>10.2f}")
+        if score < args.min_psnr:
+            failed.append(mode)
+
+    if failed:
+        print(f"\n⚠️  以下模式 PSNR 低于 {args.min_psnr}dB: {', '.join(failed)}")
+        raise SystemExit(1)
+    print("\n✓ 所有模式质量检查通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,104 +1,252 @@
+"""
+下载模型权重
+- 多个模型并发下载,以 1MB 大块读写
+- 下载到 <文件名>.part,中断后用 HTTP Range 续传,不再从头开始
+- 下载完成后按清单校验 SHA-256,通过后原子替换到目标位置,并写入 weights/SHA256SUMS
+  供服务启动时校验(见 models/weights.py)
+
+用法:
+    python download_models.py                                # 下载到 backend/weights/
+    python download_models.py --mirror http://127.0.0.1:8000 # 从镜像(或本地测试服务器)按文件名下载
+    python download_models.py --face                         # 同时下载人脸增强模型
+
+环境变量:
+    MODEL_MIRROR  同 --mirror
+"""
+import argparse
+import hashlib
 import os
-import urllib.request
+import sys
+import time
 import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-import time
+from typing import Callable, Dict, List, Optional
+
+CHUNK_SIZE = 1024 * 1024
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+WEIGHTS_DIR = Path(__file__).parent / "weights"
+CHECKSUMS_FILE = "SHA256SUMS"
+
+# 模型清单
+MODELS = [
+    {
+        "name": "RealESRGAN_x4plus.pth",
+        "url": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth",
+        "sha256": "4fa0d38905f75ac06eb49a7951b426670021be3018265fd191d2125df9d682f1",
+    },
+    {
+        "name": "RealESRGAN_x4plus_anime_6B.pth",
+        "url": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.2.4/RealESRGAN_x4plus_anime_6B.pth",
+        "sha256": "f872d837d3c90ed2e05227bed711af5671a6fd1c9f7d7e91c911a61f155e99da",
+    },
+    # LaMa 模型由 simple-lama-inpainting 库自动下载,无需手动下载
+]
+
+# 人脸增强(face_enhance=true)使用的模型,指定 --face 时下载
+FACE_MODELS = [
+    {
+        "name": "GFPGANv1.4.pth",
+        "url": "https://github.com/TencentARC/GFPGAN/releases/download/v1.3.0/GFPGANv1.4.pth",
+        "sha256": None,  # 未固定哈希,下载后记录到 SHA256SUMS
+    },
+]
+
 
-def download_file(url: str, dest_path: Path, max_retries: int = 3):
+class ChecksumMismatchError(ValueError):
+    """下载内容的 SHA-256 与清单不一致"""
+
+
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fetch(url: str, part_path: Path, timeout: float, chunk_size: int,
+           progress: Optional[Callable[[int, int], None]]):
+    """下载到 .part 文件,已有部分内容时从断点续传"""
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    headers = {'User-Agent': USER_AGENT}
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+    req = urllib.request.Request(url, headers=headers)
+
+    try:
+        response = urllib.request.urlopen(req, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 416 and offset:
+            return  # 请求范围超出文件大小:.part 已完整,交给校验
+        raise
+
+    with response:
+        if offset and response.status != 206:
+            offset = 0  # 服务器不支持 Range,重新下载
+        length = int(response.headers.get('Content-Length', 0))
+        total = offset + length if length else 0
+        downloaded = offset
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                downloaded += len(chunk)
+                if progress is not None:
+                    progress(downloaded, total)
+            f.flush()
+            os.fsync(f.fileno())
+        if total and downloaded < total:
+            raise ConnectionError(f"连接提前关闭 ({downloaded}/{total} bytes)")
+
+
+def download_file(url: str, dest_path: Path, sha256: Optional[str] = None, max_retries: int = 3,
+                  timeout: float = 30, chunk_size: int = CHUNK_SIZE,
+                  progress: Optional[Callable[[int, int], None]] = None) -> str:
     """
-    下载文件，支持重试和超时设置
-    
+    下载文件,支持断点续传、重试和 SHA-256 校验
+
     Args:
         url: 下载链接
         dest_path: 保存路径
-        max_retries: 最大重试次数
+        sha256: 期望的 SHA-256,None 表示不校验
+        max_retries: 最大重试次数(每次重试从断点续传)
+        timeout: 连接 / 读取超时(秒)
+        chunk_size: 读写块大小
+        progress: 进度回调 (已下载字节数, 总字节数)
+
+    Returns:
+        文件的 SHA-256
     """
     if dest_path.exists():
-        print(f"✓ {dest_path.name} already exists")
-        return
+        digest = sha256_file(dest_path)
+        if sha256 is None or digest == sha256:
+            print(f"✓ {dest_path.name} already exists")
+            return digest
+        print(f"⚠️  {dest_path.name} 校验失败,重新下载")
 
-    print(f"Downloading {dest_path.name}...")
     dest_path.parent.mkdir(parents=True, exist_ok=True)
-    
+    part_path = dest_path.with_name(dest_path.name + ".part")
+    if part_path.exists():
+        print(f"Resuming {dest_path.name} from {part_path.stat().st_size} bytes...")
+    else:
+        print(f"Downloading {dest_path.name}...")
+
     for attempt in range(max_retries):
         try:
-            # 设置超时和 User-Agent
-            req = urllib.request.Request(
-                url,
-                headers={
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                }
-            )
-            
-            # 下载文件
-            with urllib.request.urlopen(req, timeout=30) as response:
-                total_size = int(response.headers.get('Content-Length', 0))
-                downloaded = 0
-                chunk_size = 8192
-                
-                with open(dest_path, 'wb') as f:
-                    while True:
-                        chunk = response.read(chunk_size)
-                        if not chunk:
-                            break
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        
-                        if total_size > 0:
-                            percent = int(downloaded * 100 / total_size)
-                            print(f"\rDownloading {dest_path.name}: {percent}%", end='')
-            
-            print(f"\n✓ Downloaded {dest_path.name}")
-            return  # 下载成功，退出
-            
-        except (urllib.error.URLError, urllib.error.HTTPError, ConnectionError, TimeoutError) as e:
-            print(f"\n⚠️  Attempt {attempt + 1}/{max_retries} failed: {e}")
-            
-            # 删除不完整的文件
-            if dest_path.exists():
-                os.remove(dest_path)
-            
-            # 如果不是最后一次尝试，等待后重试
+            _fetch(url, part_path, timeout, chunk_size, progress)
+            digest = sha256_file(part_path)
+            if sha256 is not None and digest != sha256:
+                # 内容错误无法续传,删除后重新下载
+                part_path.unlink()
+                raise ChecksumMismatchError(f"{dest_path.name} 的 SHA-256 为 {digest},期望 {sha256}")
+            # 校验通过后原子替换,服务启动时不会读到不完整的文件
+            os.replace(part_path, dest_path)
+            print(f"✓ Downloaded {dest_path.name}")
+            return digest
+
+        except (urllib.error.URLError, ConnectionError, TimeoutError, ChecksumMismatchError) as e:
+            print(f"⚠️  {dest_path.name}: attempt {attempt + 1}/{max_retries} failed: {e}")
+
+            # 如果不是最后一次尝试，等待后重试(保留 .part,下次从断点继续)
             if attempt < max_retries - 1:
                 wait_time = (attempt + 1) * 2  # 递增等待时间: 2s, 4s, 6s
                 print(f"   Waiting {wait_time}s before retry...")
                 time.sleep(wait_time)
             else:
-                print(f"\n❌ Failed to download {dest_path.name} after {max_retries} attempts")
+                print(f"❌ Failed to download {dest_path.name} after {max_retries} attempts")
                 raise
-        except Exception as e:
-            print(f"\n❌ Unexpected error: {e}")
-            if dest_path.exists():
-                os.remove(dest_path)
-            raise
 
-def main():
-    # Define model URLs and paths
-    models = [
-        {
-            "name": "RealESRGAN_x4plus.pth",
-            "url": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth",
-            "target_dir": "weights"  # 放到 backend/weights/
-        },
-        {
-            "name": "RealESRGAN_x4plus_anime_6B.pth",
-            "url": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.2.4/RealESRGAN_x4plus_anime_6B.pth",
-            "target_dir": "weights"  # 放到 backend/weights/
+
+def _printer(name: str) -> Callable[[int, int], None]:
+    """并发下载时按 10% 步进打印进度,避免多个文件的进度行互相覆盖"""
+    last = [-1]
+
+    def progress(downloaded: int, total: int):
+        if total <= 0:
+            return
+        step = downloaded * 10 // total
+        if step != last[0]:
+            last[0] = step
+            print(f"   {name}: {step * 10}% ({downloaded / 1024 ** 2:.1f}/{total / 1024 ** 2:.1f}MB)")
+    return progress
+
+
+def update_checksums(weights_dir: Path, digests: Dict[str, str]):
+    """把校验过的哈希写入 SHA256SUMS(sha256sum 格式),保留其他文件的条目"""
+    path = weights_dir / CHECKSUMS_FILE
+    entries = {}
+    if path.exists():
+        for line in path.read_text().splitlines():
+            parts = line.split()
+            if len(parts) == 2:
+                entries[parts[1].lstrip("*")] = parts[0]
+    entries.update(digests)
+    tmp_path = path.with_name(f"{CHECKSUMS_FILE}.{os.getpid()}.tmp")
+    tmp_path.write_text("".join(f"{digest}  {name}\n" for name, digest in sorted(entries.items())))
+    os.replace(tmp_path, path)
+
+
+def download_all(models: List[Dict[str, str]], weights_dir: Path = WEIGHTS_DIR,
+                 mirror: Optional[str] = None, workers: int = 4) -> Dict[str, str]:
+    """
+    并发下载清单中的模型,返回 文件名 -> SHA-256
+
+    Args:
+        models: 模型清单,每项包含 name / url / sha256
+        weights_dir: 保存目录
+        mirror: 镜像地址,设置时从 <mirror>/<文件名> 下载
+        workers: 同时下载的文件数
+    """
+    weights_dir.mkdir(parents=True, exist_ok=True)
+    digests = {}
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(
+                download_file,
+                f"{mirror.rstrip('/')}/{model['name']}" if mirror else model["url"],
+                weights_dir / model["name"],
+                model.get("sha256"),
+                progress=_printer(model["name"]),
+            ): model["name"]
+            for model in models
         }
-        # LaMa 模型由 simple-lama-inpainting 库自动下载,无需手动下载
-    ]
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                digests[name] = future.result()
+            except Exception as e:
+                errors.append(f"{name}: {e}")
+    if digests:
+        update_checksums(weights_dir, digests)
+    if errors:
+        raise RuntimeError("部分模型下载失败:\n  " + "\n  ".join(errors))
+    return digests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="下载模型权重")
+    parser.add_argument("--mirror", default=os.environ.get("MODEL_MIRROR", ""),
+                        help="镜像地址,从 <mirror>/<文件名> 下载")
+    parser.add_argument("--dir", default=str(WEIGHTS_DIR), help="保存目录")
+    parser.add_argument("--workers", type=int, default=4, help="同时下载的文件数")
+    parser.add_argument("--face", action="store_true", help="同时下载人脸增强模型(GFPGAN)")
+    args = parser.parse_args()
 
     print("=" * 60)
     print("下载模型文件...")
     print("=" * 60)
 
-    for model in models:
-        # 确定目标目录(相对于此脚本)
-        target_dir = Path(__file__).parent / model["target_dir"]
-        target_dir.mkdir(exist_ok=True, parents=True)
-        
-        dest_path = target_dir / model["name"]
-        download_file(model["url"], dest_path)
+    try:
+        models = MODELS + FACE_MODELS if args.face else MODELS
+        download_all(models, Path(args.dir), mirror=args.mirror or None, workers=args.workers)
+    except RuntimeError as e:
+        print(f"\n❌ {e}")
+        sys.exit(1)
 
     print("\n" + "=" * 60)
     print("✓ 所有模型下载完成!")
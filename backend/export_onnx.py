@@ -0,0 +1,97 @@
+"""
+将 Real-ESRGAN 权重(.pth)导出为 ONNX
+导出的模型支持动态 batch / 高度 / 宽度,供 RealESRGANONNXModel 使用
+
+用法:
+    python export_onnx.py                                  # 导出 RealESRGAN_x4plus.onnx
+    python export_onnx.py --int8                           # 额外导出动态量化的 *_int8.onnx
+    python export_onnx.py --model RealESRGAN_x4plus_anime_6B
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+import torch
+from basicsr.archs.rrdbnet_arch import RRDBNet
+
+from models.realesrgan_model import RRDB_CONFIGS
+from models.weights import load_state_dict
+
+WEIGHTS_DIR = Path(__file__).parent / "weights"
+
+
+def load_rrdbnet(model_name: str) -> torch.nn.Module:
+    """从权重存储加载 RRDBNet(校验并 mmap 加载 weights/<model_name>.safetensors,优先使用 params_ema)"""
+    model = RRDBNet(**RRDB_CONFIGS[model_name])
+    model.load_state_dict(load_state_dict(model_name, WEIGHTS_DIR), strict=True)
+    return model.eval()
+
+
+def export(model_name: str, output_path: Path, opset: int = 17):
+    model = load_rrdbnet(model_name)
+    dummy = torch.rand(1, 3, 64, 64)
+
+    print(f"📦 导出 {model_name} -> {output_path.name} (opset {opset})...")
+    torch.onnx.export(
+        model,
+        dummy,
+        str(output_path),
+        input_names=["input"],
+        output_names=["output"],
+        dynamic_axes={
+            "input": {0: "batch", 2: "height", 3: "width"},
+            "output": {0: "batch", 2: "height_out", 3: "width_out"},
+        },
+        opset_version=opset,
+        do_constant_folding=True,
+    )
+
+    # 写入放大倍数元数据,供推理端读取
+    import onnx
+    onnx_model = onnx.load(str(output_path))
+    meta = onnx_model.metadata_props.add()
+    meta.key, meta.value = "scale", str(RRDB_CONFIGS[model_name]["scale"])
+    onnx.save(onnx_model, str(output_path))
+
+    verify(model, output_path)
+
+
+def verify(model: torch.nn.Module, onnx_path: Path, size=(3, 96, 80)):
+    """用非正方形随机输入对比 PyTorch 与 ONNX Runtime 的输出"""
+    import onnxruntime as ort
+
+    x = torch.rand(1, *size)
+    with torch.inference_mode():
+        expected = model(x).numpy()
+    session = ort.InferenceSession(str(onnx_path), providers=["CPUExecutionProvider"])
+    actual = session.run(None, {session.get_inputs()[0].name: x.numpy()})[0]
+    max_diff = float(np.abs(expected - actual).max())
+    print(f"   校验: 输出形状 {actual.shape}, 最大误差 {max_diff:.2e}")
+    if max_diff > 1e-3:
+        raise RuntimeError(f"ONNX 输出与 PyTorch 不一致 (最大误差 {max_diff:.2e})")
+
+
+def quantize_int8(onnx_path: Path, output_path: Path):
+    """动态量化(权重 int8,激活运行时量化),适用于 CPU 推理"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    print(f"📦 动态量化 -> {output_path.name}...")
+    quantize_dynamic(str(onnx_path), str(output_path), weight_type=QuantType.QUInt8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出 Real-ESRGAN ONNX 模型")
+    parser.add_argument("--model", default="RealESRGAN_x4plus", choices=sorted(RRDB_CONFIGS))
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--int8", action="store_true", help="同时导出动态量化模型")
+    args = parser.parse_args()
+
+    output_path = WEIGHTS_DIR / f"{args.model}.onnx"
+    export(args.model, output_path, args.opset)
+    if args.int8:
+        quantize_int8(output_path, WEIGHTS_DIR / f"{args.model}_int8.onnx")
+    print("✓ 导出完成")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+"""
+后端 HTTP 压测工具
+对 /api/upscale 与 /api/inpaint 做并发扫描,输出吞吐量、延迟分位数、
+错误率 / 429 比例、事件循环阻塞情况以及 RSS 随时间的变化
+
+用法:
+    # 进程内压测(使用 Mock 模型,无需权重)
+    python load_test.py --in-process --mock --concurrency 1,2,4,8
+
+    # 对本地 uvicorn 压测(--pid 用于采样服务端 RSS,不提供时不报告 RSS)
+    python load_test.py --url http://localhost:8888 --pid 12345 \\
+        --endpoints upscale,inpaint --sizes 256x256:3,512x512:2,1024x768:1 --rate 2
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+@dataclass
+class RequestRecord:
+    """单个请求的结果"""
+    endpoint: str
+    size: Tuple[int, int]
+    start: float
+    latency: float
+    status: int
+    error: Optional[str] = None
+    output_pixels: int = 0  # 超分为输入像素数 × scale²,inpaint 与输入相同
+
+
+@dataclass
+class LevelReport:
+    """单个并发级别的统计结果"""
+    concurrency: int
+    duration: float
+    records: List[RequestRecord] = field(default_factory=list)
+    rss_samples: List[Tuple[float, int]] = field(default_factory=list)
+    loop_lag_samples: List[float] = field(default_factory=list)
+
+    def summary(self) -> dict:
+        total = len(self.records)
+        ok = [r for r in self.records if r.status == 200]
+        throttled = [r for r in self.records if r.status == 429]
+        errors = [r for r in self.records if r.status != 200 and r.status != 429]
+        latencies = np.array([r.latency for r in ok]) if ok else np.array([0.0])
+        rss_mb = [rss / 1024 / 1024 for _, rss in self.rss_samples]
+
+        per_endpoint = {}
+        for endpoint in sorted({r.endpoint for r in self.records}):
+            ep_ok = [r.latency for r in ok if r.endpoint == endpoint]
+            per_endpoint[endpoint] = {
+                "requests": sum(1 for r in self.records if r.endpoint == endpoint),
+                "ok": len(ep_ok),
+                "p50": _percentile(ep_ok, 50),
+                "p95": _percentile(ep_ok, 95),
+            }
+
+        return {
+            "concurrency": self.concurrency,
+            "duration": round(self.duration, 2),
+            "requests": total,
+            "ok": len(ok),
+            "throughput_rps": round(len(ok) / self.duration, 3) if self.duration > 0 else 0.0,
+            "input_mpix_per_sec": round(
+                sum(r.size[0] * r.size[1] for r in ok) / 1e6 / self.duration, 3
+            ) if self.duration > 0 else 0.0,
+            "output_mpix_per_sec": round(
+                sum(r.output_pixels for r in ok) / 1e6 / self.duration, 3
+            ) if self.duration > 0 else 0.0,
+            "latency": {
+                "p50": round(float(np.percentile(latencies, 50)), 3),
+                "p90": round(float(np.percentile(latencies, 90)), 3),
+                "p99": round(float(np.percentile(latencies, 99)), 3),
+                "max": round(float(latencies.max()), 3),
+            },
+            "error_rate": round(len(errors) / total, 4) if total else 0.0,
+            "throttle_rate": round(len(throttled) / total, 4) if total else 0.0,
+            "loop_lag_ms": {
+                "p50": round(_percentile(self.loop_lag_samples, 50) * 1000, 1),
+                "max": round(max(self.loop_lag_samples, default=0.0) * 1000, 1),
+            },
+            "rss_mb": {
+                "start": round(rss_mb[0], 1) if rss_mb else None,
+                "peak": round(max(rss_mb), 1) if rss_mb else None,
+                "end": round(rss_mb[-1], 1) if rss_mb else None,
+            },
+            "endpoints": per_endpoint,
+            "sample_errors": sorted({r.error for r in errors if r.error})[:5],
+        }
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return round(float(np.percentile(np.array(values), q)), 3)
+
+
+def read_rss(pid: int) -> Optional[int]:
+    """读取进程 RSS(字节),优先使用 psutil,否则读取 /proc"""
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except ImportError:
+        pass
+    except Exception:
+        return None
+
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def parse_sizes(spec: str) -> List[Tuple[Tuple[int, int], float]]:
+    """
+    解析图片尺寸分布,如 "256x256:3,512x512:1"(冒号后为权重,默认 1)
+    """
+    sizes = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        dims, _, weight = item.partition(":")
+        width, height = dims.lower().split("x")
+        sizes.append(((int(width), int(height)), float(weight) if weight else 1.0))
+    if not sizes:
+        raise ValueError(f"无效的尺寸配置: {spec}")
+    return sizes
+
+
+def make_test_image(size: Tuple[int, int], seed: int) -> bytes:
+    """生成带渐变和噪声的测试图片(PNG 字节)"""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    noise = rng.normal(0, 25, (height, width, 3)).astype(np.float32)
+    array = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def make_test_mask(size: Tuple[int, int], seed: int) -> bytes:
+    """生成包含若干笔画的遮罩(白色=需要修复的区域)"""
+    width, height = size
+    rng = random.Random(seed)
+    mask = Image.new("L", size, 0)
+    draw = ImageDraw.Draw(mask)
+    brush = max(4, min(width, height) // 20)
+    for _ in range(3):
+        points = [(rng.randrange(width), rng.randrange(height)) for _ in range(4)]
+        draw.line(points, fill=255, width=brush)
+    buffer = io.BytesIO()
+    mask.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class LoadTester:
+    """并发扫描压测器"""
+
+    def __init__(self, client, endpoints: List[str], sizes, pid: Optional[int],
+                 rate: float = 0.0, timeout: float = 300.0, scale: int = 4):
+        """
+        Args:
+            client: httpx.AsyncClient(进程内或远程)
+            endpoints: 压测的接口列表('upscale' / 'inpaint')
+            sizes: parse_sizes 返回的尺寸分布
+            pid: 采样 RSS 的服务端进程号,None 表示不采样(远程服务未提供 --pid)
+            rate: 到达率(请求/秒),0 表示闭环模式(每个并发槽位连续发送)
+            timeout: 单个请求超时(秒)
+            scale: 超分倍数
+        """
+        self.client = client
+        self.endpoints = endpoints
+        self.sizes = sizes
+        self.pid = pid
+        self.rate = rate
+        self.timeout = timeout
+        self.scale = scale
+        self._payloads: Dict[Tuple[int, int], Tuple[bytes, bytes]] = {}
+        for index, (size, _) in enumerate(sizes):
+            self._payloads[size] = (make_test_image(size, index), make_test_mask(size, index))
+
+    def _pick(self, rng: random.Random) -> Tuple[str, Tuple[int, int]]:
+        endpoint = rng.choice(self.endpoints)
+        sizes, weights = zip(*self.sizes)
+        return endpoint, rng.choices(sizes, weights=weights)[0]
+
+    async def _send(self, endpoint: str, size: Tuple[int, int], scheduled: float) -> RequestRecord:
+        image_bytes, mask_bytes = self._payloads[size]
+        params = {}
+        output_pixels = size[0] * size[1]
+        if endpoint == "upscale":
+            files = {"file": ("image.png", image_bytes, "image/png")}
+            params["scale"] = self.scale
+            output_pixels *= self.scale * self.scale
+        else:
+            files = {
+                "image": ("image.png", image_bytes, "image/png"),
+                "mask": ("mask.png", mask_bytes, "image/png"),
+            }
+        try:
+            response = await self.client.post(f"/api/{endpoint}", params=params, files=files,
+                                              timeout=self.timeout)
+            await response.aread()
+            error = None if response.status_code == 200 else response.text[:200]
+            status = response.status_code
+        except Exception as e:
+            status, error = 0, f"{type(e).__name__}: {e}"
+        # 延迟从计划到达时间算起,避免协调遗漏(coordinated omission)
+        return RequestRecord(endpoint, size, scheduled, time.perf_counter() - scheduled, status, error,
+                             output_pixels)
+
+    async def _sample_rss(self, report: LevelReport, stop: asyncio.Event, interval: float):
+        if self.pid is None:
+            return
+        t0 = time.perf_counter()
+        while not stop.is_set():
+            rss = read_rss(self.pid)
+            if rss is not None:
+                report.rss_samples.append((time.perf_counter() - t0, rss))
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _probe_loop_lag(self, report: LevelReport, stop: asyncio.Event, interval: float):
+        """
+        通过 /api/health 的响应时间探测服务端事件循环是否被阻塞
+        (进程内模式下同时反映客户端与服务端共享的事件循环)
+        """
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                await self.client.get("/api/health", timeout=self.timeout)
+                report.loop_lag_samples.append(time.perf_counter() - t0)
+            except Exception:
+                pass
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_level(self, concurrency: int, duration: float, max_requests: int,
+                        seed: int = 0) -> LevelReport:
+        """以给定并发运行一轮压测"""
+        report = LevelReport(concurrency=concurrency, duration=0.0)
+        rng = random.Random(seed + concurrency)
+        stop = asyncio.Event()
+        deadline = time.perf_counter() + duration
+        issued = 0
+
+        def budget_left() -> bool:
+            return time.perf_counter() < deadline and (max_requests <= 0 or issued < max_requests)
+
+        async def closed_loop_worker():
+            nonlocal issued
+            while budget_left():
+                issued += 1
+                endpoint, size = self._pick(rng)
+                report.records.append(await self._send(endpoint, size, time.perf_counter()))
+
+        async def open_loop():
+            # 泊松到达,并发上限由信号量控制,排队时间计入延迟
+            nonlocal issued
+            semaphore = asyncio.Semaphore(concurrency)
+            tasks = []
+
+            async def one(endpoint, size, scheduled):
+                async with semaphore:
+                    report.records.append(await self._send(endpoint, size, scheduled))
+
+            next_arrival = time.perf_counter()
+            while budget_left():
+                now = time.perf_counter()
+                if now < next_arrival:
+                    await asyncio.sleep(next_arrival - now)
+                    continue
+                issued += 1
+                endpoint, size = self._pick(rng)
+                tasks.append(asyncio.create_task(one(endpoint, size, next_arrival)))
+                next_arrival += rng.expovariate(self.rate)
+            await asyncio.gather(*tasks)
+
+        monitors = [
+            asyncio.create_task(self._sample_rss(report, stop, 0.5)),
+            asyncio.create_task(self._probe_loop_lag(report, stop, 0.25)),
+        ]
+        t0 = time.perf_counter()
+        if self.rate > 0:
+            await open_loop()
+        else:
+            await asyncio.gather(*[closed_loop_worker() for _ in range(concurrency)])
+        report.duration = time.perf_counter() - t0
+        stop.set()
+        await asyncio.gather(*monitors)
+        return report
+
+
+def print_summary(summary: dict):
+    lat = summary["latency"]
+    rss = summary["rss_mb"]
+    print(
+        f"  并发 {summary['concurrency']:>3} | "
+        f"{summary['ok']}/{summary['requests']} 成功 | "
+        f"{summary['throughput_rps']:.2f} req/s 输出 {summary['output_mpix_per_sec']:.2f} MPix/s | "
+        f"p50 {lat['p50']:.2f}s p90 {lat['p90']:.2f}s p99 {lat['p99']:.2f}s | "
+        f"错误 {summary['error_rate'] * 100:.1f}% 429 {summary['throttle_rate'] * 100:.1f}% | "
+        f"loop lag max {summary['loop_lag_ms']['max']:.0f}ms | "
+        + (f"RSS {rss['start']}→{rss['peak']}MB" if rss["peak"] is not None else "RSS 不可用")
+    )
+    for error in summary["sample_errors"]:
+        print(f"      ⚠️  {error}")
+
+
+async def _main(args) -> List[dict]:
+    import httpx
+
+    lifespan = contextlib.AsyncExitStack()
+    if args.in_process:
+        if args.mock:
+            os.environ["INPAINT_MOCK_MODELS"] = "1"
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from api_server import app
+
+        # 进程内运行时手动触发 startup/shutdown 事件
+        await lifespan.enter_async_context(app.router.lifespan_context(app))
+        transport = httpx.ASGITransport(app=app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://loadtest")
+        pid = os.getpid()
+    else:
+        client = httpx.AsyncClient(base_url=args.url)
+        # 远程服务不提供 --pid 时无法采样服务端 RSS(压测进程自身的 RSS 没有意义)
+        pid = args.pid or None
+
+    tester = LoadTester(
+        client,
+        endpoints=[e.strip() for e in args.endpoints.split(",") if e.strip()],
+        sizes=parse_sizes(args.sizes),
+        pid=pid,
+        rate=args.rate,
+        timeout=args.timeout,
+        scale=args.scale,
+    )
+
+    mode = f"开环 {args.rate} req/s" if args.rate > 0 else "闭环"
+    print("=" * 60)
+    print(f"压测: {'进程内' if args.in_process else args.url} ({mode})")
+    print("=" * 60)
+
+    summaries = []
+    try:
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            report = await tester.run_level(concurrency, args.duration, args.requests)
+            summary = report.summary()
+            summary["rss_timeline"] = [(round(t, 2), rss) for t, rss in report.rss_samples]
+            summaries.append(summary)
+            print_summary(summary)
+    finally:
+        await client.aclose()
+        await lifespan.aclose()
+    return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inpaint-Web 后端压测工具")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", default="http://localhost:8888", help="服务地址")
+    target.add_argument("--in-process", action="store_true", help="进程内压测 api_server:app")
+    parser.add_argument("--mock", action="store_true", help="进程内模式下使用 Mock 模型")
+    parser.add_argument("--pid", type=int, default=0,
+                        help="采样 RSS 的服务端进程号(远程压测时不提供则不报告 RSS)")
+    parser.add_argument("--endpoints", default="upscale,inpaint", help="接口列表,逗号分隔")
+    parser.add_argument("--sizes", default="256x256:3,512x512:2,1024x768:1",
+                        help="图片尺寸分布,如 256x256:3,512x512:1")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="并发级别,逗号分隔")
+    parser.add_argument("--scale", type=int, default=4, help="超分倍数")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="到达率(请求/秒),0 表示闭环模式")
+    parser.add_argument("--duration", type=float, default=30.0, help="每个并发级别的持续时间(秒)")
+    parser.add_argument("--requests", type=int, default=0, help="每个并发级别的最大请求数(0 不限)")
+    parser.add_argument("--timeout", type=float, default=300.0, help="单个请求超时(秒)")
+    parser.add_argument("--json-out", help="将完整结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    summaries = asyncio.run(_main(args))
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(summaries, f, indent=2, ensure_ascii=False)
+        print(f"\n✓ 结果已写入 {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
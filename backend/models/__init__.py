@@ -1,8 +1,27 @@
-from .realesrgan_model import get_model as get_realesrgan_model
 from .migan_onnx import MIGANONNXModel
 from .device import DeviceDetector
+from .capabilities import get_plans, plan_torch_model
+import os
+import threading
 
-__all__ = ['get_realesrgan_model', 'MIGANONNXModel', 'DeviceDetector', 'get_model', 'get_inpaint_model']
+__all__ = ['get_realesrgan_model', 'MIGANONNXModel', 'DeviceDetector', 'get_model', 'get_inpaint_model',
+           'get_fast_model', 'get_face_enhancer', 'get_face_enhancer_info', 'enhance_faces', 'use_mock_models', 'get_plans']
+
+# 人脸增强模型按需加载,同一进程内共享
+_face_enhancer = None
+_face_enhancer_error = None
+_face_enhancer_lock = threading.Lock()
+
+
+def get_realesrgan_model():
+    """获取 PyTorch 版 Real-ESRGAN 模型(延迟导入,ONNX 部署可不安装 torch)"""
+    from .realesrgan_model import get_model as _get_model
+    return _get_model()
+
+
+def use_mock_models() -> bool:
+    """是否使用 Mock 模型(环境变量 INPAINT_MOCK_MODELS=1,用于压测或无权重环境)"""
+    return os.environ.get("INPAINT_MOCK_MODELS", "0").lower() in ("1", "true", "yes")
 
 
 def get_model(device_type: str = None):
@@ -11,7 +30,14 @@ def get_model(device_type: str = None):
     (兼容函数,调用 realesrgan_model 的 get_model)
     
     注意: 原始 get_model() 不接受参数,会自动检测设备
+    后端由环境变量 UPSCALE_BACKEND 选择: torch(默认)或 onnx
     """
+    if use_mock_models():
+        from .mock_models import MockUpscaleModel
+        return MockUpscaleModel()
+    if os.environ.get("UPSCALE_BACKEND", "torch") == "onnx":
+        from .realesrgan_onnx import get_model as get_onnx_model
+        return get_onnx_model()
     return get_realesrgan_model()  # 不传递参数
 
 
@@ -29,7 +55,16 @@ def get_inpaint_model(device_type: str = None, model_path: str = None):
     Returns:
         LamaInpaint 实例
     """
-    from .lama_inpaint import LamaInpaint
+    if use_mock_models():
+        from .mock_models import MockInpaintModel
+        return MockInpaintModel()
+
+    try:
+        from .lama_inpaint import LamaInpaint
+    except ImportError:
+        # 未安装 torch(ONNX 部署),使用 OpenCV 修复
+        from .opencv_inpaint import OpenCVInpaint
+        return OpenCVInpaint()
     from pathlib import Path
     
     # 自动检测设备
@@ -37,6 +72,8 @@ def get_inpaint_model(device_type: str = None, model_path: str = None):
         device_info = DeviceDetector.get_device_info()
         # LaMa 使用 PyTorch,支持 CUDA 和 CPU
         device_type = 'cuda' if device_info['type'] == 'cuda' else 'cpu'
+    # LaMa 在 fp16 下数值不稳定,始终使用 fp32(记录决策供 /api/info 展示)
+    plan_torch_model("big-lama", device_type, cpu_mode="fp32", allow_fp16=False)
     
     # 默认模型路径
     if model_path is None:
@@ -46,3 +83,100 @@ def get_inpaint_model(device_type: str = None, model_path: str = None):
     
     return LamaInpaint(model_path=model_path, device=device_type)
 
+
+def get_fast_model(op: str):
+    """
+    获取降级档位(负载高时使用)的轻量模型,缺少权重时抛出 FileNotFoundError / ImportError
+        upscale: DEGRADE_UPSCALE_MODEL 指定的 Real-ESRGAN 权重(默认 RealESRGAN_x4plus_anime_6B,
+                 也可以用 RealESRGAN_x2plus,输出再缩放到请求的倍数),后端与默认模型相同
+        inpaint: DEGRADE_INPAINT_MODEL 为 migan(默认,缺少 weights/migan_pipeline_v2.onnx 时使用 opencv)或 opencv
+
+    Args:
+        op: 'upscale' / 'inpaint'
+    """
+    if use_mock_models():
+        from .mock_models import MockUpscaleModel, MockInpaintModel
+        # 模拟降级模型:吞吐量为默认模拟模型的 4 倍
+        if op == "upscale":
+            rate = float(os.environ.get("MOCK_UPSCALE_MPIX_PER_SEC", "0.5")) * 4
+            return MockUpscaleModel(mpix_per_sec=rate, model_name="mock-upscale-fast")
+        rate = float(os.environ.get("MOCK_INPAINT_MPIX_PER_SEC", "4")) * 4
+        return MockInpaintModel(mpix_per_sec=rate, model_name="mock-inpaint-fast")
+
+    if op == "upscale":
+        model_name = os.environ.get("DEGRADE_UPSCALE_MODEL", "RealESRGAN_x4plus_anime_6B")
+        if os.environ.get("UPSCALE_BACKEND", "torch") == "onnx":
+            from .realesrgan_onnx import get_model as get_onnx_model
+            return get_onnx_model(model_name)
+        from .realesrgan_model import get_model as get_torch_model
+        return get_torch_model(model_name)
+
+    from pathlib import Path
+    from .opencv_inpaint import OpenCVInpaint
+    if os.environ.get("DEGRADE_INPAINT_MODEL", "migan") == "opencv":
+        return OpenCVInpaint()
+    model_path = Path(__file__).parent.parent / "weights" / "migan_pipeline_v2.onnx"
+    if not model_path.exists():
+        print(f"⚠️  未找到 MI-GAN 权重 {model_path.name},降级档位使用 OpenCV Inpaint")
+        return OpenCVInpaint()
+    device_type = 'cuda' if DeviceDetector.get_device_info()['type'] == 'cuda' else 'cpu'
+    return MIGANONNXModel(str(model_path), device=device_type)
+
+
+
+def get_face_enhancer(device_type: str = None):
+    """
+    获取 GFPGAN 人脸增强(第一次调用时加载,之后复用同一实例)
+
+    人脸增强按请求启用,不使用时不加载模型。
+    未安装 gfpgan / facexlib 或缺少权重时抛出 ImportError / FileNotFoundError
+
+    Args:
+        device_type: 设备类型('cuda' / 'mps' / 'cpu')。如果为 None,自动检测
+    """
+    global _face_enhancer
+    with _face_enhancer_lock:
+        if _face_enhancer is None:
+            if use_mock_models():
+                from .mock_models import MockFaceEnhancer
+                _face_enhancer = MockFaceEnhancer()
+            else:
+                from .face_enhance import get_model as get_face_model
+                if device_type is None:
+                    device_type = DeviceDetector.get_device_info()['type']
+                plan_torch_model("gfpgan", device_type, cpu_mode="fp32", allow_fp16=False)
+                _face_enhancer = get_face_model(device_type)
+        return _face_enhancer
+
+
+def get_face_enhancer_info():
+    """人脸增强的状态与累计统计(未加载时不触发加载)"""
+    if _face_enhancer_error is not None:
+        return {"loaded": False, "error": _face_enhancer_error}
+    if _face_enhancer is None:
+        return {"loaded": False}
+    return {"loaded": True, **_face_enhancer.get_info()}
+
+
+def enhance_faces(original, upscaled):
+    """
+    对超分结果做人脸增强(原图用于检测);RGBA 图片只增强 RGB,alpha 保持不变
+
+    Returns:
+        (增强后的数组, 统计);人脸增强不可用时原样返回,统计中包含 error
+    """
+    global _face_enhancer_error
+    if _face_enhancer_error is not None:
+        return upscaled, {"faces": 0, "error": _face_enhancer_error}
+    try:
+        enhancer = get_face_enhancer()
+    except (ImportError, FileNotFoundError) as e:
+        # 只尝试加载一次,之后的请求直接跳过
+        _face_enhancer_error = f"{type(e).__name__}: {e}"
+        print(f"⚠️  人脸增强不可用: {_face_enhancer_error}")
+        return upscaled, {"faces": 0, "error": _face_enhancer_error}
+    if upscaled.ndim == 3 and upscaled.shape[2] == 4:
+        import numpy as np
+        restored, stats = enhancer.enhance(original[..., :3], upscaled[..., :3])
+        return np.dstack([restored, upscaled[..., 3]]), stats
+    return enhancer.enhance(original, upscaled)
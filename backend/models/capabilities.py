@@ -0,0 +1,315 @@
+"""
+设备能力探测与自动选择推理配置
+启动时探测一次并缓存:GPU fp16 / bf16 支持、ONNX Runtime providers、
+CPU 指令集(AVX2 / AVX-512 / AMX)、核心数与内存,
+再据此为每个模型选择精度、providers 与线程数,选择结果在 /api/info 中展示
+
+环境变量:
+    INFERENCE_THREADS   覆盖自动选择的 CPU 推理线程数(0 表示自动)
+    MPS_FP16            MPS 上是否使用 fp16: auto(默认,实测可用才启用) / 1 / 0
+"""
+import os
+import platform
+import subprocess
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+try:
+    import torch
+except ImportError:  # ONNX 部署可不安装 torch
+    torch = None
+
+# 关注的 CPU 指令集(/proc/cpuinfo flags 命名)
+CPU_FLAGS = (
+    "avx2", "fma", "avx512f", "avx512_vnni", "avx512_bf16", "avx512_fp16",
+    "amx_tile", "amx_bf16", "amx_int8",
+)
+
+# ONNX Runtime providers 偏好顺序(不自动启用 TensorRT:首次构建引擎耗时较长)
+ORT_PROVIDER_PREFERENCE = (
+    "CUDAExecutionProvider",
+    "ROCMExecutionProvider",
+    "CoreMLExecutionProvider",
+    "DmlExecutionProvider",
+    "CPUExecutionProvider",
+)
+
+# 各 GPU 设备类型对应的 ORT provider
+_DEVICE_PROVIDERS = {
+    "cuda": ("CUDAExecutionProvider", "ROCMExecutionProvider"),
+    "mps": ("CoreMLExecutionProvider",),
+}
+
+
+@dataclass
+class ModelPlan:
+    """单个模型的推理配置决策"""
+    model: str
+    device: str
+    precision: str
+    threads: int
+    providers: List[str] = field(default_factory=list)
+    reasons: List[str] = field(default_factory=list)
+
+
+# 已加载模型的决策(model -> ModelPlan),在 /api/info 中展示
+_PLANS: Dict[str, ModelPlan] = {}
+
+
+def _read_cpuinfo() -> str:
+    try:
+        with open("/proc/cpuinfo") as f:
+            return f.read()
+    except OSError:
+        return ""
+
+
+def _sysctl(name: str) -> Optional[str]:
+    try:
+        return subprocess.run(["sysctl", "-n", name], capture_output=True, text=True, timeout=2).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _probe_cpu() -> Dict[str, Any]:
+    logical = os.cpu_count() or 1
+    try:
+        usable = len(os.sched_getaffinity(0))  # Worker 绑定核心后只计可用核心
+    except AttributeError:
+        usable = logical
+
+    info: Dict[str, Any] = {"arch": platform.machine(), "logical_cores": logical, "usable_cores": usable}
+    cpuinfo = _read_cpuinfo()
+    if cpuinfo:
+        flags = set()
+        cores = set()
+        physical_id = core_id = None
+        for line in cpuinfo.splitlines():
+            key, _, value = line.partition(":")
+            key = key.strip()
+            if key == "flags" and not flags:
+                flags = set(value.split())
+            elif key == "model name" and "name" not in info:
+                info["name"] = value.strip()
+            elif key == "physical id":
+                physical_id = value.strip()
+            elif key == "core id":
+                core_id = value.strip()
+                cores.add((physical_id, core_id))
+        info["physical_cores"] = len(cores) or logical
+        info["flags"] = {flag: flag in flags for flag in CPU_FLAGS}
+    elif platform.system() == "Darwin":
+        info["name"] = _sysctl("machdep.cpu.brand_string")
+        physical = _sysctl("hw.physicalcpu")
+        info["physical_cores"] = int(physical) if physical and physical.isdigit() else logical
+        info["flags"] = {
+            "avx2": _sysctl("hw.optional.avx2_0") == "1",
+            "avx512f": _sysctl("hw.optional.avx512f") == "1",
+            "neon": _sysctl("hw.optional.neon") == "1",
+        }
+    else:
+        info["physical_cores"] = logical
+        info["flags"] = {}
+
+    # torch 报告的实际可用指令集(如 AVX512 / AVX2 / DEFAULT)
+    if torch is not None:
+        try:
+            info["torch_capability"] = torch.backends.cpu.get_cpu_capability()
+        except AttributeError:
+            pass
+    return info
+
+
+def _probe_memory() -> Dict[str, Optional[int]]:
+    try:
+        import psutil
+        memory = psutil.virtual_memory()
+        return {"total_bytes": memory.total, "available_bytes": memory.available}
+    except ImportError:
+        pass
+    values = {}
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("MemTotal", "MemAvailable"):
+                    values[key] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    total = values.get("MemTotal")
+    if total is None:
+        try:
+            total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        except (ValueError, OSError, AttributeError):
+            total = None
+    return {"total_bytes": total, "available_bytes": values.get("MemAvailable")}
+
+
+def _probe_mps_fp16() -> bool:
+    """在 MPS 上实际跑一次 fp16 卷积,检查是否报错或产生 NaN"""
+    try:
+        conv = torch.nn.Conv2d(3, 8, 3, padding=1).to("mps").half()
+        with torch.inference_mode():
+            out = conv(torch.rand(1, 3, 32, 32, device="mps", dtype=torch.float16))
+        return bool(torch.isfinite(out).all().item())
+    except Exception:
+        return False
+
+
+def _probe_torch() -> Optional[Dict[str, Any]]:
+    if torch is None:
+        return None
+    info: Dict[str, Any] = {"version": torch.__version__, "cuda": [], "mps": None}
+    if torch.cuda.is_available():
+        for index in range(torch.cuda.device_count()):
+            props = torch.cuda.get_device_properties(index)
+            capability = (props.major, props.minor)
+            info["cuda"].append({
+                "index": index,
+                "name": props.name,
+                "compute_capability": f"{props.major}.{props.minor}",
+                "total_memory": props.total_memory,
+                # fp16 算术需要 5.3+,Tensor Core 加速需要 7.0+;更老的卡 fp16 反而更慢
+                "fp16": capability >= (7, 0),
+                "bf16": capability >= (8, 0),
+            })
+    elif getattr(torch.backends, "mps", None) is not None and torch.backends.mps.is_available():
+        setting = os.environ.get("MPS_FP16", "auto").lower()
+        fp16 = _probe_mps_fp16() if setting == "auto" else setting in ("1", "true", "yes")
+        info["mps"] = {"fp16": fp16}
+    try:
+        info["cpu_bf16"] = bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        info["cpu_bf16"] = False
+    return info
+
+
+def _probe_ort() -> Optional[Dict[str, Any]]:
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        return None
+    return {"version": ort.__version__, "providers": ort.get_available_providers()}
+
+
+@lru_cache(maxsize=1)
+def probe() -> Dict[str, Any]:
+    """探测设备能力(每个进程只执行一次)"""
+    return {
+        "cpu": _probe_cpu(),
+        "memory": _probe_memory(),
+        "torch": _probe_torch(),
+        "onnxruntime": _probe_ort(),
+    }
+
+
+def default_threads() -> int:
+    """
+    CPU 推理线程数:物理核心数(超线程对卷积推理收益很小),不超过进程可用核心数
+    INFERENCE_THREADS 可覆盖
+    """
+    override = int(os.environ.get("INFERENCE_THREADS", "0"))
+    if override > 0:
+        return override
+    cpu = probe()["cpu"]
+    return max(1, min(cpu.get("physical_cores") or cpu["logical_cores"], cpu["usable_cores"]))
+
+
+def _record(plan: ModelPlan) -> ModelPlan:
+    _PLANS[plan.model] = plan
+    print(f"   {plan.model}: device={plan.device}, precision={plan.precision}, threads={plan.threads}"
+          + (f", providers={plan.providers}" if plan.providers else ""))
+    return plan
+
+
+def plan_torch_model(model: str, device_type: str, cpu_mode: str = "fp32", threads: int = 0,
+                     allow_fp16: bool = True) -> ModelPlan:
+    """
+    为 PyTorch 模型选择精度与线程数
+
+    Args:
+        model: 模型名
+        device_type: 'cuda' / 'mps' / 'cpu'
+        cpu_mode: CPU 精度: fp32(默认)/ bf16 / auto(支持 bf16 时使用 bf16)
+        threads: CPU 线程数,0 表示自动
+        allow_fp16: 模型是否能在 GPU 上使用 fp16(数值不稳定的模型传 False)
+    """
+    caps = probe()
+    torch_info = caps["torch"] or {}
+    reasons = []
+    precision = "fp32"
+
+    if device_type == "cuda":
+        gpu = (torch_info.get("cuda") or [{}])[0]
+        if not allow_fp16:
+            reasons.append("模型不支持 fp16")
+        elif gpu.get("fp16"):
+            precision = "fp16"
+            reasons.append(f"GPU 计算能力 {gpu.get('compute_capability')} 支持 Tensor Core fp16")
+        else:
+            reasons.append(f"GPU 计算能力 {gpu.get('compute_capability')} 低于 7.0,fp16 无加速")
+    elif device_type == "mps":
+        if allow_fp16 and (torch_info.get("mps") or {}).get("fp16"):
+            precision = "fp16"
+            reasons.append("MPS fp16 实测可用")
+        else:
+            reasons.append("MPS fp16 不可用或模型不支持")
+    else:
+        if cpu_mode == "auto":
+            if torch_info.get("cpu_bf16"):
+                precision = "bf16"
+                reasons.append("CPU 支持 bf16 (AVX512-BF16 / AMX)")
+            else:
+                reasons.append("CPU 不支持 bf16")
+        else:
+            precision = cpu_mode
+            reasons.append("由配置指定")
+
+    return _record(ModelPlan(
+        model=model,
+        device=device_type,
+        precision=precision,
+        threads=threads or default_threads(),
+        reasons=reasons,
+    ))
+
+
+def plan_onnx_model(model: str, device: str = "auto", threads: int = 0, precision: str = "fp32") -> ModelPlan:
+    """
+    为 ONNX Runtime 模型选择 providers 与线程数
+
+    Args:
+        model: 模型名
+        device: 'auto' / 'cuda' / 'mps' / 'cpu';auto 使用所有可用的加速 provider
+        threads: CPU intra-op 线程数,0 表示自动
+        precision: 模型文件精度(fp32 / int8),仅用于记录
+    """
+    available = (probe()["onnxruntime"] or {}).get("providers", ["CPUExecutionProvider"])
+    if device == "cpu":
+        allowed = ("CPUExecutionProvider",)
+    elif device == "auto":
+        allowed = ORT_PROVIDER_PREFERENCE
+    else:
+        allowed = _DEVICE_PROVIDERS.get(device, ()) + ("CPUExecutionProvider",)
+    providers = [p for p in ORT_PROVIDER_PREFERENCE if p in allowed and p in available]
+    if "CPUExecutionProvider" not in providers:
+        providers.append("CPUExecutionProvider")
+
+    reasons = [f"可用 providers: {', '.join(available)}"]
+    if device not in ("auto", "cpu") and providers[0] == "CPUExecutionProvider":
+        reasons.append(f"{device} 没有可用的 provider,降级到 CPU")
+
+    return _record(ModelPlan(
+        model=model,
+        device="cpu" if providers[0] == "CPUExecutionProvider" else providers[0].replace("ExecutionProvider", "").lower(),
+        precision=precision,
+        threads=threads or default_threads(),
+        providers=providers,
+        reasons=reasons,
+    ))
+
+
+def get_plans() -> Dict[str, Dict[str, Any]]:
+    """已加载模型的推理配置决策"""
+    return {name: asdict(plan) for name, plan in _PLANS.items()}
@@ -1,6 +1,19 @@
-import torch
+try:
+    import torch
+except ImportError:  # ONNX 部署可不安装 torch
+    torch = None
+
+from .capabilities import probe
+
 
 class DeviceDetector:
+    @staticmethod
+    def get_capabilities():
+        """
+        设备能力详情(fp16 / bf16、ORT providers、CPU 指令集、核心数与内存),每个进程只探测一次
+        """
+        return probe()
+
     @staticmethod
     def get_device_info():
         """
@@ -9,6 +22,17 @@ class DeviceDetector:
         device_type = "cpu"
         device_name = "CPU"
         
+        if torch is None:
+            import onnxruntime as ort
+            if "CUDAExecutionProvider" in ort.get_available_providers():
+                device_type = "cuda"
+                device_name = "CUDA (ONNX Runtime)"
+            return {
+                "type": device_type,
+                "name": device_name,
+                "torch_version": None
+            }
+        
         if torch.cuda.is_available():
             device_type = "cuda"
             device_name = torch.cuda.get_device_name(0)
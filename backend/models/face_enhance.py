@@ -0,0 +1,233 @@
+"""
+人脸增强(GFPGAN)
+只处理超分结果中的人脸区域,而不是整张图:
+- 在缩小的原图上检测一次人脸,检测耗时与输出尺寸无关
+- 关键点映射到超分结果坐标,按 FFHQ 模板对齐裁剪为 512x512
+- 所有人脸拼成 batch 送入 GFPGAN(每批最多 FACE_BATCH_SIZE 张)
+- 修复结果与对齐裁剪的原人脸按 FACE_WEIGHT 混合
+- 按逆变换只在人脸所在区域贴回,边缘羽化融合
+没有检测到人脸时只付出一次小图检测的开销
+
+模型在第一次请求人脸增强时加载(见 models.get_face_enhancer),不使用该功能时不占用内存
+
+环境变量:
+    FACE_DETECT_SIZE   检测时原图缩放到的最长边(默认 640)
+    FACE_BATCH_SIZE    每批送入 GFPGAN 的人脸数(默认 8)
+    FACE_MODEL         GFPGAN 权重名(默认 GFPGANv1.4,位于 weights/)
+    FACE_WEIGHT        修复结果的混合权重 0~1(默认 0.5),0 保留超分结果中的原人脸,1 完全使用 GFPGAN 输出
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, Tuple
+
+import cv2
+import numpy as np
+
+FACE_SIZE = 512
+# FFHQ 对齐模板(512x512):左眼、右眼、鼻尖、左嘴角、右嘴角,与 facexlib 一致
+FACE_TEMPLATE = np.array([
+    [192.98138, 239.94708],
+    [318.90277, 240.19360],
+    [256.63416, 314.01935],
+    [201.26117, 371.41043],
+    [313.08905, 371.15118],
+], dtype=np.float32)
+# 超分结果中两眼间距小于该值(像素)的人脸太小,GFPGAN 无法改善,跳过
+MIN_EYE_DISTANCE = 12
+# 对齐裁剪越界部分的填充色(与 facexlib 相同)
+_BORDER_VALUE = (135, 133, 132)
+
+
+class FaceEnhancer:
+    """
+    人脸增强流程:检测 -> 对齐裁剪 -> 批量修复 -> 贴回
+    子类实现 _detect(小图检测)与 _restore(批量修复)
+
+    Args:
+        detect_size: 检测时原图缩放到的最长边
+        batch_size: 每批修复的人脸数
+        weight: 修复结果与原人脸的混合权重(0~1),1 表示完全使用修复结果
+    """
+
+    name = "face-enhance"
+
+    def __init__(self, detect_size: int = 640, batch_size: int = 8, weight: float = 1.0):
+        self.detect_size = detect_size
+        self.batch_size = max(1, batch_size)
+        self.weight = min(1.0, max(0.0, weight))
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.faces = 0
+        self.seconds = {"detect": 0.0, "restore": 0.0, "paste": 0.0}
+
+    def _detect(self, image: np.ndarray) -> np.ndarray:
+        """检测人脸关键点: RGB uint8 -> [N, 5, 2](图像坐标)"""
+        raise NotImplementedError
+
+    def _restore(self, faces: np.ndarray) -> np.ndarray:
+        """批量修复对齐后的人脸: [N, 512, 512, 3] RGB uint8 -> 同形状"""
+        raise NotImplementedError
+
+    def detect(self, image: np.ndarray) -> np.ndarray:
+        """在缩小的图像上检测,返回原图坐标的关键点 [N, 5, 2]"""
+        height, width = image.shape[:2]
+        ratio = min(1.0, self.detect_size / max(height, width))
+        if ratio < 1.0:
+            size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        landmarks = self._detect(image).reshape(-1, 5, 2).astype(np.float32)
+        return landmarks / ratio
+
+    def enhance(self, original: np.ndarray, upscaled: np.ndarray) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """
+        增强超分结果中的人脸
+
+        Args:
+            original: 超分前的原图(RGB uint8),用于检测
+            upscaled: 超分结果(RGB uint8)
+
+        Returns:
+            (增强后的图像, 统计 {faces, detect, restore, paste}(耗时单位秒))
+        """
+        stats: Dict[str, Any] = {"faces": 0, "detect": 0.0, "restore": 0.0, "paste": 0.0}
+
+        start = time.perf_counter()
+        landmarks = self.detect(original) * (upscaled.shape[1] / original.shape[1])
+        if len(landmarks):
+            eye_distance = np.linalg.norm(landmarks[:, 1] - landmarks[:, 0], axis=1)
+            landmarks = landmarks[eye_distance >= MIN_EYE_DISTANCE]
+        affines = [cv2.estimateAffinePartial2D(points, FACE_TEMPLATE, method=cv2.LMEDS)[0]
+                   for points in landmarks]
+        affines = [m for m in affines if m is not None]
+        stats["detect"] = time.perf_counter() - start
+
+        if affines:
+            start = time.perf_counter()
+            crops = np.stack([
+                cv2.warpAffine(upscaled, m, (FACE_SIZE, FACE_SIZE),
+                               borderMode=cv2.BORDER_CONSTANT, borderValue=_BORDER_VALUE)
+                for m in affines
+            ])
+            restored = np.concatenate([
+                self._restore(crops[i:i + self.batch_size]) for i in range(0, len(crops), self.batch_size)
+            ])
+            if self.weight < 1.0:
+                restored = [cv2.addWeighted(face, self.weight, crop, 1 - self.weight, 0)
+                            for face, crop in zip(restored, crops)]
+            stats["restore"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            if not upscaled.flags.writeable:
+                upscaled = upscaled.copy()
+            for face, m in zip(restored, affines):
+                _paste(upscaled, face, m)
+            stats["paste"] = time.perf_counter() - start
+            stats["faces"] = len(affines)
+
+        with self._lock:
+            self.requests += 1
+            self.faces += stats["faces"]
+            for key in self.seconds:
+                self.seconds[key] += stats[key]
+        return upscaled, stats
+
+    def get_info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "detect_size": self.detect_size,
+                "batch_size": self.batch_size,
+                "weight": self.weight,
+                "requests": self.requests,
+                "faces": self.faces,
+                "seconds": {key: round(value, 3) for key, value in self.seconds.items()},
+            }
+
+
+def _paste(image: np.ndarray, face: np.ndarray, affine: np.ndarray):
+    """把修复后的人脸按逆变换贴回 image(原地修改),只处理人脸覆盖的区域"""
+    height, width = image.shape[:2]
+    inverse = cv2.invertAffineTransform(affine)
+    corners = cv2.transform(
+        np.array([[[0, 0], [FACE_SIZE, 0], [0, FACE_SIZE], [FACE_SIZE, FACE_SIZE]]], np.float32), inverse
+    )[0]
+    x0, y0 = np.maximum(np.floor(corners.min(axis=0)).astype(int), 0)
+    x1, y1 = np.minimum(np.ceil(corners.max(axis=0)).astype(int) + 1, (width, height))
+    if x1 <= x0 or y1 <= y0:
+        return
+    inverse[:, 2] -= (x0, y0)
+    size = (int(x1 - x0), int(y1 - y0))
+    warped = cv2.warpAffine(face, inverse, size, flags=cv2.INTER_LINEAR)
+    mask = cv2.warpAffine(np.ones((FACE_SIZE, FACE_SIZE), np.float32), inverse, size, flags=cv2.INTER_LINEAR)
+
+    # 羽化宽度随人脸在输出中的大小变化(与 GFPGAN 贴回方式一致:先腐蚀再模糊)
+    edge = max(1, int(np.sqrt(mask.sum()) / 20))
+    mask = cv2.erode(mask, np.ones((2 * edge, 2 * edge), np.uint8))
+    mask = cv2.GaussianBlur(mask, (0, 0), edge)[..., None]
+    region = image[y0:y1, x0:x1]
+    region[:] = (warped * mask + region * (1 - mask) + 0.5).astype(np.uint8)
+
+
+class GFPGANFaceEnhancer(FaceEnhancer):
+    """
+    RetinaFace(facexlib)检测 + GFPGAN v1.x(clean 结构,不依赖自定义 CUDA 算子)修复
+
+    Args:
+        device: torch 设备类型('cuda' / 'mps' / 'cpu')
+        model_name: GFPGAN 权重名,从 weights/<model_name>.pth 加载(与超分模型相同的 mmap 权重存储)
+        weight: 修复结果与原人脸的混合权重,见 FaceEnhancer
+    """
+
+    name = "gfpgan"
+
+    def __init__(self, device: str = "cpu", model_name: str = "GFPGANv1.4", weight: float = 0.5, **kwargs):
+        super().__init__(weight=weight, **kwargs)
+        import torch
+        from facexlib.detection import init_detection_model
+        from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+        from .weights import WEIGHTS_DIR, load_state_dict
+
+        self._torch = torch
+        self.device = torch.device(device)
+        self.model_name = model_name
+        # 检测模型很小,首次使用时由 facexlib 下载到权重目录
+        self.detector = init_detection_model("retinaface_resnet50", half=False, device=self.device,
+                                             model_rootpath=str(WEIGHTS_DIR))
+        network = GFPGANv1Clean(
+            out_size=FACE_SIZE, num_style_feat=512, channel_multiplier=2, decoder_load_path=None,
+            fix_decoder=False, num_mlp=8, input_is_latent=True, different_w=True, narrow=1, sft_half=True,
+        )
+        network.load_state_dict(load_state_dict(model_name), strict=True)
+        # 与 GFPGANer 相同使用 fp32,StyleGAN 解码器在 fp16 下容易溢出
+        self.network = network.eval().to(self.device)
+        print(f"✓ GFPGAN 人脸增强已加载 ({model_name}, {self.device})")
+
+    def _detect(self, image: np.ndarray) -> np.ndarray:
+        with self._torch.inference_mode():
+            detections = self.detector.detect_faces(np.ascontiguousarray(image[..., ::-1]), 0.97)
+        if detections is None or len(detections) == 0:
+            return np.zeros((0, 5, 2), np.float32)
+        return np.asarray(detections)[:, 5:15]
+
+    def _restore(self, faces: np.ndarray) -> np.ndarray:
+        torch = self._torch
+        x = torch.from_numpy(faces).to(self.device).permute(0, 3, 1, 2).float().div_(127.5).sub_(1)
+        with torch.inference_mode():
+            out = self.network(x, return_rgb=False)[0]
+        out = out.clamp_(-1, 1).add_(1).mul_(127.5).round_()
+        return out.permute(0, 2, 3, 1).to(torch.uint8).cpu().numpy()
+
+    def get_info(self) -> Dict[str, Any]:
+        return {**super().get_info(), "model": self.model_name, "device": str(self.device)}
+
+
+def get_model(device: str = "cpu") -> GFPGANFaceEnhancer:
+    """按环境变量创建 GFPGAN 人脸增强"""
+    return GFPGANFaceEnhancer(
+        device=device,
+        model_name=os.environ.get("FACE_MODEL", "GFPGANv1.4"),
+        weight=float(os.environ.get("FACE_WEIGHT", "0.5")),
+        detect_size=int(os.environ.get("FACE_DETECT_SIZE", "640")),
+        batch_size=int(os.environ.get("FACE_BATCH_SIZE", "8")),
+    )
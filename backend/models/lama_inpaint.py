@@ -6,9 +6,14 @@ LaMa (Resolution-robust Large Mask Inpainting) 实现
 import torch
 import numpy as np
 from PIL import Image
+from pathlib import Path
 from typing import Optional
 import os
 
+from .profiling import torch_profiler
+from .telea import inpaint_telea
+from .weights import verify_file
+
 
 class LamaInpaint:
     """LaMa Inpainting 模型"""
@@ -35,28 +40,13 @@ class LamaInpaint:
         # 检查模型文件
         if model_path and os.path.exists(model_path):
             try:
-                # 加载预训练模型
-                checkpoint = torch.load(model_path, map_location=self.device)
-                
-                # 提取模型状态
-                if 'state_dict' in checkpoint:
-                    state_dict = checkpoint['state_dict']
-                elif 'model' in checkpoint:
-                    state_dict = checkpoint['model']
-                else:
-                    state_dict = checkpoint
-                
-                # 创建模型（使用 torch.jit.load 如果是 TorchScript 模型）
-                if model_path.endswith('.pt') or model_path.endswith('.pth'):
-                    try:
-                        self.model = torch.jit.load(model_path, map_location=self.device)
-                        print(f"✓ 加载 TorchScript 模型成功")
-                    except:
-                        # 如果不是 TorchScript，则尝试普通加载
-                        raise Exception("需要原始 PyTorch 模型")
-                else:
+                if not (model_path.endswith('.pt') or model_path.endswith('.pth')):
                     raise Exception(f"不支持的模型格式: {model_path}")
-                    
+                # 校验结果缓存,文件未变化时不重新计算哈希
+                verify_file(Path(model_path))
+                # big-lama.pt 是 TorchScript 模型,只加载一次(不再先 torch.load 再 torch.jit.load)
+                self.model = torch.jit.load(model_path, map_location=self.device)
+                print(f"✓ 加载 TorchScript 模型成功")
                 self.model.eval()
                 self.model_loaded = True
                 print(f"✓ LaMa 模型加载成功")
@@ -70,6 +60,10 @@ class LamaInpaint:
             print(f"⚠️  将使用简单的修复策略（仅供测试）")
             self.model_loaded = False
     
+    def profiler(self):
+        """torch.profiler 剖析一次推理"""
+        return torch_profiler(self.device)
+
     def get_info(self) -> dict:
         """获取模型信息"""
         return {
@@ -92,8 +86,8 @@ class LamaInpaint:
         # 将 mask 转为二值图像
         _, mask_binary = cv2.threshold(mask_array, 127, 255, cv2.THRESH_BINARY)
         
-        # 使用 OpenCV 的 inpaint 功能
-        result = cv2.inpaint(img_array, mask_binary, inpaintRadius=3, flags=cv2.INPAINT_TELEA)
+        # 使用 OpenCV Telea(按连通域并行,大面积遮罩使用金字塔加速)
+        result = inpaint_telea(img_array, mask_binary, radius=3)
         
         return Image.fromarray(result)
     
@@ -7,6 +7,8 @@ import numpy as np
 from PIL import Image
 from typing import Tuple
 
+from .capabilities import plan_onnx_model
+
 
 class MIGANONNXModel:
     """MI-GAN Inpaint 模型(ONNX Runtime 实现)"""
@@ -17,22 +19,15 @@ class MIGANONNXModel:
         
         Args:
             model_path: ONNX 模型文件路径
-            device: 'cuda' 或 'cpu'
+            device: 'cuda' / 'mps' / 'cpu' / 'auto'
         """
-        # 配置 execution providers
-        providers = []
-        if device == "cuda":
-            available_providers = ort.get_available_providers()
-            if "CUDAExecutionProvider" in available_providers:
-                providers.append("CUDAExecutionProvider")
-                print("✓ 使用 CUDA 加速")
-            else:
-                print("⚠️  CUDA 不可用,降级到 CPU")
-        
-        providers.append("CPUExecutionProvider")
+        # 按设备能力选择 execution providers 与线程数(CUDA / ROCm / CoreML / DirectML)
+        self.plan = plan_onnx_model("MI-GAN", device)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.plan.threads
         
         # 加载模型
-        self.session = ort.InferenceSession(model_path, providers=providers)
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=self.plan.providers)
         self.actual_device = "cuda" if "CUDAExecutionProvider" in self.session.get_providers() else "cpu"
         
         print(f"✓ MI-GAN ONNX 模型加载成功 (设备: {self.actual_device})")
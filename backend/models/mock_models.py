@@ -0,0 +1,204 @@
+"""
+Mock 模型(压测 / 无权重环境使用)
+接口与 RealESRGANModel、LamaInpaint、GFPGANFaceEnhancer 保持一致,用 PIL 缩放和 OpenCV 修复
+代替真实推理,并按像素数模拟推理耗时
+
+通过环境变量 INPAINT_MOCK_MODELS=1 启用
+"""
+import os
+import time
+import numpy as np
+from PIL import Image
+
+from .face_enhance import FaceEnhancer
+from .tiling import clip_roi, tile_grid
+
+
+def _simulated_delay(pixels: int, mpix_per_sec: float) -> float:
+    """按处理的像素数估算模拟耗时(秒)"""
+    if mpix_per_sec <= 0:
+        return 0.0
+    return pixels / 1e6 / mpix_per_sec
+
+
+class MockUpscaleModel:
+    """模拟 Real-ESRGAN 超分辨率模型"""
+
+    def __init__(self, mpix_per_sec: float = None, scale: int = 4, tile: int = 400,
+                 model_name: str = "mock-upscale"):
+        """
+        Args:
+            mpix_per_sec: 模拟吞吐量(每秒处理的输入百万像素),
+                          默认读取 MOCK_UPSCALE_MPIX_PER_SEC,0 表示不等待
+            scale: 模型原生放大倍数
+            tile: 模拟的瓦片大小(按瓦片分段等待)
+            model_name: 模型名称(模拟降级档位时区分)
+        """
+        if mpix_per_sec is None:
+            mpix_per_sec = float(os.environ.get("MOCK_UPSCALE_MPIX_PER_SEC", "0.5"))
+        self.mpix_per_sec = mpix_per_sec
+        self.scale = scale
+        self.tile = tile
+        self.model_name = model_name
+        self.device = "cpu"
+        print(f"✓ Mock 超分模型已加载 ({mpix_per_sec} MPix/s)")
+
+    def enhance(self, img, outscale=4, cancel_check=None, on_tile=None, roi=None):
+        """
+        模拟超分辨率处理
+
+        Args:
+            img: PIL Image 或 numpy 数组(RGB / RGBA)
+            outscale: 放大倍数
+            cancel_check: 模拟瓦片之间的取消检查,请求已取消时抛出异常
+            on_tile: 每个模拟瓦片完成后调用 (瓦片, 开始, 结束)
+            roi: 只放大原图中的区域 (x, y, 宽, 高),只模拟与其相交的瓦片
+
+        Returns:
+            PIL Image: 放大后的图像(指定 roi 时为该区域)
+        """
+        if not hasattr(img, 'mode'):
+            img = Image.fromarray(np.asarray(img))
+
+        width, height = img.size
+        tiles = tile_grid(height, width, self.tile, 10)
+        if img.mode == "RGBA":
+            # 同 TiledUpscaler:完全透明的瓦片不推理
+            alpha = np.asarray(img.getchannel("A"))
+            tiles = [t for t in tiles if alpha[t.pad_y0:t.pad_y1, t.pad_x0:t.pad_x1].any()]
+        if roi is not None:
+            x, y, w, h = clip_roi(roi, width, height)
+            tiles = [t for t in tiles if t.x0 < x + w and t.x1 > x and t.y0 < y + h and t.y1 > y]
+            img = img.crop((x, y, x + w, y + h))
+            width, height = w, h
+        for tile in tiles:
+            self._simulate(tile, cancel_check, on_tile)
+        return img.resize((int(width * outscale), int(height * outscale)), Image.BICUBIC)
+
+    def _simulate(self, tile, cancel_check=None, on_tile=None):
+        """模拟一个瓦片的推理,按 0.05 秒分段等待以便及时响应取消"""
+        start = time.perf_counter()
+        pixels = (tile.pad_x1 - tile.pad_x0) * (tile.pad_y1 - tile.pad_y0)
+        deadline = start + _simulated_delay(pixels, self.mpix_per_sec)
+        while True:
+            if cancel_check is not None:
+                cancel_check()
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            time.sleep(min(0.05, remaining))
+        if on_tile is not None:
+            on_tile(tile, start, time.perf_counter())
+
+    def enhance_to(self, img, out, cancel_check=None, on_tile=None, on_rows=None):
+        """
+        模拟大图模式:逐瓦片缩放后写入输出画布 out (H*scale, W*scale, 3)
+
+        Args:
+            img: RGB uint8 数组
+            on_rows: 每写完一行瓦片以输出行范围 (y0, y1) 调用
+        """
+        img = np.asarray(img)
+        height, width = img.shape[:2]
+        s = self.scale
+        tiles = tile_grid(height, width, self.tile, 10)
+        for i, tile in enumerate(tiles):
+            self._simulate(tile, cancel_check, on_tile)
+            part = Image.fromarray(img[tile.y0:tile.y1, tile.x0:tile.x1])
+            size = ((tile.x1 - tile.x0) * s, (tile.y1 - tile.y0) * s)
+            out[tile.y0 * s:tile.y1 * s, tile.x0 * s:tile.x1 * s] = np.asarray(part.resize(size, Image.BICUBIC))
+            if on_rows is not None and (i + 1 == len(tiles) or tiles[i + 1].y0 != tile.y0):
+                on_rows(tile.y0 * s, tile.y1 * s)
+
+    def get_info(self):
+        return {
+            "name": self.model_name,
+            "device": self.device,
+            "mock": True
+        }
+
+
+class MockInpaintModel:
+    """模拟 Inpaint 模型(内部使用 OpenCV Telea)"""
+
+    def __init__(self, mpix_per_sec: float = None, model_name: str = "mock-inpaint"):
+        """
+        Args:
+            mpix_per_sec: 模拟吞吐量,默认读取 MOCK_INPAINT_MPIX_PER_SEC,0 表示不等待
+            model_name: 模型名称(模拟降级档位时区分)
+        """
+        if mpix_per_sec is None:
+            mpix_per_sec = float(os.environ.get("MOCK_INPAINT_MPIX_PER_SEC", "4"))
+        self.mpix_per_sec = mpix_per_sec
+        self.model_name = model_name
+        self.actual_device = "cpu"
+        print(f"✓ Mock Inpaint 模型已加载 ({mpix_per_sec} MPix/s)")
+
+    def get_info(self) -> dict:
+        return {
+            "name": self.model_name,
+            "device": self.actual_device,
+            "mock": True
+        }
+
+    def inpaint(self, image: Image.Image, mask: Image.Image) -> Image.Image:
+        """
+        模拟 Inpaint 修复
+
+        Args:
+            image: 原始图片(PIL Image, RGB)
+            mask: 遮罩图片(PIL Image, L/灰度, 白色=需要修复的区域)
+
+        Returns:
+            修复后的图片(PIL Image)
+        """
+        import cv2
+
+        width, height = image.size
+        time.sleep(_simulated_delay(width * height, self.mpix_per_sec))
+
+        img_array = np.array(image.convert('RGB'))
+        mask_array = np.array(mask.convert('L'))
+        _, mask_binary = cv2.threshold(mask_array, 127, 255, cv2.THRESH_BINARY)
+        result = cv2.inpaint(img_array, mask_binary, inpaintRadius=3, flags=cv2.INPAINT_TELEA)
+        return Image.fromarray(result)
+
+
+class MockFaceEnhancer(FaceEnhancer):
+    """
+    模拟 GFPGAN 人脸增强:用肤色区域近似人脸检测,修复阶段按人脸数模拟耗时,
+    对齐裁剪、分批与贴回与真实实现相同
+    """
+
+    name = "mock-face-enhance"
+
+    def __init__(self, seconds_per_face: float = None, **kwargs):
+        """
+        Args:
+            seconds_per_face: 每张人脸的模拟修复耗时,默认读取 MOCK_FACE_SECONDS
+        """
+        super().__init__(**kwargs)
+        if seconds_per_face is None:
+            seconds_per_face = float(os.environ.get("MOCK_FACE_SECONDS", "0.05"))
+        self.seconds_per_face = seconds_per_face
+        print(f"✓ Mock 人脸增强已加载 ({seconds_per_face}s/face)")
+
+    def _detect(self, image: np.ndarray) -> np.ndarray:
+        import cv2
+
+        ycrcb = cv2.cvtColor(image, cv2.COLOR_RGB2YCrCb)
+        skin = cv2.inRange(ycrcb, (40, 140, 85), (240, 175, 130))
+        count, _, boxes, _ = cv2.connectedComponentsWithStats(skin)
+        min_area = image.shape[0] * image.shape[1] * 0.002
+        landmarks = []
+        for x, y, w, h, area in boxes[1:count]:
+            if area < min_area or not 0.5 < w / h < 1.5:
+                continue
+            # 按人脸框的典型比例估算五个关键点
+            landmarks.append([(x + w * fx, y + h * fy) for fx, fy in
+                              ((0.32, 0.40), (0.68, 0.40), (0.50, 0.58), (0.36, 0.74), (0.64, 0.74))])
+        return np.array(landmarks, np.float32).reshape(-1, 5, 2)
+
+    def _restore(self, faces: np.ndarray) -> np.ndarray:
+        time.sleep(self.seconds_per_face * len(faces))
+        return faces
@@ -7,6 +7,8 @@ import numpy as np
 from PIL import Image
 from typing import Tuple
 
+from .telea import inpaint_telea
+
 
 class OpenCVInpaint:
     """OpenCV Inpainting 模型"""
@@ -25,7 +27,7 @@ class OpenCVInpaint:
         """获取模型信息"""
         return {
             "name": "OpenCV Inpainting",
-            "algorithm": "Telea",
+            "algorithm": "Telea (parallel + pyramid)",
             "device": "cpu"
         }
     
@@ -54,23 +56,13 @@ class OpenCVInpaint:
         elif img_array.shape[2] == 4:
             img_array = cv2.cvtColor(img_array, cv2.COLOR_RGBA2RGB)
         
-        # OpenCV 使用 BGR 格式
-        img_bgr = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-        
-        print(f"   OpenCV Inpaint 处理: {img_bgr.shape}")
+        print(f"   OpenCV Inpaint 处理: {img_array.shape}")
         print(f"   mask 非零像素: {np.count_nonzero(mask_array)}/{mask_array.size}")
         
-        # 使用 Telea 算法进行修复
+        # 使用 Telea 算法进行修复(按连通域并行,大面积遮罩使用金字塔加速)
         # inpaintRadius: 修复半径,越大修复范围越广但速度越慢
-        result_bgr = cv2.inpaint(
-            img_bgr,
-            mask_array,
-            inpaintRadius=5,  # 修复半径
-            flags=cv2.INPAINT_TELEA  # 使用 Telea 算法
-        )
-        
-        # 转回 RGB
-        result_rgb = cv2.cvtColor(result_bgr, cv2.COLOR_BGR2RGB)
+        # Telea 的权重只取决于几何位置,各通道独立插值,RGB 与 BGR 结果相同,无需转换
+        result_rgb = inpaint_telea(img_array, mask_array, radius=5)
         
         # 转换为 PIL Image
         result_image = Image.fromarray(result_rgb)
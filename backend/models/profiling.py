@@ -0,0 +1,39 @@
+"""
+推理后端自带 profiler 的封装
+模型的 profiler() 返回上下文管理器,退出后列表中是 Chrome trace 事件,
+由 serving.profiling.Trace 合并到请求的 trace 中
+"""
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+
+def load_trace_events(path: str) -> List[Dict[str, Any]]:
+    """读取 Chrome trace 文件并删除(ONNX Runtime 输出事件列表,torch 输出 {"traceEvents": [...]})"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    finally:
+        os.unlink(path)
+    return data.get("traceEvents", []) if isinstance(data, dict) else data
+
+
+@contextmanager
+def torch_profiler(device_type: str):
+    """torch.profiler 剖析:记录 CPU 算子,CUDA 设备上同时记录 CUDA kernel"""
+    import torch
+    from torch.profiler import ProfilerActivity, profile
+
+    activities = [ProfilerActivity.CPU]
+    if device_type == "cuda" and torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+    events: List[Dict[str, Any]] = []
+    prof = profile(activities=activities)
+    with prof:
+        yield events
+    fd, path = tempfile.mkstemp(prefix="torch-profile-", suffix=".json")
+    os.close(fd)
+    prof.export_chrome_trace(path)
+    events.extend(load_trace_events(path))
@@ -1,14 +1,83 @@
 import os
+import numpy as np
 import torch
-from pathlib import Path
 from basicsr.archs.rrdbnet_arch import RRDBNet
-from realesrgan import RealESRGANer
 from .device import DeviceDetector
+from .capabilities import plan_torch_model
+from .profiling import torch_profiler
+from .tile_cache import get_tile_cache
+from .tiling import TiledUpscaler
+from .weights import load_state_dict
+
+# CPU 推理模式
+# fp32: 默认精度,启用 channels_last / inference_mode / 线程控制
+# bf16: 在 fp32 基础上使用 bfloat16 autocast(需要 CPU 支持 AVX512-BF16 / AMX),输出与 fp32 有差异
+# auto: 按设备能力探测结果选择(支持 bf16 时使用 bf16)
+# bf16 会改变输出,默认不启用,需显式配置 bf16 或 auto
+CPU_MODES = ("fp32", "bf16", "auto")
+
+# 各权重文件对应的 RRDBNet 结构参数
+RRDB_CONFIGS = {
+    "RealESRGAN_x4plus": dict(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4),
+    "RealESRGAN_x4plus_anime_6B": dict(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=6, num_grow_ch=32, scale=4),
+    "RealESRGAN_x2plus": dict(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=2),
+}
+
+
+class _CPUOptimizedModule(torch.nn.Module):
+    """
+    CPU 推理包装:输入转为 channels_last,可选 bf16 autocast,输出恢复为 fp32 连续内存
+    权重保持 mmap 加载时的布局(转换为 channels_last 会在每个进程产生一份私有拷贝),
+    输入为 channels_last 时卷积输出同样是 channels_last
+    """
+
+    def __init__(self, module: torch.nn.Module, bf16: bool = False):
+        super().__init__()
+        self.module = module
+        self.bf16 = bf16
+
+    def forward(self, x):
+        x = x.contiguous(memory_format=torch.channels_last)
+        if self.bf16:
+            with torch.autocast("cpu", dtype=torch.bfloat16):
+                out = self.module(x)
+            out = out.float()
+        else:
+            out = self.module(x)
+        return out.contiguous()
+
+
+def _cpu_bf16_supported() -> bool:
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
 
 class RealESRGANModel:
-    def __init__(self, model_name="RealESRGAN_x4plus", device=None):
+    def __init__(self, model_name="RealESRGAN_x4plus", device=None,
+                 cpu_mode="fp32", cpu_threads=0, tile=400):
+        """
+        Args:
+            model_name: 权重文件名(不含扩展名)
+            device: torch.device,默认自动检测
+            cpu_mode: CPU 推理模式,见 CPU_MODES(仅在 CPU 设备上生效)
+            cpu_threads: CPU 推理线程数,0 表示按物理核心数自动选择
+            tile: 瓦片大小,0 表示整图推理
+        """
+        if cpu_mode == "int8":
+            raise ValueError(
+                "int8 仅适用于 ONNX 后端,请使用 UPSCALE_BACKEND=onnx REALESRGAN_ONNX_PRECISION=int8"
+            )
+        if cpu_mode not in CPU_MODES:
+            raise ValueError(f"不支持的 CPU 模式: {cpu_mode},可选: {CPU_MODES}")
         self.model_name = model_name
         self.device = device if device else self._get_default_device()
+        # 按设备能力选择精度与线程数(GPU: fp16 / fp32, CPU: bf16 / fp32)
+        self.plan = plan_torch_model(self.model_name, self.device.type, cpu_mode, cpu_threads)
+        self.cpu_mode = self.plan.precision if self.device.type == 'cpu' else cpu_mode
+        self.cpu_threads = self.plan.threads
+        self.tile = tile
         self.model = self._load_model()
 
     def _get_default_device(self):
@@ -16,53 +85,80 @@ class RealESRGANModel:
         return torch.device(info["type"])
 
     def _load_model(self):
-        # 模型路径
-        weights_dir = Path(__file__).parent.parent / "weights"
-        model_path = weights_dir / f"{self.model_name}.pth"
-        
-        if not model_path.exists():
-            raise FileNotFoundError(f"Model file not found at: {model_path}")
+        # 按权重名称选择 RRDBNet 配置
+        config = RRDB_CONFIGS[self.model_name]
+        network = RRDBNet(**config)
+
+        # 权重以 mmap 方式加载(首次使用时由 .pth 转换为 safetensors),多个 Worker 共享页缓存
+        state_dict = load_state_dict(self.model_name)
+        try:
+            # assign=True 直接使用 mmap 张量作为参数,不再复制一份
+            network.load_state_dict(state_dict, strict=True, assign=True)
+        except TypeError:  # torch < 2.1
+            network.load_state_dict(state_dict, strict=True)
+        network.eval()
+
+        if self.device.type == 'cpu':
+            network = self._optimize_for_cpu(network)
+        else:
+            network = network.to(self.device)
+            if self.plan.precision == 'fp16':  # 仅在探测确认 fp16 可用的 GPU 上启用
+                network = network.half()
+        self.network = network
 
-        # RealESRGAN_x4plus配置
-        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
-        
         # IMPORTANT: 默认使用 tile 模式以避免显存不足
         # GTX 1070 8GB 建议使用 tile=400，可根据实际显存调整
         # tile=0 表示不使用 tile，适合大显存 GPU
-        upsampler = RealESRGANer(
-            scale=4,
-            model_path=str(model_path),
-            model=model,
-            tile=400,  # 默认使用 tile 模式，避免大图像导致 OOM
+        return TiledUpscaler(
+            self._infer,
+            scale=config["scale"],
+            tile=self.tile,  # 默认 400,使用 tile 模式避免大图像导致 OOM
             tile_pad=10,
             pre_pad=0,
-            half=True if self.device.type != 'cpu' else False, # CPU 不支持 half
-            device=self.device,
+            # 输入未变化的瓦片复用上次的输出(如 inpaint 一小块后重新放大)
+            cache=get_tile_cache(),
+            variant=f"{self.model_name}/{self.device.type}/{self.plan.precision}",
         )
-        return upsampler
 
-    def enhance(self, img, outscale=4):
+    def _infer(self, chw: np.ndarray) -> np.ndarray:
+        """单个瓦片推理: [1, 3, H, W] float32 -> [1, 3, H*scale, W*scale] float32"""
+        x = torch.from_numpy(chw).to(self.device)
+        if self.plan.precision == 'fp16' and self.device.type != 'cpu':
+            x = x.half()
+        with torch.inference_mode():
+            out = self.network(x)
+        return out.float().cpu().numpy()
+
+    def _optimize_for_cpu(self, network):
+        """CPU 吞吐优化:线程数控制、channels_last 内存布局、可选 bf16"""
+        if self.cpu_threads > 0:
+            torch.set_num_threads(self.cpu_threads)
+        
+        if self.cpu_mode == 'bf16' and not _cpu_bf16_supported():
+            print(f"⚠️  CPU 不支持 bf16,使用 fp32")
+            self.cpu_mode = 'fp32'
+            self.plan.precision = 'fp32'
+        
+        print(f"✓ CPU 推理模式: {self.cpu_mode}, 线程数: {torch.get_num_threads()}, tile: {self.tile}")
+        return _CPUOptimizedModule(network, bf16=self.cpu_mode == 'bf16').eval()
+
+    def enhance(self, img, outscale=4, cancel_check=None, on_tile=None, roi=None):
         """
         执行超分辨率处理
         
         Args:
-            img: PIL Image 或 numpy 数组（BGR 格式）
+            img: PIL Image 或 numpy 数组(RGB / RGBA 格式)
             outscale: 放大倍数
+            cancel_check: 每个瓦片之前调用,请求已取消时抛出异常(不是 RuntimeError,不会触发 OOM 重试)
+            on_tile: 每个瓦片推理完成后调用 (瓦片, 开始, 结束),用于性能剖析
+            roi: 只放大原图中的区域 (x, y, 宽, 高),只推理与其相交的瓦片
             
         Returns:
-            PIL Image: 放大后的图像
+            PIL Image: 放大后的图像(指定 roi 时为该区域)
         """
-        import numpy as np
         from PIL import Image
         
-        # 如果是 PIL Image，转换为 numpy 数组（BGR 格式）
-        if hasattr(img, 'mode'):  # PIL Image
-            # PIL Image 是 RGB 格式，需要转换为 BGR（OpenCV 格式）
-            img_np = np.array(img)
-            if len(img_np.shape) == 3 and img_np.shape[2] == 3:
-                img_np = img_np[:, :, ::-1]  # RGB -> BGR
-        else:
-            img_np = img
+        img_np = np.array(img) if hasattr(img, 'mode') else img
         
         try:
             # 处理前清理 CUDA 缓存
@@ -71,12 +167,9 @@ class RealESRGANModel:
                 import gc
                 gc.collect()
             
-            output, _ = self.model.enhance(img_np, outscale=outscale)
-            
-            # 将输出从 BGR 转换回 RGB，然后转为 PIL Image
-            if len(output.shape) == 3 and output.shape[2] == 3:
-                output = output[:, :, ::-1]  # BGR -> RGB
-            
+            # RGBA 输入只对 RGB 推理,alpha 用引导滤波放大
+            output = self.model.enhance(img_np, outscale=outscale, cancel_check=cancel_check,
+                                        on_tile=on_tile, roi=roi, alpha_upsampler="guided")
             return Image.fromarray(output)
         except RuntimeError as e:
             if "CUDA out of memory" in str(e) or "out of memory" in str(e).lower():
@@ -95,14 +188,11 @@ class RealESRGANModel:
                     try:
                         print(f"   尝试 tile={tile_size}...")
                         self.model.tile = tile_size
-                        output, _ = self.model.enhance(img_np, outscale=outscale)
+                        output = self.model.enhance(img_np, outscale=outscale, cancel_check=cancel_check,
+                                                    on_tile=on_tile, roi=roi, alpha_upsampler="guided")
                         
                         # 恢复原始设置
                         self.model.tile = original_tile
-                        
-                        # 转换回 RGB 和 PIL Image
-                        if len(output.shape) == 3 and output.shape[2] == 3:
-                            output = output[:, :, ::-1]
                         return Image.fromarray(output)
                     except RuntimeError:
                         # 继续尝试更小的 tile
@@ -117,11 +207,49 @@ class RealESRGANModel:
                 )
             raise e
 
+    def enhance_to(self, img, out, cancel_check=None, on_tile=None, on_rows=None):
+        """
+        大图模式:按模型原生倍数放大,瓦片结果直接写入输出画布 out(不分配整张输出)
+
+        Args:
+            img: RGB uint8 数组
+            out: (H*scale, W*scale, 3) uint8 数组,通常为磁盘上的内存映射画布
+            on_rows: 每写完一行瓦片以输出行范围 (y0, y1) 调用
+        """
+        if self.device.type == 'cuda':
+            torch.cuda.empty_cache()
+        self.model.enhance_to(np.asarray(img), out, cancel_check=cancel_check,
+                              on_tile=on_tile, on_rows=on_rows)
+
+    def profiler(self):
+        """torch.profiler 剖析一次推理"""
+        return torch_profiler(self.device.type)
+
     def get_info(self):
-        return {
+        info = {
             "name": self.model_name,
-            "device": str(self.device)
+            "device": str(self.device),
+            "precision": self.plan.precision,
+            "tile": self.tile
         }
+        if self.model.cache is not None:
+            info["tile_cache"] = self.model.cache.stats()
+        if self.device.type == 'cpu':
+            info["cpu_mode"] = self.cpu_mode
+            info["cpu_threads"] = torch.get_num_threads()
+        return info
 
-def get_model():
-    return RealESRGANModel()
+def get_model(model_name: str = "RealESRGAN_x4plus"):
+    """
+    创建超分模型(默认 x4plus),CPU 相关参数通过环境变量配置:
+        REALESRGAN_CPU_MODE     CPU 推理模式(fp32 / bf16 / auto),默认 fp32;int8 量化仅 ONNX 后端支持
+        REALESRGAN_CPU_THREADS  CPU 推理线程数,默认 0(按物理核心数自动选择)
+        REALESRGAN_TILE         瓦片大小,默认 400
+        REALESRGAN_TILE_CACHE_MB  瓦片结果缓存大小(MB),默认 512,0 表示关闭
+    """
+    return RealESRGANModel(
+        model_name=model_name,
+        cpu_mode=os.environ.get("REALESRGAN_CPU_MODE", "fp32"),
+        cpu_threads=int(os.environ.get("REALESRGAN_CPU_THREADS", "0")),
+        tile=int(os.environ.get("REALESRGAN_TILE", "400")),
+    )
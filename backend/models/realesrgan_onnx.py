@@ -0,0 +1,170 @@
+"""
+Real-ESRGAN ONNX Runtime 超分辨率模型
+不依赖 torch / basicsr / realesrgan,瓦片行为与 RealESRGANModel 一致
+ONNX 文件由 export_onnx.py 从 .pth 权重导出
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+import onnxruntime as ort
+from PIL import Image
+
+from .capabilities import plan_onnx_model
+from .profiling import load_trace_events
+from .tile_cache import get_tile_cache
+from .tiling import TiledUpscaler
+
+# ONNX 模型文件精度(REALESRGAN_ONNX_PRECISION),仅在 CPU 上生效
+# fp32: 默认,使用 <model_name>.onnx
+# int8: 使用 export_onnx.py --int8 导出的动态量化模型 <model_name>_int8.onnx
+ONNX_PRECISIONS = ("fp32", "int8")
+
+
+class RealESRGANONNXModel:
+    """Real-ESRGAN 超分辨率模型(ONNX Runtime 实现)"""
+
+    def __init__(self, model_path: str, device: str = "cpu", tile: int = 400,
+                 tile_pad: int = 10, pre_pad: int = 0, num_threads: int = 0):
+        """
+        初始化 ONNX 模型
+
+        Args:
+            model_path: ONNX 模型文件路径
+            device: 'cuda' / 'mps' / 'cpu' / 'auto'(使用所有可用的加速 provider)
+            tile: 瓦片大小,0 表示整图推理
+            tile_pad: 瓦片边缘填充
+            pre_pad: 整图预填充
+            num_threads: CPU intra-op 线程数,0 表示按物理核心数自动选择
+        """
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model file not found at: {model_path}")
+
+        self.model_path = model_path
+        self.model_name = os.path.splitext(os.path.basename(model_path))[0]
+
+        # 按设备能力选择 execution providers 与线程数
+        self.plan = plan_onnx_model(
+            self.model_name, device, num_threads,
+            precision="int8" if self.model_name.endswith("_int8") else "fp32"
+        )
+
+        self.session = ort.InferenceSession(
+            model_path, sess_options=self._session_options(), providers=self.plan.providers
+        )
+        self.actual_device = "cuda" if "CUDAExecutionProvider" in self.session.get_providers() else "cpu"
+        self.device = self.actual_device
+        self.input_name = self.session.get_inputs()[0].name
+
+        # 导出时写入的元数据:放大倍数
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.scale = int(metadata.get("scale", 4))
+
+        self.upsampler = TiledUpscaler(
+            self._infer, scale=self.scale, tile=tile, tile_pad=tile_pad, pre_pad=pre_pad,
+            cache=get_tile_cache(), variant=f"{self.model_name}.onnx/{self.actual_device}/{self.plan.precision}"
+        )
+        print(f"✓ Real-ESRGAN ONNX 模型加载成功 ({self.model_name}, 设备: {self.actual_device})")
+
+    def _session_options(self) -> ort.SessionOptions:
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = self.plan.threads
+        return options
+
+    @contextmanager
+    def profiler(self):
+        """
+        ONNX Runtime profiling:只能在创建会话时开启,因此每次剖析创建一个开启 profiling 的
+        临时会话,期间代替常规会话(同一模型的调用是串行的)
+        """
+        options = self._session_options()
+        options.enable_profiling = True
+        options.profile_file_prefix = os.path.join(tempfile.gettempdir(), f"ort-profile-{os.getpid()}")
+        session = ort.InferenceSession(self.model_path, sess_options=options, providers=self.plan.providers)
+        events = []
+        original, self.session = self.session, session
+        try:
+            yield events
+        finally:
+            self.session = original
+            events.extend(load_trace_events(session.end_profiling()))
+
+    def _infer(self, tile: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: tile.astype(np.float32)})[0]
+
+    def enhance(self, img, outscale=4, cancel_check=None, on_tile=None, roi=None):
+        """
+        执行超分辨率处理
+
+        Args:
+            img: PIL Image 或 numpy 数组(RGB / RGBA 格式)
+            outscale: 放大倍数
+            cancel_check: 每个瓦片之前调用,请求已取消时抛出异常
+            on_tile: 每个瓦片推理完成后调用 (瓦片, 开始, 结束),用于性能剖析
+            roi: 只放大原图中的区域 (x, y, 宽, 高),只推理与其相交的瓦片
+
+        Returns:
+            PIL Image: 放大后的图像(指定 roi 时为该区域)
+        """
+        img_np = np.array(img) if hasattr(img, 'mode') else img
+        # RGBA 输入只对 RGB 推理,alpha 用引导滤波放大
+        output = self.upsampler.enhance(img_np, outscale=outscale, cancel_check=cancel_check,
+                                        on_tile=on_tile, roi=roi, alpha_upsampler="guided")
+        return Image.fromarray(output)
+
+    def enhance_to(self, img, out, cancel_check=None, on_tile=None, on_rows=None):
+        """
+        大图模式:按模型原生倍数放大,瓦片结果直接写入输出画布 out(不分配整张输出)
+
+        Args:
+            img: RGB uint8 数组
+            out: (H*scale, W*scale, 3) uint8 数组,通常为磁盘上的内存映射画布
+            on_rows: 每写完一行瓦片以输出行范围 (y0, y1) 调用
+        """
+        self.upsampler.enhance_to(np.asarray(img), out, cancel_check=cancel_check,
+                                  on_tile=on_tile, on_rows=on_rows)
+
+    def get_info(self):
+        info = {
+            "name": self.model_name,
+            "backend": "onnxruntime",
+            "device": self.actual_device,
+            "providers": self.session.get_providers(),
+            "precision": self.plan.precision,
+            "threads": self.plan.threads,
+            "tile": self.upsampler.tile
+        }
+        if self.upsampler.cache is not None:
+            info["tile_cache"] = self.upsampler.cache.stats()
+        return info
+
+
+def get_model(model_name: str = "RealESRGAN_x4plus"):
+    """
+    创建 ONNX 超分模型(默认 x4plus,从 weights/<model_name>.onnx 加载),参数通过环境变量配置:
+        REALESRGAN_ONNX_PRECISION  CPU 上的模型精度(fp32 / int8),int8 使用动态量化模型(*_int8.onnx),默认 fp32
+        REALESRGAN_CPU_THREADS  CPU intra-op 线程数,默认 0(按物理核心数自动选择)
+        REALESRGAN_TILE         瓦片大小,默认 400
+        REALESRGAN_TILE_CACHE_MB  瓦片结果缓存大小(MB),默认 512,0 表示关闭
+    """
+    from pathlib import Path
+    from .device import DeviceDetector
+
+    device = "cuda" if DeviceDetector.get_device_info()["type"] == "cuda" else "cpu"
+    precision = os.environ.get("REALESRGAN_ONNX_PRECISION", "fp32")
+    if precision not in ONNX_PRECISIONS:
+        raise ValueError(f"不支持的 ONNX 精度: {precision},可选: {ONNX_PRECISIONS}")
+    if os.environ.get("REALESRGAN_CPU_MODE"):
+        # REALESRGAN_CPU_MODE 只作用于 PyTorch 后端
+        print("⚠️  REALESRGAN_CPU_MODE 对 ONNX 后端无效,量化模型请使用 REALESRGAN_ONNX_PRECISION=int8")
+    suffix = "_int8" if device == "cpu" and precision == "int8" else ""
+    model_path = Path(__file__).parent.parent / "weights" / f"{model_name}{suffix}.onnx"
+    return RealESRGANONNXModel(
+        str(model_path),
+        device=device,
+        tile=int(os.environ.get("REALESRGAN_TILE", "400")),
+        num_threads=int(os.environ.get("REALESRGAN_CPU_THREADS", "0")),
+    )
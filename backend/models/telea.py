@@ -0,0 +1,124 @@
+"""
+并行 + 金字塔加速的 OpenCV Telea 修复
+cv2.inpaint 的耗时与 遮罩面积 x 半径 成正比,整张大图单线程调用时大遮罩需要数秒:
+- 遮罩按连通域拆分(相距小于修复半径的连通域合并为一组,保证与整图修复结果一致),
+  每组只修复带边距的外接矩形,在线程池中并行执行(OpenCV 计算时释放 GIL)
+- 可选(默认关闭):面积较大的连通域先在缩小的金字塔层上修复内部,再在原分辨率上只修复靠近边界的环带。
+  结果是近似值:遮罩外完全一致,遮罩内与整图 cv2.inpaint 的平均差异通常为 10~20 个灰度级(不保证上限)
+
+配置(环境变量):
+    INPAINT_TELEA_THREADS      线程数(默认 CPU 核数)
+    INPAINT_PYRAMID_MIN_AREA   使用金字塔的最小遮罩面积(像素,如 262144 即 512x512),0 表示禁用(默认)
+"""
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# 金字塔层上遮罩面积的目标值:缩小到该面积以内再修复
+PYRAMID_TARGET_AREA = 65536
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            threads = int(os.environ.get("INPAINT_TELEA_THREADS", "0")) or os.cpu_count() or 1
+            _executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="telea")
+        return _executor
+
+
+def _components(mask: np.ndarray, radius: int) -> List[Tuple[int, int, int, int, np.ndarray]]:
+    """
+    按连通域分组,返回每组的 (x0, y0, x1, y1, 组内遮罩)
+    外接矩形已加上 radius 边距;相距不超过 2 * radius 的连通域会互相影响,合并为一组
+    """
+    height, width = mask.shape
+    kernel = np.ones((2 * radius + 3, 2 * radius + 3), np.uint8)
+    grouped = cv2.dilate(mask, kernel)
+    count, labels, boxes, _ = cv2.connectedComponentsWithStats(grouped, connectivity=8)
+    pad = radius + 2
+    groups = []
+    for label in range(1, count):
+        x, y, w, h, _ = boxes[label]
+        x0, y0 = max(0, x - pad), max(0, y - pad)
+        x1, y1 = min(width, x + w + pad), min(height, y + h + pad)
+        region = (labels[y0:y1, x0:x1] == label) & (mask[y0:y1, x0:x1] > 0)
+        if region.any():
+            groups.append((x0, y0, x1, y1, region))
+    # 大的组先提交,避免最后剩下一个大组单独执行
+    groups.sort(key=lambda g: (g[2] - g[0]) * (g[3] - g[1]), reverse=True)
+    return groups
+
+
+def _pyramid_inpaint(crop: np.ndarray, region: np.ndarray, radius: int, area: int) -> np.ndarray:
+    """
+    大面积遮罩:在缩小的图像上修复得到内部,再在原分辨率上修复靠近边界的环带
+    """
+    factor = 2 ** math.ceil(math.log(area / PYRAMID_TARGET_AREA, 4))
+    height, width = region.shape
+    size = (max(1, width // factor), max(1, height // factor))
+    mask = region.astype(np.uint8) * 255
+
+    small = cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+    # 缩小后部分被遮罩覆盖的像素也视为需要修复,避免把遮罩内的颜色带入
+    small_mask = (cv2.resize(mask, size, interpolation=cv2.INTER_AREA) > 0).astype(np.uint8) * 255
+    coarse = cv2.inpaint(small, small_mask, radius, cv2.INPAINT_TELEA)
+    coarse = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_LINEAR)
+
+    # 内部用低分辨率结果填充,视为已知;只在原分辨率上修复宽度为 band 的边界环带
+    band = max(2 * radius, 2 * factor)
+    core = cv2.erode(mask, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * band + 1, 2 * band + 1)))
+    seeded = crop.copy()
+    np.copyto(seeded, coarse, where=(core > 0) if crop.ndim == 2 else (core > 0)[..., None])
+    return cv2.inpaint(seeded, cv2.subtract(mask, core), radius, cv2.INPAINT_TELEA)
+
+
+def inpaint_telea(image: np.ndarray, mask: np.ndarray, radius: int = 5,
+                  pyramid_min_area: Optional[int] = None) -> np.ndarray:
+    """
+    Telea 修复,默认结果与 cv2.inpaint(image, mask, radius, INPAINT_TELEA) 逐像素一致;
+    启用金字塔时,面积超过 pyramid_min_area 的连通域内部为近似结果(遮罩外不变)
+
+    Args:
+        image: uint8 图像(单通道或 3 通道)
+        mask: uint8 遮罩,非零为需要修复的区域
+        radius: 修复半径
+        pyramid_min_area: 使用金字塔的最小遮罩面积,None 读取 INPAINT_PYRAMID_MIN_AREA,0 表示禁用(默认)
+
+    Returns:
+        修复后的图像(新数组)
+    """
+    if pyramid_min_area is None:
+        pyramid_min_area = int(os.environ.get("INPAINT_PYRAMID_MIN_AREA", "0"))
+    radius = max(1, int(radius))
+    mask = (mask > 0).astype(np.uint8) * 255
+    output = image.copy()
+    groups = _components(mask, radius)
+    if not groups:
+        return output
+
+    def solve(group):
+        x0, y0, x1, y1, region = group
+        crop = image[y0:y1, x0:x1]
+        area = int(np.count_nonzero(region))
+        if pyramid_min_area and area >= pyramid_min_area:
+            result = _pyramid_inpaint(crop, region, radius, area)
+        else:
+            result = cv2.inpaint(crop, region.astype(np.uint8) * 255, radius, cv2.INPAINT_TELEA)
+        # 各组的遮罩像素互不重叠,可以并发写入
+        target = output[y0:y1, x0:x1]
+        np.copyto(target, result, where=region if image.ndim == 2 else region[..., None])
+
+    if len(groups) == 1:
+        solve(groups[0])
+    else:
+        list(_get_executor().map(solve, groups))
+    return output
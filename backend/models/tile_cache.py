@@ -0,0 +1,105 @@
+"""
+超分瓦片结果缓存
+以 (模型变体, 瓦片几何, 含 tile_pad 的输入瓦片内容哈希) 为键,保存瓦片推理输出中实际拼接的部分。
+局部修改(如 inpaint 一小块)后再次放大同一张图时,输入未变化的瓦片直接复用,只推理变化的瓦片
+
+缓存保存 float32 输出,复用结果与重新推理逐像素一致;按字节预算 LRU 淘汰。
+同一进程内的所有超分模型共用一个缓存(多 Worker 部署时每个 Worker 各有一份)
+
+配置(环境变量):
+    REALESRGAN_TILE_CACHE_MB  缓存字节预算(MB),默认 512,0 表示关闭
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+
+class TileCache:
+    """
+    瓦片输出的 LRU 缓存
+
+    Args:
+        max_bytes: 字节预算,超出时淘汰最久未使用的瓦片
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._tiles: "OrderedDict[Hashable, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(variant: str, input_tile: np.ndarray, geometry: Tuple[int, ...]) -> Hashable:
+        """
+        缓存键:模型变体 + 输入形状与数据类型 + 输出裁剪位置 + 输入内容哈希
+        输入相同但在图中位置不同(如边缘瓦片)时裁剪位置不同,需要一并作为键
+        """
+        digest = hashlib.blake2b(np.ascontiguousarray(input_tile).data, digest_size=16).digest()
+        return variant, input_tile.shape, input_tile.dtype.str, geometry, digest
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is None:
+                self.misses += 1
+                return None
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return tile
+
+    def put(self, key: Hashable, tile: np.ndarray):
+        """保存瓦片输出(拷贝一份,不引用整个输出瓦片);单个瓦片超出预算时不缓存"""
+        if tile.nbytes > self.max_bytes:
+            return
+        tile = np.array(tile, copy=True)
+        with self._lock:
+            old = self._tiles.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._tiles[key] = tile
+            self._bytes += tile.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._tiles.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "tiles": len(self._tiles),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+_cache: Optional[TileCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_tile_cache() -> Optional[TileCache]:
+    """进程内共享的瓦片缓存,REALESRGAN_TILE_CACHE_MB=0 时返回 None"""
+    global _cache
+    max_mb = float(os.environ.get("REALESRGAN_TILE_CACHE_MB", "512"))
+    if max_mb <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = TileCache(int(max_mb * 1024 ** 2))
+        return _cache
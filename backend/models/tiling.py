@@ -0,0 +1,468 @@
+"""
+超分辨率瓦片推理(纯 numpy 实现,不依赖 torch)
+与 realesrgan.RealESRGANer.enhance 的预处理、瓦片切分、拼接和后处理保持一致,
+推理函数由具体后端提供(ONNX Runtime 等)
+"""
+import math
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .tile_cache import TileCache
+
+# 推理函数:输入 [1, 3, H, W] float32 (RGB, 0~1),输出 [1, 3, H*scale, W*scale]
+InferFn = Callable[[np.ndarray], np.ndarray]
+# 取消检查:请求已取消时抛出异常,在每个瓦片推理之前调用
+CancelCheck = Optional[Callable[[], None]]
+# 瓦片回调:每个瓦片推理完成后以 (瓦片, 开始, 结束) 调用,时间为 time.perf_counter 秒
+TileCallback = Optional[Callable[["Tile", float, float], None]]
+# 行回调:大图模式下每写完一行瓦片以输出行范围 (y0, y1) 调用
+RowsCallback = Optional[Callable[[int, int], None]]
+
+
+@dataclass(frozen=True)
+class Tile:
+    """单个瓦片的输入区域(含 / 不含 padding)"""
+    index: int
+    x0: int
+    y0: int
+    x1: int
+    y1: int
+    pad_x0: int
+    pad_y0: int
+    pad_x1: int
+    pad_y1: int
+
+
+@dataclass(frozen=True)
+class Region:
+    """
+    ROI 超分的执行计划(坐标均为原图坐标,预处理填充区域位于原图右 / 下方)
+
+    Attributes:
+        roi: 需要输出的区域 (x, y, 宽, 高),已裁剪到原图范围内
+        tiles: 与 ROI 相交的瓦片(与整图推理的瓦片完全相同)
+        source: 需要读取的原图区域 (y0, y1, x0, x1)
+        pad_h / pad_w: 读取区域需要补上的预处理填充(区域越过原图下 / 右边界时非零)
+    """
+    roi: Tuple[int, int, int, int]
+    tiles: List[Tile]
+    source: Tuple[int, int, int, int]
+    pad_h: Tuple[int, int]
+    pad_w: Tuple[int, int]
+
+
+def clip_roi(roi, width: int, height: int) -> Tuple[int, int, int, int]:
+    """把 ROI (x, y, 宽, 高) 裁剪到图片范围内,与图片没有交集时抛出 ValueError"""
+    x, y, w, h = (int(v) for v in roi)
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(width, x + w), min(height, y + h)
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError(f"ROI {x},{y},{w},{h} 与图片 {width}x{height} 没有交集")
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def guided_upsample_alpha(alpha: np.ndarray, guide_lo: np.ndarray, guide_hi: np.ndarray, scale: int,
+                          offset: Tuple[int, int] = (0, 0), radius: int = 2, eps: float = 1e-3) -> np.ndarray:
+    """
+    以模型放大后的亮度为引导放大 alpha(引导滤波的线性系数,只用 cv2.boxFilter,不经过模型)
+
+    在原分辨率上按局部窗口拟合 alpha ≈ a × 亮度 + b,得到 alpha 随亮度变化的系数 a;
+    输出 = alpha 的线性插值 + a × (模型放大后的亮度 - 亮度的线性插值)。
+    alpha 边缘与颜色边缘重合时(抠图、logo),模型让颜色边缘变锐利的部分同样作用到 alpha 上;
+    颜色平坦或与 alpha 无关的区域 a ≈ 0,结果就是线性插值
+
+    Args:
+        alpha: 原分辨率 HW float32 alpha (0~1)
+        guide_lo: 原分辨率 HW float32 亮度
+        guide_hi: 放大后的 HW float32 亮度,对应原分辨率放大 scale 倍后从 offset 开始的区域
+        scale: 放大倍数
+        offset: guide_hi 在放大结果中的位置 (y, x),ROI 超分时非零
+        radius: 原分辨率上的窗口半径
+        eps: 正则项,越大越接近线性插值
+
+    Returns:
+        与 guide_hi 同尺寸的 float32 alpha (0~1)
+    """
+    ksize = (2 * radius + 1, 2 * radius + 1)
+
+    def box(x: np.ndarray) -> np.ndarray:
+        return cv2.boxFilter(x, -1, ksize, borderType=cv2.BORDER_REFLECT)
+
+    h, w = alpha.shape
+    out_h, out_w = guide_hi.shape
+    dy, dx = offset
+
+    def upsample(x: np.ndarray) -> np.ndarray:
+        return cv2.resize(x, (w * scale, h * scale), interpolation=cv2.INTER_LINEAR)[dy:dy + out_h, dx:dx + out_w]
+
+    mean_i = box(guide_lo)
+    mean_p = box(alpha)
+    cov_ip = box(guide_lo * alpha) - mean_i * mean_p
+    var_i = box(guide_lo * guide_lo) - mean_i * mean_i
+    a = box(cov_ip / (var_i + eps))
+    return np.clip(upsample(alpha) + upsample(a) * (guide_hi - upsample(guide_lo)), 0, 1)
+
+
+def tile_grid(height: int, width: int, tile_size: int, tile_pad: int) -> List[Tile]:
+    """按 RealESRGANer.tile_process 的规则切分瓦片"""
+    tiles = []
+    tiles_x = math.ceil(width / tile_size)
+    tiles_y = math.ceil(height / tile_size)
+    for y in range(tiles_y):
+        for x in range(tiles_x):
+            x0 = x * tile_size
+            y0 = y * tile_size
+            x1 = min(x0 + tile_size, width)
+            y1 = min(y0 + tile_size, height)
+            tiles.append(Tile(
+                index=y * tiles_x + x,
+                x0=x0, y0=y0, x1=x1, y1=y1,
+                pad_x0=max(x0 - tile_pad, 0),
+                pad_y0=max(y0 - tile_pad, 0),
+                pad_x1=min(x1 + tile_pad, width),
+                pad_y1=min(y1 + tile_pad, height),
+            ))
+    return tiles
+
+
+class TiledUpscaler:
+    """
+    瓦片超分推理器
+
+    Args:
+        infer: 推理函数
+        scale: 模型原生放大倍数
+        tile: 瓦片大小,0 表示整图推理
+        tile_pad: 瓦片边缘填充
+        pre_pad: 整图预填充
+        cache: 瓦片结果缓存,输入未变化的瓦片直接复用(整图推理模式不使用)
+        variant: 缓存键中的模型变体(权重、设备、精度),输出不同的模型不能共用缓存项
+    """
+
+    def __init__(self, infer: InferFn, scale: int = 4, tile: int = 400,
+                 tile_pad: int = 10, pre_pad: int = 0,
+                 cache: Optional[TileCache] = None, variant: str = ""):
+        self.infer = infer
+        self.scale = scale
+        self.tile = tile
+        self.tile_pad = tile_pad
+        self.pre_pad = pre_pad
+        self.cache = cache
+        self.variant = variant
+        # 与 RealESRGANer 相同:x2 / x1 模型要求输入尺寸可被整除
+        self.mod_scale = {2: 2, 1: 4}.get(scale)
+
+    def _mod_pad(self, height: int, width: int) -> Tuple[int, int]:
+        """pre_pad 之后为满足 mod_scale 需要的填充 (mod_pad_h, mod_pad_w)"""
+        if self.mod_scale is None:
+            return 0, 0
+        return (-(height + self.pre_pad)) % self.mod_scale, (-(width + self.pre_pad)) % self.mod_scale
+
+    def plan_region(self, height: int, width: int, roi) -> Region:
+        """
+        规划 ROI 超分:只推理与 ROI 相交的瓦片
+
+        瓦片按整图切分,每个瓦片的输入(含 tile_pad)与整图推理时完全相同,
+        因此 ROI 结果与整图结果裁剪出的同一区域逐像素一致。
+        整图推理模式(tile=0)没有瓦片,以 ROI 加 tile_pad 上下文作为一个瓦片推理
+        """
+        x, y, w, h = roi = clip_roi(roi, width, height)
+        mod_pad_h, mod_pad_w = self._mod_pad(height, width)
+        padded_h = height + self.pre_pad + mod_pad_h
+        padded_w = width + self.pre_pad + mod_pad_w
+        if self.tile > 0:
+            tiles = [
+                t for t in tile_grid(padded_h, padded_w, self.tile, self.tile_pad)
+                if t.x0 < x + w and t.x1 > x and t.y0 < y + h and t.y1 > y
+            ]
+        else:
+            # 边界对齐到 mod_scale,x2 / x1 模型的输入尺寸仍可被整除
+            m = self.mod_scale or 1
+            x0, y0 = x // m * m, y // m * m
+            x1, y1 = min(padded_w, -(-(x + w) // m) * m), min(padded_h, -(-(y + h) // m) * m)
+            tiles = [Tile(
+                index=0, x0=x0, y0=y0, x1=x1, y1=y1,
+                pad_x0=max(x0 - self.tile_pad, 0) // m * m,
+                pad_y0=max(y0 - self.tile_pad, 0) // m * m,
+                pad_x1=min(padded_w, -(-(x1 + self.tile_pad) // m) * m),
+                pad_y1=min(padded_h, -(-(y1 + self.tile_pad) // m) * m),
+            )]
+
+        # 需要读取的输入区域;越过原图下 / 右边界时,预处理的 reflect 填充依赖靠近边界的像素,一并读取
+        in_y0 = min(t.pad_y0 for t in tiles)
+        in_y1 = max(t.pad_y1 for t in tiles)
+        in_x0 = min(t.pad_x0 for t in tiles)
+        in_x1 = max(t.pad_x1 for t in tiles)
+        pad_h = pad_w = (0, 0)
+        if in_y1 > height:
+            in_y0 = max(0, min(in_y0, height - self.pre_pad - mod_pad_h - 1))
+            pad_h = (self.pre_pad, mod_pad_h)
+        if in_x1 > width:
+            in_x0 = max(0, min(in_x0, width - self.pre_pad - mod_pad_w - 1))
+            pad_w = (self.pre_pad, mod_pad_w)
+        source = (in_y0, min(in_y1, height), in_x0, min(in_x1, width))
+        return Region(roi=roi, tiles=tiles, source=source, pad_h=pad_h, pad_w=pad_w)
+
+    def _run_region(self, img: np.ndarray, region: Region, cancel_check: CancelCheck = None,
+                    on_tile: TileCallback = None, alpha: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        ROI 推理:img 为 region.source 区域的 HWC float32 RGB (0~1),
+        返回 ROI 放大 scale 倍的 HWC float32 RGB (0~1);提供同一区域的 alpha 时跳过完全透明的瓦片
+        """
+        def pad(hwc: np.ndarray) -> np.ndarray:
+            chw = np.ascontiguousarray(np.transpose(hwc, (2, 0, 1)))[None]
+            # 与整图预处理相同的两次 reflect 填充(先 pre_pad,再 mod_pad)
+            for i in range(2):
+                after_h, after_w = region.pad_h[i], region.pad_w[i]
+                if after_h or after_w:
+                    chw = np.pad(chw, ((0, 0), (0, 0), (0, after_h), (0, after_w)), mode="reflect")
+            return chw
+
+        chw = pad(img)
+        alpha_chw = pad(alpha[:, :, None]) if alpha is not None else None
+
+        s = self.scale
+        src_y0, _, src_x0, _ = region.source
+        out_y0 = min(t.y0 for t in region.tiles)
+        out_x0 = min(t.x0 for t in region.tiles)
+        out_y1 = max(t.y1 for t in region.tiles)
+        out_x1 = max(t.x1 for t in region.tiles)
+        output = np.zeros((1, chw.shape[1], (out_y1 - out_y0) * s, (out_x1 - out_x0) * s), dtype=np.float32)
+        for t in region.tiles:
+            output[:, :, (t.y0 - out_y0) * s:(t.y1 - out_y0) * s, (t.x0 - out_x0) * s:(t.x1 - out_x0) * s] = \
+                self._infer_tile(chw, t, src_y0, src_x0, cancel_check, on_tile, alpha_chw)
+
+        x, y, w, h = region.roi
+        output = output[0, :, (y - out_y0) * s:(y - out_y0 + h) * s, (x - out_x0) * s:(x - out_x0 + w) * s]
+        return np.transpose(np.clip(output, 0, 1), (1, 2, 0))
+
+    def _pre_process(self, img: np.ndarray):
+        """HWC float32 -> [1, C, H, W],并做 pre_pad 与 mod_pad(reflect)"""
+        chw = np.ascontiguousarray(np.transpose(img, (2, 0, 1)))[None]
+        if self.pre_pad != 0:
+            chw = np.pad(chw, ((0, 0), (0, 0), (0, self.pre_pad), (0, self.pre_pad)), mode="reflect")
+        mod_pad_h = mod_pad_w = 0
+        if self.mod_scale is not None:
+            _, _, h, w = chw.shape
+            if h % self.mod_scale != 0:
+                mod_pad_h = self.mod_scale - h % self.mod_scale
+            if w % self.mod_scale != 0:
+                mod_pad_w = self.mod_scale - w % self.mod_scale
+            chw = np.pad(chw, ((0, 0), (0, 0), (0, mod_pad_h), (0, mod_pad_w)), mode="reflect")
+        return chw, mod_pad_h, mod_pad_w
+
+    def _infer_tile(self, chw: np.ndarray, t: Tile, src_y0: int = 0, src_x0: int = 0,
+                    cancel_check: CancelCheck = None, on_tile: TileCallback = None,
+                    alpha: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        推理单个瓦片,返回其不含 tile_pad 部分的输出 [1, C, (y1-y0)*scale, (x1-x0)*scale]
+        chw 从原图坐标 (src_y0, src_x0) 开始;启用缓存时输入未变化的瓦片直接复用
+        alpha 为与 chw 对齐的 [1, 1, H, W] 数组,瓦片(含 tile_pad)完全透明时不推理
+        """
+        if cancel_check is not None:
+            cancel_check()  # 请求已取消时不再计算剩余瓦片
+        s = self.scale
+        if alpha is not None and not alpha[:, :, t.pad_y0 - src_y0:t.pad_y1 - src_y0,
+                                           t.pad_x0 - src_x0:t.pad_x1 - src_x0].any():
+            # 完全透明的区域看不见,RGB 用线性插值填充
+            inner = chw[0, :, t.y0 - src_y0:t.y1 - src_y0, t.x0 - src_x0:t.x1 - src_x0]
+            filled = cv2.resize(np.ascontiguousarray(np.transpose(inner, (1, 2, 0))),
+                                ((t.x1 - t.x0) * s, (t.y1 - t.y0) * s), interpolation=cv2.INTER_LINEAR)
+            return np.transpose(filled, (2, 0, 1))[None]
+        input_tile = np.ascontiguousarray(
+            chw[:, :, t.pad_y0 - src_y0:t.pad_y1 - src_y0, t.pad_x0 - src_x0:t.pad_x1 - src_x0]
+        )
+        oy0 = (t.y0 - t.pad_y0) * s
+        ox0 = (t.x0 - t.pad_x0) * s
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(self.variant, input_tile, (oy0, ox0, t.y1 - t.y0, t.x1 - t.x0))
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        start = time.perf_counter()
+        output_tile = self.infer(input_tile)
+        if on_tile is not None:
+            on_tile(t, start, time.perf_counter())
+        output_tile = output_tile[:, :, oy0:oy0 + (t.y1 - t.y0) * s, ox0:ox0 + (t.x1 - t.x0) * s]
+        if key is not None:
+            self.cache.put(key, output_tile)
+        return output_tile
+
+    def _tile_process(self, chw: np.ndarray, cancel_check: CancelCheck = None,
+                      on_tile: TileCallback = None, alpha: Optional[np.ndarray] = None) -> np.ndarray:
+        batch, channel, height, width = chw.shape
+        output = np.zeros((batch, channel, height * self.scale, width * self.scale), dtype=np.float32)
+        s = self.scale
+        for t in tile_grid(height, width, self.tile, self.tile_pad):
+            output[:, :, t.y0 * s:t.y1 * s, t.x0 * s:t.x1 * s] = \
+                self._infer_tile(chw, t, cancel_check=cancel_check, on_tile=on_tile, alpha=alpha)
+        return output
+
+    def _run(self, img: np.ndarray, cancel_check: CancelCheck = None,
+             on_tile: TileCallback = None, alpha: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        HWC float32 RGB (0~1) -> HWC float32 RGB (0~1),放大 scale 倍
+        提供 HW alpha 时跳过完全透明的瓦片
+        """
+        chw, mod_pad_h, mod_pad_w = self._pre_process(img)
+        alpha_chw = self._pre_process(alpha[:, :, None])[0] if alpha is not None else None
+        if self.tile > 0:
+            output = self._tile_process(chw, cancel_check, on_tile, alpha_chw)
+        elif alpha_chw is not None and not alpha_chw.any():
+            _, _, height, width = chw.shape
+            output = self._infer_tile(chw, Tile(0, 0, 0, width, height, 0, 0, width, height),
+                                      cancel_check=cancel_check, alpha=alpha_chw)
+        else:
+            if cancel_check is not None:
+                cancel_check()
+            start = time.perf_counter()
+            output = self.infer(chw.astype(np.float32))
+            if on_tile is not None:
+                _, _, height, width = chw.shape
+                on_tile(Tile(0, 0, 0, width, height, 0, 0, width, height), start, time.perf_counter())
+        _, _, h, w = output.shape
+        output = output[:, :, 0:h - mod_pad_h * self.scale, 0:w - mod_pad_w * self.scale]
+        if self.pre_pad != 0:
+            _, _, h, w = output.shape
+            output = output[:, :, 0:h - self.pre_pad * self.scale, 0:w - self.pre_pad * self.scale]
+        return np.transpose(np.clip(output[0], 0, 1), (1, 2, 0))
+
+    def enhance_to(self, img: np.ndarray, out: np.ndarray, cancel_check: CancelCheck = None,
+                   on_tile: TileCallback = None, on_rows: RowsCallback = None):
+        """
+        大图模式:瓦片推理结果直接量化写入 out(通常为磁盘上的内存映射画布),不分配整张输出
+
+        输入只在每个瓦片内转换为 float32,输出按瓦片写入;结果与 enhance(img) 逐像素一致。
+        仅支持 RGB uint8 输入、按模型原生倍数放大
+
+        Args:
+            img: HWC RGB uint8 数组
+            out: 形状为 (H*scale, W*scale, 3) 的 uint8 数组
+            cancel_check: 每个瓦片之前调用,请求已取消时抛出异常以停止推理
+            on_tile: 每个瓦片推理完成后调用,用于性能剖析
+            on_rows: 每写完一行瓦片以输出行范围 (y0, y1) 调用,如把这些行刷到磁盘并释放
+        """
+        if img.dtype != np.uint8 or img.ndim != 3 or img.shape[2] != 3:
+            raise ValueError("大图模式只支持 RGB 8 位图片")
+        height, width = img.shape[:2]
+        s = self.scale
+        if out.shape != (height * s, width * s, 3):
+            raise ValueError(f"输出画布尺寸 {out.shape} 与 {self.scale} 倍放大结果不一致")
+
+        # 与 _pre_process 相同的 reflect 填充(uint8 上填充与 float32 上填充结果相同)
+        mod_pad_h, mod_pad_w = self._mod_pad(height, width)
+        if self.pre_pad or mod_pad_h or mod_pad_w:
+            if self.pre_pad:
+                img = np.pad(img, ((0, self.pre_pad), (0, self.pre_pad), (0, 0)), mode="reflect")
+            img = np.pad(img, ((0, mod_pad_h), (0, mod_pad_w), (0, 0)), mode="reflect")
+        padded_h, padded_w = img.shape[:2]
+        if self.tile > 0:
+            tiles = tile_grid(padded_h, padded_w, self.tile, self.tile_pad)
+        else:
+            tiles = [Tile(0, 0, 0, padded_w, padded_h, 0, 0, padded_w, padded_h)]
+
+        out_h, out_w = out.shape[:2]
+        for i, t in enumerate(tiles):
+            region = img[t.pad_y0:t.pad_y1, t.pad_x0:t.pad_x1].astype(np.float32) / 255
+            chw = np.ascontiguousarray(np.transpose(region, (2, 0, 1)))[None]
+            del region
+            output_tile = self._infer_tile(chw, t, t.pad_y0, t.pad_x0, cancel_check, on_tile)
+            # 超出原图的部分(pre_pad / mod_pad 填充)不写入
+            y0, y1 = t.y0 * s, min(t.y1 * s, out_h)
+            x0, x1 = t.x0 * s, min(t.x1 * s, out_w)
+            if y1 > y0 and x1 > x0:
+                tile_rgb = np.transpose(np.clip(output_tile[0, :, :y1 - y0, :x1 - x0], 0, 1), (1, 2, 0))
+                out[y0:y1, x0:x1] = (tile_rgb * 255.0).round().astype(np.uint8)
+            last_in_row = i + 1 == len(tiles) or tiles[i + 1].y0 != t.y0
+            if on_rows is not None and last_in_row and y1 > y0:
+                on_rows(y0, y1)
+
+    def enhance(self, img: np.ndarray, outscale: float = None, alpha_upsampler: str = "realesrgan",
+                cancel_check: CancelCheck = None, on_tile: TileCallback = None, roi=None,
+                skip_transparent: bool = True) -> np.ndarray:
+        """
+        执行超分辨率(语义同 RealESRGANer.enhance,但输入输出为 RGB 通道顺序)
+
+        Args:
+            img: HW / HWC(RGB 或 RGBA)数组,uint8 或 uint16
+            outscale: 最终放大倍数,与模型倍数不同时用 Lanczos 缩放
+            alpha_upsampler: 'realesrgan' 用模型放大 alpha(推理量翻倍),
+                'guided' 以放大后的 RGB 为引导做引导滤波插值(不经过模型),否则线性插值
+            cancel_check: 每个瓦片之前调用,请求已取消时抛出异常以停止推理
+            on_tile: 每个瓦片推理完成后调用,用于性能剖析
+            roi: 只输出原图中的区域 (x, y, 宽, 高),只推理与其相交的瓦片
+            skip_transparent: RGBA 输入中完全透明的瓦片不推理 RGB(该区域的 RGB 用线性插值填充)
+
+        Returns:
+            放大后的数组(指定 roi 时为该区域),通道与位深同输入
+        """
+        h_input, w_input = img.shape[0:2]
+        # 位深按整图判断,ROI 结果与整图结果一致
+        max_range = 65535 if np.max(img) > 256 else 255
+        region = None
+        if roi is not None:
+            region = self.plan_region(h_input, w_input, roi)
+            y0, y1, x0, x1 = region.source
+            img = img[y0:y1, x0:x1]
+            w_input, h_input = region.roi[2:]
+        img = img.astype(np.float32) / max_range
+
+        def run(rgb: np.ndarray, alpha: Optional[np.ndarray] = None) -> np.ndarray:
+            if region is not None:
+                return self._run_region(rgb, region, cancel_check, on_tile, alpha)
+            return self._run(rgb, cancel_check, on_tile, alpha)
+
+        alpha = None
+        if img.ndim == 2:
+            img_mode = "L"
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+        elif img.shape[2] == 4:
+            img_mode = "RGBA"
+            alpha = img[:, :, 3]
+            img = img[:, :, 0:3]
+        else:
+            img_mode = "RGB"
+
+        output = run(img, alpha if skip_transparent else None)
+        if img_mode == "L":
+            output = cv2.cvtColor(output, cv2.COLOR_RGB2GRAY)
+
+        if img_mode == "RGBA":
+            if alpha_upsampler == "guided":
+                offset = (0, 0)
+                if region is not None:
+                    x, y = region.roi[:2]
+                    offset = ((y - region.source[0]) * self.scale, (x - region.source[2]) * self.scale)
+                output_alpha = guided_upsample_alpha(
+                    alpha, cv2.cvtColor(img, cv2.COLOR_RGB2GRAY), cv2.cvtColor(output, cv2.COLOR_RGB2GRAY),
+                    self.scale, offset
+                )
+            elif alpha_upsampler == "realesrgan":
+                output_alpha = cv2.cvtColor(
+                    run(cv2.cvtColor(alpha, cv2.COLOR_GRAY2RGB)), cv2.COLOR_RGB2GRAY
+                )
+            else:
+                h, w = alpha.shape[0:2]
+                output_alpha = cv2.resize(alpha, (w * self.scale, h * self.scale), interpolation=cv2.INTER_LINEAR)
+                if region is not None:
+                    s = self.scale
+                    x, y, w, h = region.roi
+                    dy, dx = (y - region.source[0]) * s, (x - region.source[2]) * s
+                    output_alpha = output_alpha[dy:dy + h * s, dx:dx + w * s]
+            output = np.dstack([output, output_alpha])
+
+        if max_range == 65535:
+            output = (output * 65535.0).round().astype(np.uint16)
+        else:
+            output = (output * 255.0).round().astype(np.uint8)
+
+        if outscale is not None and outscale != float(self.scale):
+            output = cv2.resize(
+                output, (int(w_input * outscale), int(h_input * outscale)), interpolation=cv2.INTER_LANCZOS4
+            )
+        return output
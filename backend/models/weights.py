@@ -0,0 +1,272 @@
+"""
+模型权重存储
+- .pth checkpoint 首次使用时转换为 safetensors(张量数据连续存放在文件中),
+  之后以 mmap 方式加载:张量直接引用页缓存,同一节点的多个 Worker 进程共享同一份物理内存,
+  不再各自反序列化出一份私有拷贝
+- SHA-256 只校验一次:结果按 (文件大小, 修改时间) 缓存在权重目录的 .verified.json 中,
+  文件未变化时启动不再重新计算哈希
+- 期望的哈希来自权重目录中的 SHA256SUMS(sha256sum 格式),未列出的文件只记录不比对
+
+safetensors 格式:8 字节小端头长度 + JSON 头(各张量的 dtype / shape / 数据偏移)+ 张量数据,
+这里直接读写,与 safetensors 库生成的文件互相兼容
+
+环境变量:
+    WEIGHTS_VERIFY  权重校验: once(默认,校验结果缓存) / always(每次启动重新计算) / off
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import torch
+except ImportError:  # ONNX 部署可不安装 torch
+    torch = None
+
+WEIGHTS_DIR = Path(__file__).parent.parent / "weights"
+CHECKSUMS_FILE = "SHA256SUMS"
+VERIFIED_CACHE_FILE = ".verified.json"
+_LOCK_FILE = ".lock"
+_HASH_CHUNK = 8 * 1024 * 1024
+
+# safetensors dtype 名称 <-> torch dtype
+_DTYPES = {
+    "F64": "float64", "F32": "float32", "F16": "float16", "BF16": "bfloat16",
+    "I64": "int64", "I32": "int32", "I16": "int16", "I8": "int8", "U8": "uint8", "BOOL": "bool",
+}
+
+
+class WeightChecksumError(ValueError):
+    """权重文件的 SHA-256 与期望值不一致(文件损坏或被替换)"""
+
+
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_checksums(weights_dir: Path = WEIGHTS_DIR) -> Dict[str, str]:
+    """读取 SHA256SUMS:每行 "<sha256>  <文件名>" """
+    checksums = {}
+    try:
+        with open(weights_dir / CHECKSUMS_FILE) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2:
+                    checksums[parts[1].lstrip("*")] = parts[0].lower()
+    except FileNotFoundError:
+        pass
+    return checksums
+
+
+def _load_cache(weights_dir: Path) -> Dict[str, Dict]:
+    try:
+        with open(weights_dir / VERIFIED_CACHE_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_cache(weights_dir: Path, cache: Dict[str, Dict]):
+    """写入校验缓存(先写临时文件再原子替换);权重目录只读时跳过,下次启动重新校验"""
+    path = weights_dir / VERIFIED_CACHE_FILE
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+@contextmanager
+def _weights_lock(weights_dir: Path):
+    """多个 Worker 同时启动时,转换与校验缓存的写入串行进行"""
+    f = None
+    if fcntl is not None:
+        try:
+            f = open(weights_dir / _LOCK_FILE, "a")
+        except OSError:  # 只读目录
+            f = None
+    if f is None:
+        yield
+        return
+    with f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def verify(path: Path, expected: Optional[str] = None, cache: Optional[Dict[str, Dict]] = None) -> str:
+    """
+    计算(或从缓存读取)文件的 SHA-256,提供 expected 时比对
+
+    Args:
+        path: 权重文件
+        expected: 期望的 SHA-256,None 表示只记录
+        cache: 校验缓存(文件名 -> {size, mtime_ns, sha256}),命中且文件未变化时不重新计算
+
+    Returns:
+        文件的 SHA-256
+    """
+    mode = os.environ.get("WEIGHTS_VERIFY", "once")
+    stat = path.stat()
+    entry = cache.get(path.name) if cache is not None else None
+    if mode == "off":
+        return (entry or {}).get("sha256") or expected or ""
+    if (mode == "once" and entry and entry["size"] == stat.st_size
+            and entry["mtime_ns"] == stat.st_mtime_ns):
+        digest = entry["sha256"]
+    else:
+        print(f"   校验 {path.name} ({stat.st_size / 1024 ** 2:.0f}MB)...")
+        digest = sha256_file(path)
+        if cache is not None:
+            cache[path.name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+    if expected and digest != expected:
+        raise WeightChecksumError(f"{path.name} 的 SHA-256 为 {digest},期望 {expected},文件可能已损坏")
+    return digest
+
+
+def save_safetensors(tensors: Dict[str, "torch.Tensor"], path: Path, metadata: Optional[Dict[str, str]] = None):
+    """按 safetensors 格式保存张量(先写临时文件再原子替换)"""
+    names = {v: k for k, v in _DTYPES.items()}
+    header: Dict[str, Dict] = {}
+    if metadata:
+        header["__metadata__"] = dict(metadata)
+    offset = 0
+    buffers = []
+    for name in sorted(tensors):
+        tensor = tensors[name].detach().cpu().contiguous()
+        data = tensor.reshape(-1).view(torch.uint8).numpy().tobytes() if tensor.numel() else b""
+        header[name] = {
+            "dtype": names[str(tensor.dtype).replace("torch.", "")],
+            "shape": list(tensor.shape),
+            "data_offsets": [offset, offset + len(data)],
+        }
+        buffers.append(data)
+        offset += len(data)
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    header_bytes += b" " * (-len(header_bytes) % 8)  # 数据区按 8 字节对齐
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for data in buffers:
+            f.write(data)
+    os.replace(tmp_path, path)
+
+
+def load_safetensors(path: Path) -> Dict[str, "torch.Tensor"]:
+    """
+    以 mmap 方式加载 safetensors 文件
+    返回的张量直接引用映射的页(写时复制),只读使用时多个进程共享同一份页缓存
+    """
+    with open(path, "rb") as f:
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_len))
+        # ACCESS_COPY(MAP_PRIVATE):torch.frombuffer 需要可写缓冲区,写入不会影响文件
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    data_start = 8 + header_len
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = getattr(torch, _DTYPES[info["dtype"]])
+        begin, end = info["data_offsets"]
+        if end == begin:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+        tensors[name] = torch.frombuffer(buffer, dtype=dtype, count=count,
+                                         offset=data_start + begin).reshape(info["shape"])
+    return tensors
+
+
+def _extract_state_dict(checkpoint) -> Dict[str, "torch.Tensor"]:
+    """取出 checkpoint 中的权重(与 RealESRGANer 相同,优先使用 params_ema)"""
+    for key in ("params_ema", "params", "state_dict", "model"):
+        if isinstance(checkpoint, dict) and key in checkpoint:
+            return checkpoint[key]
+    return checkpoint
+
+
+def _torch_load(path: Path):
+    try:
+        return torch.load(path, map_location="cpu", weights_only=True)
+    except TypeError:  # 旧版 torch 不支持 weights_only
+        return torch.load(path, map_location="cpu")
+
+
+def load_state_dict(name: str, weights_dir: Path = WEIGHTS_DIR) -> Dict[str, "torch.Tensor"]:
+    """
+    加载 <name> 的权重,优先使用 mmap 加载的 <name>.safetensors
+
+    safetensors 文件不存在(或与转换时记录的哈希不一致)时,从 <name>.pth 校验后转换生成。
+    权重目录只读、无法转换时回退到直接读取 .pth
+    """
+    checkpoint_path = weights_dir / f"{name}.pth"
+    safetensors_path = weights_dir / f"{name}.safetensors"
+    checksums = read_checksums(weights_dir)
+
+    with _weights_lock(weights_dir):
+        cache = _load_cache(weights_dir)
+        snapshot = json.dumps(cache, sort_keys=True)
+        try:
+            if safetensors_path.exists():
+                # 转换生成的文件以转换时记录的哈希为准,SHA256SUMS 中列出时以其为准
+                entry = cache.get(safetensors_path.name, {})
+                expected = checksums.get(safetensors_path.name) or entry.get("sha256")
+                try:
+                    verify(safetensors_path, expected, cache)
+                    return load_safetensors(safetensors_path)
+                except WeightChecksumError as e:
+                    if not checkpoint_path.exists():
+                        raise
+                    print(f"⚠️  {e},重新转换")
+
+            if not checkpoint_path.exists():
+                raise FileNotFoundError(f"Model file not found at: {checkpoint_path}")
+            source_digest = verify(checkpoint_path, checksums.get(checkpoint_path.name), cache)
+            state_dict = _extract_state_dict(_torch_load(checkpoint_path))
+            try:
+                print(f"   转换 {checkpoint_path.name} -> {safetensors_path.name}")
+                save_safetensors(state_dict, safetensors_path,
+                                 metadata={"source": checkpoint_path.name, "source_sha256": source_digest})
+            except OSError as e:
+                print(f"⚠️  无法写入 {safetensors_path.name} ({e}),直接使用 {checkpoint_path.name}")
+                return state_dict
+            cache.pop(safetensors_path.name, None)
+            verify(safetensors_path, None, cache)
+            return load_safetensors(safetensors_path)
+        finally:
+            if json.dumps(cache, sort_keys=True) != snapshot:
+                _save_cache(weights_dir, cache)
+
+
+def verify_file(path: Path) -> str:
+    """校验单个权重文件(TorchScript / ONNX 等不做转换的格式),校验结果同样缓存"""
+    weights_dir = path.parent
+    expected = read_checksums(weights_dir).get(path.name)
+    with _weights_lock(weights_dir):
+        cache = _load_cache(weights_dir)
+        snapshot = json.dumps(cache, sort_keys=True)
+        try:
+            return verify(path, expected, cache)
+        finally:
+            if json.dumps(cache, sort_keys=True) != snapshot:
+                _save_cache(weights_dir, cache)
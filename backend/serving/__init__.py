@@ -0,0 +1,28 @@
+"""
+推理服务层
+负责请求调度、多进程 Worker 等与具体模型无关的服务端逻辑
+"""
+from .workers import (
+    WorkerPool,
+    WorkerSpec,
+    NoCapableWorkerError,
+    WorkerCrashedError,
+    build_worker_specs,
+)
+from .shm import SharedArrayPool, SharedArray, ShmDescriptor, borrow
+from .pipeline import Pipeline, PipelineResult, Stage
+
+__all__ = [
+    'WorkerPool',
+    'WorkerSpec',
+    'NoCapableWorkerError',
+    'WorkerCrashedError',
+    'build_worker_specs',
+    'SharedArrayPool',
+    'SharedArray',
+    'ShmDescriptor',
+    'borrow',
+    'Pipeline',
+    'PipelineResult',
+    'Stage',
+]
@@ -0,0 +1,397 @@
+"""
+准入控制与按客户端的加权公平排队
+每个请求按像素数、操作(upscale / inpaint)和推理后端估算成本(预计推理秒数),
+进入流水线之前先在公平队列中排队:
+
+- 每个客户端有并发请求数与未完成成本两项预算,超出时返回 429
+- 排队顺序使用自计时公平排队(SCFQ):请求的虚拟完成时间 =
+  max(当前虚拟时间, 该客户端上一个请求的虚拟完成时间) + 成本 / 权重,
+  按虚拟完成时间从小到大放行。一个客户端的超大放大请求不会让其他客户端的小 inpaint 一直等待
+- 成本模型以预设的每百万像素耗时为初值,按实际推理耗时做指数滑动平均
+
+配置(环境变量):
+    ADMISSION_MAX_ACTIVE           同时进入流水线的请求数(默认 推理并发数 × 2)
+    ADMISSION_MAX_QUEUE            排队请求总数上限,超出返回 503(默认 64)
+    ADMISSION_CLIENT_MAX_REQUESTS  每个客户端排队 + 执行中的请求数上限(默认 4)
+    ADMISSION_CLIENT_MAX_COST      每个客户端排队 + 执行中请求的预计推理秒数上限(默认 300)
+    ADMISSION_CLIENT_WEIGHTS       客户端权重,如 "10.0.0.5=2,batch-user=0.5"(默认 1)
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+# 各操作在各设备上的初始耗时估计(秒 / 百万像素输入),运行后按实测值修正
+DEFAULT_SECONDS_PER_MPIX = {
+    ("upscale", "cuda"): 1.0,
+    ("upscale", "mps"): 5.0,
+    ("upscale", "cpu"): 40.0,
+    ("inpaint", "cuda"): 0.2,
+    ("inpaint", "mps"): 1.0,
+    ("inpaint", "cpu"): 3.0,
+}
+# 降级档位(如 "upscale:fast")相对完整档位的初始耗时比例
+# anime_6B 只有 6 个 RRDB 块(x4plus 为 23 个),x2plus 的主干在 1/2 分辨率上计算;MI-GAN 远快于 LaMa
+FAST_TIER_COST_RATIO = {"upscale": 0.3, "inpaint": 0.2}
+# 每个请求的固定开销(秒),避免小图成本为 0
+BASE_COST = 0.05
+# 实测耗时的指数滑动平均系数
+EWMA_ALPHA = 0.2
+# 小于该像素数的请求耗时以固定开销为主,不用于修正成本模型
+MIN_OBSERVE_PIXELS = 64 * 1024
+
+
+class AdmissionRejected(Exception):
+    """
+    请求未被接纳
+
+    Args:
+        message: 错误信息
+        status_code: 429(客户端超出预算)或 503(服务端队列已满)
+        retry_after: 建议的重试间隔(秒)
+    """
+
+    def __init__(self, message: str, status_code: int, retry_after: float):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class CostModel:
+    """
+    请求成本估计:预计推理秒数 = 固定开销 + 百万像素数 × 每百万像素耗时
+
+    Args:
+        backends: 各操作的推理后端标签,如 {"upscale": "torch-cuda", "inpaint": "cuda"};
+            标签最后一段(设备类型)用于查找初始耗时估计。
+            "upscale:fast" 这样的降级档位按完整档位的初始估计乘以 FAST_TIER_COST_RATIO
+    """
+
+    def __init__(self, backends: Dict[str, str]):
+        self.backends = dict(backends)
+        self.seconds_per_mpix: Dict[str, float] = {}
+        self.samples: Dict[str, int] = {}
+        for op, backend in self.backends.items():
+            device = backend.rsplit("-", 1)[-1]
+            base, _, tier = op.partition(":")
+            seconds = DEFAULT_SECONDS_PER_MPIX.get((base, device), 1.0)
+            if tier:
+                seconds *= FAST_TIER_COST_RATIO.get(base, 1.0)
+            self.seconds_per_mpix[op] = seconds
+            self.samples[op] = 0
+
+    def estimate(self, op: str, pixels: int) -> float:
+        """op 为 "inpaint+upscale" 这样的组合操作时,成本为各步骤之和(每一步的输入像素数相同)"""
+        if "+" in op:
+            return sum(self.estimate(step, pixels) for step in op.split("+"))
+        return BASE_COST + pixels / 1e6 * self.seconds_per_mpix.get(op, 1.0)
+
+    def observe(self, op: str, pixels: int, seconds: float):
+        """用实际推理耗时修正估计"""
+        if pixels < MIN_OBSERVE_PIXELS or op not in self.seconds_per_mpix:
+            return
+        measured = max(seconds - BASE_COST, 0.0) / (pixels / 1e6)
+        if self.samples[op] == 0:
+            self.seconds_per_mpix[op] = measured
+        else:
+            self.seconds_per_mpix[op] += EWMA_ALPHA * (measured - self.seconds_per_mpix[op])
+        self.samples[op] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            op: {
+                "backend": self.backends[op],
+                "seconds_per_mpix": round(self.seconds_per_mpix[op], 4),
+                "samples": self.samples[op],
+            }
+            for op in self.backends
+        }
+
+
+@dataclass(eq=False)
+class Ticket:
+    """一个请求的排队凭据"""
+    client: str
+    op: str
+    pixels: int
+    cost: float
+    finish: float  # 虚拟完成时间,越小越先放行
+    enqueued_at: float
+    position: int = 0  # 入队时前面的请求数 + 1,0 表示无需排队
+    estimated_wait: float = 0.0  # 入队时的预计等待(秒)
+    admitted_at: Optional[float] = None
+    cancelled: bool = False
+    future: asyncio.Future = field(default=None, repr=False)
+
+    @property
+    def waited(self) -> float:
+        end = self.admitted_at if self.admitted_at is not None else time.perf_counter()
+        return end - self.enqueued_at
+
+    def headers(self) -> Dict[str, str]:
+        """返回给客户端的排队信息响应头"""
+        return {
+            "X-Queue-Position": str(self.position),
+            "X-Estimated-Wait": f"{self.estimated_wait:.2f}",
+            "X-Queue-Wait": f"{self.waited:.2f}",
+            "X-Estimated-Cost": f"{self.cost:.2f}",
+        }
+
+
+@dataclass
+class _ClientState:
+    weight: float = 1.0
+    requests: int = 0  # 排队 + 执行中
+    outstanding_cost: float = 0.0
+    last_finish: float = 0.0
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """解析 "client=weight,..." 形式的权重配置"""
+    weights = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        client, _, weight = item.rpartition("=")
+        if not client or float(weight) <= 0:
+            raise ValueError(f"客户端权重格式错误: {item!r},应为 client=正数")
+        weights[client.strip()] = float(weight)
+    return weights
+
+
+class AdmissionController:
+    """
+    准入控制器
+
+    Args:
+        cost_model: 成本估计
+        max_active: 同时进入流水线的请求数
+        parallelism: 推理并发数,用于估算等待时间
+        max_queue: 排队请求总数上限
+        client_max_requests: 每个客户端排队 + 执行中的请求数上限
+        client_max_cost: 每个客户端排队 + 执行中请求的预计推理秒数上限;
+            客户端没有未完成请求时单个请求总会被接纳,超大图片不会永远被拒绝
+        weights: 客户端权重,未配置的客户端权重为 1
+    """
+
+    def __init__(self, cost_model: CostModel, max_active: int, parallelism: int = 1,
+                 max_queue: int = 64, client_max_requests: int = 4, client_max_cost: float = 300.0,
+                 weights: Optional[Dict[str, float]] = None):
+        self.cost_model = cost_model
+        self.max_active = max(1, max_active)
+        self.parallelism = max(1, parallelism)
+        self.max_queue = max_queue
+        self.client_max_requests = client_max_requests
+        self.client_max_cost = client_max_cost
+        self.weights = weights or {}
+        self.virtual_time = 0.0
+        self._seq = itertools.count()
+        self._queue: List[Tuple[float, int, Ticket]] = []  # (虚拟完成时间, 序号, 凭据) 小顶堆
+        self._queued = 0
+        self._active: Dict[int, Ticket] = {}
+        self._clients: Dict[str, _ClientState] = {}  # 只保留有未完成请求的客户端
+        self._changed = asyncio.Event()  # 有请求完成或撤出,唤醒等待预算的批量任务
+        self.admitted_total = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.wait_seconds = 0.0
+
+    @classmethod
+    def from_env(cls, cost_model: CostModel, parallelism: int) -> "AdmissionController":
+        return cls(
+            cost_model,
+            max_active=int(os.environ.get("ADMISSION_MAX_ACTIVE", "0")) or parallelism * 2,
+            parallelism=parallelism,
+            max_queue=int(os.environ.get("ADMISSION_MAX_QUEUE", "64")),
+            client_max_requests=int(os.environ.get("ADMISSION_CLIENT_MAX_REQUESTS", "4")),
+            client_max_cost=float(os.environ.get("ADMISSION_CLIENT_MAX_COST", "300")),
+            weights=parse_weights(os.environ.get("ADMISSION_CLIENT_WEIGHTS", "")),
+        )
+
+    def _client(self, client: str) -> _ClientState:
+        state = self._clients.get(client)
+        if state is None:
+            state = _ClientState(weight=self.weights.get(client, 1.0))
+        return state
+
+    def _check_budget(self, state: _ClientState, cost: float) -> Optional[str]:
+        """超出客户端预算时返回原因"""
+        if state.requests >= self.client_max_requests:
+            return f"同时进行的请求数已达上限 {self.client_max_requests}"
+        if state.requests > 0 and state.outstanding_cost + cost > self.client_max_cost:
+            return (f"未完成请求的预计推理时间 {state.outstanding_cost + cost:.0f} 秒,"
+                    f"超过上限 {self.client_max_cost:.0f} 秒")
+        return None
+
+    def _backlog(self, before: Optional[float] = None) -> float:
+        """执行中请求的剩余成本 + 排在 before 之前的排队请求成本(秒)"""
+        now = time.perf_counter()
+        backlog = sum(max(t.cost - (now - t.admitted_at), 0.0) for t in self._active.values())
+        backlog += sum(t.cost for finish, _, t in self._queue
+                       if not t.cancelled and (before is None or finish < before))
+        return backlog
+
+    def submit(self, client: str, op: str, pixels: int) -> Ticket:
+        """
+        估算成本并排队,超出预算时抛出 AdmissionRejected
+        返回的凭据需要通过 admitted() 等待放行
+        """
+        cost = self.cost_model.estimate(op, pixels)
+        state = self._client(client)
+        reason = self._check_budget(state, cost)
+        if reason is None and self._queued >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(f"服务繁忙,排队请求已达上限 {self.max_queue}", 503,
+                                    self._backlog() / self.parallelism)
+        if reason is not None:
+            self.rejected += 1
+            raise AdmissionRejected(reason, 429, state.outstanding_cost / self.parallelism)
+        return self._enqueue(client, state, op, pixels, cost)
+
+    async def submit_when_allowed(self, client: str, op: str, pixels: int) -> Ticket:
+        """与 submit 相同,但客户端超出预算时等待其已有请求完成,而不是拒绝(用于批量任务)"""
+        cost = self.cost_model.estimate(op, pixels)
+        while True:
+            state = self._client(client)
+            if self._check_budget(state, cost) is None and self._queued < self.max_queue:
+                break
+            self._changed.clear()
+            await self._changed.wait()
+        return self._enqueue(client, state, op, pixels, cost)
+
+    def _enqueue(self, client: str, state: _ClientState, op: str, pixels: int, cost: float) -> Ticket:
+        finish = max(self.virtual_time, state.last_finish) + cost / state.weight
+        state.last_finish = finish
+        state.requests += 1
+        self._clients[client] = state
+        state.outstanding_cost += cost
+        ticket = Ticket(
+            client=client, op=op, pixels=pixels, cost=cost, finish=finish,
+            enqueued_at=time.perf_counter(),
+            future=asyncio.get_running_loop().create_future(),
+        )
+        if len(self._active) >= self.max_active or self._queued:
+            ahead = sum(1 for f, _, t in self._queue if not t.cancelled and f < finish)
+            ticket.position = ahead + 1
+            ticket.estimated_wait = self._backlog(before=finish) / self.parallelism
+        heapq.heappush(self._queue, (finish, next(self._seq), ticket))
+        self._queued += 1
+        self._dispatch()
+        return ticket
+
+    def _dispatch(self):
+        """按虚拟完成时间放行排队请求,直到执行位占满"""
+        while self._queue and len(self._active) < self.max_active:
+            finish, _, ticket = heapq.heappop(self._queue)
+            if ticket.cancelled:
+                continue
+            self._queued -= 1
+            self.virtual_time = max(self.virtual_time, finish)
+            ticket.admitted_at = time.perf_counter()
+            self._active[id(ticket)] = ticket
+            self.admitted_total += 1
+            self.wait_seconds += ticket.waited
+            ticket.future.set_result(None)
+
+    def _finish(self, ticket: Ticket):
+        """请求完成或放弃,归还客户端预算"""
+        state = self._clients[ticket.client]
+        state.requests -= 1
+        state.outstanding_cost -= ticket.cost
+        self._changed.set()
+        if state.requests == 0:
+            # 空闲客户端不保留状态,虚拟时间已超过其上一个完成时间
+            del self._clients[ticket.client]
+
+    @asynccontextmanager
+    async def admitted(self, ticket: Ticket):
+        """等待放行并占用执行位,退出时释放;等待期间取消(客户端断开)会撤出队列"""
+        try:
+            await ticket.future
+        except BaseException:
+            self.withdraw(ticket)
+            raise
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
+
+    def withdraw(self, ticket: Ticket):
+        """
+        撤回没有进入 admitted() 执行的凭据(可重复调用):
+        排队中的撤出队列,已放行的归还执行位;否则预算与执行位会一直被占用
+        """
+        if ticket.admitted_at is None:
+            if ticket.cancelled:
+                return
+            ticket.cancelled = True
+            self._queued -= 1
+            self.cancelled += 1
+            self._finish(ticket)
+            return
+        self._release(ticket)
+
+    def _release(self, ticket: Ticket):
+        if self._active.pop(id(ticket), None) is None:
+            return
+        self._finish(ticket)
+        self._dispatch()
+
+    def observe(self, ticket: Ticket, infer_seconds: float, op: Optional[str] = None):
+        """记录实际推理耗时,修正成本模型;组合操作按步骤分别记录(op 为其中一步)"""
+        self.cost_model.observe(op or ticket.op, ticket.pixels, infer_seconds)
+
+    def load(self) -> Tuple[int, float]:
+        """当前负载:(排队请求数, 新请求的预计等待秒数)"""
+        return self._queued, self._backlog() / self.parallelism
+
+    def status(self, client: str) -> Dict[str, Any]:
+        """客户端当前的排队情况(位置与预计等待按当前队列重新计算)"""
+        waiting = sorted((f, s, t) for f, s, t in self._queue if not t.cancelled)
+        queued = []
+        for position, (finish, _, ticket) in enumerate(waiting, start=1):
+            if ticket.client == client:
+                queued.append({
+                    "op": ticket.op,
+                    "position": position,
+                    "estimated_wait": round(self._backlog(before=finish) / self.parallelism, 2),
+                    "estimated_cost": round(ticket.cost, 2),
+                    "waited": round(ticket.waited, 2),
+                })
+        state = self._clients.get(client)
+        return {
+            "client": client,
+            "weight": self.weights.get(client, 1.0),
+            "active": sum(1 for t in self._active.values() if t.client == client),
+            "queued": queued,
+            "outstanding_cost": round(state.outstanding_cost, 2) if state else 0.0,
+            "max_requests": self.client_max_requests,
+            "max_cost": self.client_max_cost,
+            "queue_length": len(waiting),
+            "estimated_backlog": round(self._backlog() / self.parallelism, 2),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": len(self._active),
+            "max_active": self.max_active,
+            "queued": self._queued,
+            "max_queue": self.max_queue,
+            "clients": len(self._clients),
+            "admitted": self.admitted_total,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "avg_queue_wait": round(self.wait_seconds / self.admitted_total, 4) if self.admitted_total else None,
+            "estimated_backlog": round(self._backlog() / self.parallelism, 2),
+            "cost_model": self.cost_model.stats(),
+        }
+
+
+def retry_after_header(seconds: float) -> str:
+    """Retry-After 响应头(整数秒,至少 1)"""
+    return str(max(1, math.ceil(seconds)))
@@ -0,0 +1,186 @@
+"""
+批量处理
+- 从多文件上传或 zip / tar 压缩包中读取图片(inpaint 时按文件名配对遮罩)
+- 流水线执行:多张图片同时在途,解码 / 编码与模型推理重叠
+- 结果按完成顺序以 multipart/mixed 流式返回
+"""
+import asyncio
+import os
+import tarfile
+import uuid
+import zipfile
+from dataclasses import dataclass
+from typing import (
+    AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+)
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff"}
+
+# 压缩包中遮罩文件的命名约定: <图片名>_mask.<扩展名>
+MASK_SUFFIX = "_mask"
+
+
+@dataclass
+class BatchItem:
+    """批量任务中的单张图片"""
+    index: int
+    name: str
+    image: bytes
+    mask: Optional[bytes] = None
+    error: Optional[str] = None  # 读取时已失败(如解压后超过大小上限),不再处理
+
+
+def _is_image_name(name: str) -> bool:
+    base = os.path.basename(name)
+    return not base.startswith(".") and os.path.splitext(base)[1].lower() in IMAGE_EXTENSIONS
+
+
+def iter_archive(fileobj, filename: str = "", max_entry_bytes: Optional[int] = None,
+                 max_total_bytes: Optional[int] = None) -> Iterator[Tuple[str, bytes, Optional[str]]]:
+    """
+    逐个读取压缩包中的图片文件(zip 或 tar / tar.gz),按包内顺序返回 (文件名, 内容, 错误)
+    读取是阻塞操作,在事件循环中需放到线程池执行
+
+    解压前按文件头中的大小检查上限(zip 解压时不会超过文件头中的大小):
+    单个文件超过 max_entry_bytes 时不读取,内容为空并返回错误;
+    已读取的总大小超过 max_total_bytes 时抛出 ValueError
+
+    Args:
+        max_entry_bytes: 单个文件解压后的大小上限,None 表示不限制
+        max_total_bytes: 所有文件解压后的总大小上限,None 表示不限制
+    """
+    total = 0
+
+    def check(name: str, size: int) -> Optional[str]:
+        nonlocal total
+        if max_entry_bytes is not None and size > max_entry_bytes:
+            return f"{name} 解压后 {size} 字节,超过单个文件上限 {max_entry_bytes} 字节"
+        total += size
+        if max_total_bytes is not None and total > max_total_bytes:
+            raise ValueError(f"压缩包解压后超过总大小上限 {max_total_bytes} 字节")
+        return None
+
+    fileobj.seek(0)
+    if filename.lower().endswith(".zip") or zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and _is_image_name(info.filename):
+                    error = check(info.filename, info.file_size)
+                    yield info.filename, b"" if error else archive.read(info), error
+        return
+
+    fileobj.seek(0)
+    try:
+        # 流式模式:不需要随机访问,可以边读边处理
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            for member in archive:
+                if member.isfile() and _is_image_name(member.name):
+                    error = check(member.name, member.size)
+                    yield member.name, b"" if error else archive.extractfile(member).read(), error
+    except tarfile.ReadError as e:
+        raise ValueError(f"无法识别的压缩包格式(仅支持 zip / tar): {e}")
+
+
+def pair_masks(entries: Iterable[Tuple[str, bytes, Optional[str]]]) -> List[BatchItem]:
+    """
+    将压缩包中的图片与遮罩配对:photo.jpg <-> photo_mask.png
+    没有遮罩的图片和没有图片的遮罩都会报错;图片或遮罩读取失败时该项带上错误
+    """
+    images: Dict[str, Tuple[str, bytes, Optional[str]]] = {}
+    masks: Dict[str, Tuple[bytes, Optional[str]]] = {}
+    for name, data, error in entries:
+        stem = os.path.splitext(name)[0]
+        if stem.endswith(MASK_SUFFIX):
+            masks[stem[:-len(MASK_SUFFIX)]] = (data, error)
+        else:
+            images[stem] = (name, data, error)
+
+    orphans = sorted(set(masks) - set(images))
+    if orphans:
+        raise ValueError(f"遮罩没有对应的图片: {', '.join(orphans)}")
+    missing = sorted(set(images) - set(masks))
+    if missing:
+        raise ValueError(f"图片缺少遮罩(应命名为 <图片名>{MASK_SUFFIX}.png): {', '.join(missing)}")
+
+    return [
+        BatchItem(index=index, name=images[stem][0], image=images[stem][1], mask=masks[stem][0],
+                  error=images[stem][2] or masks[stem][1])
+        for index, stem in enumerate(sorted(images))
+    ]
+
+
+async def run_pipelined(
+    items: Union[Iterable[BatchItem], AsyncIterable[BatchItem]],
+    process: Callable[[BatchItem], Awaitable],
+    max_inflight: int = 4
+) -> AsyncIterator[Tuple[BatchItem, object, Optional[Exception]]]:
+    """
+    并发处理批量任务,按完成顺序产出 (item, 结果, 异常)
+    同时在途的任务数受 max_inflight 限制,避免整批图片同时解码占满内存
+    items 可以是异步迭代器(如在线程池中读取的压缩包);带 error 的项不调用 process,直接作为失败产出
+    """
+    done = object()
+    results: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(max_inflight)
+    tasks: List[asyncio.Task] = []
+
+    async def run_one(item: BatchItem):
+        try:
+            if item.error is not None:
+                raise ValueError(item.error)
+            await results.put((item, await process(item), None))
+        except Exception as e:
+            await results.put((item, None, e))
+        finally:
+            semaphore.release()
+
+    async def start(item: BatchItem):
+        await semaphore.acquire()
+        tasks.append(asyncio.create_task(run_one(item)))
+
+    async def feed():
+        try:
+            if hasattr(items, "__aiter__"):
+                async for item in items:
+                    await start(item)
+            else:
+                for item in items:
+                    await start(item)
+        finally:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await results.put(done)
+
+    feeder = asyncio.create_task(feed())
+    try:
+        while True:
+            entry = await results.get()
+            if entry is done:
+                break
+            yield entry
+        await feeder  # 传播读取输入(如压缩包格式错误)时的异常
+    finally:
+        # 客户端断开时停止剩余任务
+        feeder.cancel()
+        for task in tasks:
+            task.cancel()
+
+
+class MultipartWriter:
+    """multipart/mixed 流式响应的分段编码"""
+
+    def __init__(self):
+        self.boundary = uuid.uuid4().hex
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/mixed; boundary={self.boundary}"
+
+    def part(self, headers: Dict[str, str], body: bytes) -> bytes:
+        lines = [f"--{self.boundary}"]
+        lines += [f"{key}: {value}" for key, value in headers.items()]
+        lines.append(f"Content-Length: {len(body)}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8") + body + b"\r\n"
+
+    def close(self) -> bytes:
+        return f"--{self.boundary}--\r\n".encode("utf-8")
@@ -0,0 +1,115 @@
+"""
+请求取消
+客户端断开(或通过 DELETE /api/requests/{id} 显式取消)后,不再继续为该请求计算:
+- 排队中的请求直接退出队列
+- 推理中的请求在下一个瓦片之前停止(进程内执行器与 Worker 进程均支持)
+- 推理完成后、编码之前再检查一次,不再编码没有人接收的结果
+
+CancelToken 在事件循环与推理线程之间共享(threading.Event),
+模型只接收 token.check 作为取消检查函数,不依赖本模块
+"""
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class RequestCancelled(Exception):
+    """
+    请求已取消
+    不继承 RuntimeError:超分模型会捕获 RuntimeError 做显存不足重试,取消不应触发重试
+    """
+
+
+class CancelToken:
+    """
+    单个请求的取消令牌
+
+    Args:
+        request_id: 客户端提供的请求 ID(X-Request-ID),用于显式取消
+        client: 客户端标识,只有同一客户端可以取消
+    """
+
+    def __init__(self, request_id: Optional[str] = None, client: Optional[str] = None):
+        self.request_id = request_id
+        self.client = client
+        self.reason: Optional[str] = None
+        self.stage = "queue"  # 请求当前所处的阶段,取消时记入统计
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], Any]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str) -> bool:
+        """取消请求,返回是否是第一次取消(需在事件循环中调用,回调如 task.cancel 不是线程安全的)"""
+        if self._event.is_set():
+            return False
+        self.reason = reason
+        self._event.set()
+        for callback in list(self._callbacks):
+            callback()
+        return True
+
+    def add_callback(self, callback: Callable[[], Any]):
+        """取消时调用 callback(如取消正在等待结果的 asyncio 任务)"""
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback: Callable[[], Any]):
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    def check(self):
+        """请求已取消时抛出 RequestCancelled(在推理线程的瓦片之间调用)"""
+        if self._event.is_set():
+            raise RequestCancelled(f"请求已取消 ({self.reason})")
+
+
+class CancelRegistry:
+    """登记进行中的请求(供显式取消),并统计取消次数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens: Dict[Tuple[str, str], CancelToken] = {}
+        self.active = 0
+        self.completed = 0
+        self.by_reason: Counter = Counter()
+        self.by_stage: Counter = Counter()
+
+    def open(self, request_id: Optional[str], client: str) -> CancelToken:
+        token = CancelToken(request_id, client)
+        with self._lock:
+            self.active += 1
+            if request_id:
+                self._tokens[(client, request_id)] = token
+        return token
+
+    def close(self, token: CancelToken):
+        """请求结束:注销并记入统计"""
+        with self._lock:
+            self.active -= 1
+            if token.request_id and self._tokens.get((token.client, token.request_id)) is token:
+                del self._tokens[(token.client, token.request_id)]
+            if token.cancelled:
+                self.by_reason[token.reason] += 1
+                self.by_stage[token.stage] += 1
+            else:
+                self.completed += 1
+
+    def cancel(self, client: str, request_id: str) -> Optional[CancelToken]:
+        """显式取消,请求不存在(或已完成)时返回 None"""
+        with self._lock:
+            token = self._tokens.get((client, request_id))
+        if token is not None:
+            token.cancel("cancelled")
+        return token
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": self.active,
+                "completed": self.completed,
+                "cancelled": sum(self.by_reason.values()),
+                "cancelled_by_reason": dict(self.by_reason),
+                "cancelled_by_stage": dict(self.by_stage),
+            }
@@ -0,0 +1,283 @@
+"""
+大图模式:磁盘上的输出画布与流式编码
+超大图片的放大结果(如 10000x8000 放大 4 倍约 3.8GB)不在内存中分配:
+- 输出画布是临时目录中的 .npy 内存映射文件,瓦片推理完成后直接写入
+- 每写完一行瓦片,对应的输出行刷到磁盘并从进程地址空间释放(madvise DONTNEED)
+- PNG / TIFF 编码器按行块读取画布,边读边写入输出文件,读过的行同样释放
+进程常驻内存只与瓦片工作集和行块大小有关,与输出尺寸无关
+
+Worker 模式下服务进程创建画布,Worker 按路径打开同一个文件写入
+
+配置(环境变量):
+    LARGE_IMAGE_DIR        画布与编码结果的临时目录(默认 系统临时目录/inpaint-large)
+    LARGE_IMAGE_THRESHOLD  输出超过该大小时自动使用大图模式,如 "1G"(默认 1G)
+"""
+import mmap
+import os
+import struct
+import tempfile
+import uuid
+import zlib
+from typing import BinaryIO, Optional, Tuple
+
+import numpy as np
+
+# 编码时每次读取的行块大小(字节)
+ENCODE_BLOCK_BYTES = 8 * 1024 ** 2
+# 每个 IDAT 块的最小大小(字节),压缩输出先累积到该大小再写出
+PNG_CHUNK_BYTES = 1024 ** 2
+# TIFF 每个条带的目标大小(字节)
+TIFF_STRIP_BYTES = 1024 ** 2
+
+
+def default_large_image_dir() -> str:
+    return os.environ.get("LARGE_IMAGE_DIR", os.path.join(tempfile.gettempdir(), "inpaint-large"))
+
+
+def release_rows(array: np.ndarray, y0: int, y1: int):
+    """
+    把内存映射数组的 [y0, y1) 行刷到磁盘并从进程地址空间释放
+    数据仍在文件(和页缓存)中,再次访问时从文件读入;非内存映射数组或平台不支持时不做任何事
+    """
+    mm = getattr(array, "_mmap", None)
+    if mm is None or y1 <= y0 or not hasattr(mm, "madvise"):
+        return
+    row_bytes = array.strides[0]
+    # np.memmap 的映射起点按 ALLOCATIONGRANULARITY 对齐,数组位于映射内的 delta 处
+    delta = array.offset % mmap.ALLOCATIONGRANULARITY
+    page = mmap.PAGESIZE
+    start = -(-(delta + y0 * row_bytes) // page) * page
+    end = (delta + y1 * row_bytes) // page * page
+    if end <= start:
+        return
+    mm.flush(start, end - start)
+    mm.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+
+class DiskCanvas:
+    """
+    磁盘上的 HWC uint8 输出画布(.npy 内存映射文件)
+
+    Args:
+        path: 文件路径
+        array: 内存映射数组
+    """
+
+    def __init__(self, path: str, array: np.memmap):
+        self.path = path
+        self.array = array
+
+    @classmethod
+    def create(cls, directory: str, shape: Tuple[int, ...]) -> "DiskCanvas":
+        """在 directory 中创建画布(稀疏文件,未写入的部分不占磁盘)"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"canvas-{uuid.uuid4().hex}.npy")
+        array = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=tuple(shape))
+        return cls(path, array)
+
+    @staticmethod
+    def open(path: str) -> np.memmap:
+        """以读写方式打开已创建的画布(Worker 进程中使用)"""
+        return np.load(path, mmap_mode="r+")
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.array.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.array.nbytes
+
+    def release(self, y0: int, y1: int):
+        release_rows(self.array, y0, y1)
+
+    def delete(self):
+        """关闭映射并删除文件(可重复调用)"""
+        if self.array is not None:
+            mm = getattr(self.array, "_mmap", None)
+            self.array = None
+            if mm is not None:
+                try:
+                    mm.close()
+                except BufferError:
+                    pass  # 仍有视图引用映射,随视图回收
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _block_rows(array: np.ndarray) -> int:
+    return max(1, ENCODE_BLOCK_BYTES // max(1, array.strides[0]))
+
+
+def _png_chunk(f: BinaryIO, kind: bytes, data: bytes):
+    f.write(struct.pack(">I", len(data)))
+    f.write(kind)
+    f.write(data)
+    f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)) & 0xFFFFFFFF))
+
+
+def _paeth_filter(rows: np.ndarray, prev: Optional[np.ndarray], channels: int) -> bytes:
+    """
+    对行块做 Paeth 滤波(PNG 滤波类型 4),返回每行前加滤波类型字节的数据
+    预测值只依赖原始像素(左、上、左上),整块可以向量化计算
+    """
+    raw = rows.reshape(rows.shape[0], -1).astype(np.int16)
+    up = np.empty_like(raw)
+    up[0] = prev.reshape(-1) if prev is not None else 0
+    up[1:] = raw[:-1]
+    left = np.zeros_like(raw)
+    left[:, channels:] = raw[:, :-channels]
+    upper_left = np.zeros_like(raw)
+    upper_left[:, channels:] = up[:, :-channels]
+    pa = np.abs(up - upper_left)
+    pb = np.abs(left - upper_left)
+    pc = np.abs(left + up - 2 * upper_left)
+    pred = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, upper_left))
+    out = np.empty((raw.shape[0], raw.shape[1] + 1), dtype=np.uint8)
+    out[:, 0] = 4
+    out[:, 1:] = (raw - pred) & 0xFF
+    return out.tobytes()
+
+
+def write_png(array: np.ndarray, f: BinaryIO, compress_level: int = 6, release: bool = True):
+    """
+    按行块流式编码 PNG(RGB / RGBA / L,8 位),不在内存中保存整张图片
+
+    Args:
+        array: HWC / HW uint8 数组(通常为内存映射画布)
+        f: 可写的二进制文件对象
+        compress_level: zlib 压缩级别(0~9)
+        release: 读过的行从进程地址空间释放(内存映射数组时)
+    """
+    height, width = array.shape[:2]
+    channels = array.shape[2] if array.ndim == 3 else 1
+    color_type = {1: 0, 3: 2, 4: 6}[channels]
+    f.write(b"\x89PNG\r\n\x1a\n")
+    _png_chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 15, 9)
+    pending = []
+    pending_bytes = 0
+    prev = None
+    step = _block_rows(array)
+    for y0 in range(0, height, step):
+        y1 = min(y0 + step, height)
+        rows = np.asarray(array[y0:y1])
+        data = compressor.compress(_paeth_filter(rows, prev, channels))
+        prev = rows[-1].copy()
+        del rows
+        if release:
+            release_rows(array, y0, y1)
+        if data:
+            pending.append(data)
+            pending_bytes += len(data)
+        if pending_bytes >= PNG_CHUNK_BYTES:
+            _png_chunk(f, b"IDAT", b"".join(pending))
+            pending, pending_bytes = [], 0
+    pending.append(compressor.flush())
+    _png_chunk(f, b"IDAT", b"".join(pending))
+    _png_chunk(f, b"IEND", b"")
+
+
+# TIFF 字段类型:SHORT / LONG / LONG8
+_TIFF_TYPES = {3: ("H", 2), 4: ("I", 4), 16: ("Q", 8)}
+
+
+def write_tiff(array: np.ndarray, f: BinaryIO, release: bool = True, bigtiff: Optional[bool] = None):
+    """
+    按条带流式写出未压缩的 TIFF(RGB / RGBA / L,8 位,小端)
+    未压缩的条带大小固定,IFD 与条带偏移可以在写入像素之前算好,无需回写文件头
+
+    Args:
+        array: HWC / HW uint8 数组(通常为内存映射画布)
+        f: 可写的二进制文件对象
+        release: 读过的行从进程地址空间释放(内存映射数组时)
+        bigtiff: 是否使用 BigTIFF,None 时在文件超过 4GB 时自动使用
+    """
+    height, width = array.shape[:2]
+    channels = array.shape[2] if array.ndim == 3 else 1
+    row_bytes = width * channels
+    rows_per_strip = max(1, min(height, TIFF_STRIP_BYTES // row_bytes))
+    strips = -(-height // rows_per_strip)
+    counts = [rows_per_strip * row_bytes] * strips
+    counts[-1] = (height - rows_per_strip * (strips - 1)) * row_bytes
+    if bigtiff is None:
+        bigtiff = height * row_bytes + strips * 16 + 4096 >= 2 ** 32
+
+    offset_type = 16 if bigtiff else 4
+    entries = [
+        (256, 4, [width]),                                   # ImageWidth
+        (257, 4, [height]),                                  # ImageLength
+        (258, 3, [8] * channels),                            # BitsPerSample
+        (259, 3, [1]),                                       # Compression: 无
+        (262, 3, [1 if channels == 1 else 2]),               # Photometric: 灰度 / RGB
+        (273, offset_type, [0] * strips),                    # StripOffsets(稍后填入)
+        (277, 3, [channels]),                                # SamplesPerPixel
+        (278, 4, [rows_per_strip]),                          # RowsPerStrip
+        (279, offset_type, counts),                          # StripByteCounts
+        (284, 3, [1]),                                       # PlanarConfiguration: 交错
+    ]
+    if channels == 4:
+        entries.append((338, 3, [2]))                        # ExtraSamples: 非预乘 alpha
+
+    if bigtiff:
+        header_size, entry_size, inline, count_fmt, offset_fmt = 16, 20, 8, "<Q", "<Q"
+        ifd_size = 8 + entry_size * len(entries) + 8
+    else:
+        header_size, entry_size, inline, count_fmt, offset_fmt = 8, 12, 4, "<H", "<I"
+        ifd_size = 2 + entry_size * len(entries) + 4
+
+    # 布局:文件头 | IFD | 放不进 IFD 的字段值 | 像素条带
+    position = header_size + ifd_size
+    external = {}
+    for tag, kind, values in entries:
+        size = _TIFF_TYPES[kind][1] * len(values)
+        if size > inline:
+            external[tag] = position
+            position += size + size % 2
+    data_start = position
+    offsets = [data_start + i * counts[0] for i in range(strips)]
+    entries[5] = (273, offset_type, offsets)
+
+    def pack_values(kind, values) -> bytes:
+        fmt, _ = _TIFF_TYPES[kind]
+        return struct.pack(f"<{len(values)}{fmt}", *values)
+
+    if bigtiff:
+        f.write(b"II" + struct.pack("<HHHQ", 43, 8, 0, header_size))
+    else:
+        f.write(b"II" + struct.pack("<HI", 42, header_size))
+    f.write(struct.pack(count_fmt, len(entries)))
+    for tag, kind, values in entries:
+        data = pack_values(kind, values)
+        f.write(struct.pack("<HH", tag, kind))
+        f.write(struct.pack(offset_fmt, len(values)))
+        if tag in external:
+            f.write(struct.pack(offset_fmt, external[tag]))
+        else:
+            f.write(data.ljust(inline, b"\0"))
+    f.write(struct.pack(offset_fmt, 0))  # 没有下一个 IFD
+    for tag, kind, values in entries:
+        if tag in external:
+            data = pack_values(kind, values)
+            f.write(data + b"\0" * (len(data) % 2))
+
+    step = max(rows_per_strip, _block_rows(array) // rows_per_strip * rows_per_strip)
+    for y0 in range(0, height, step):
+        y1 = min(y0 + step, height)
+        f.write(np.ascontiguousarray(array[y0:y1]).tobytes())
+        if release:
+            release_rows(array, y0, y1)
+
+
+def encode_canvas(canvas: DiskCanvas, path: str, image_format: str = "png",
+                  compress_level: Optional[int] = None) -> str:
+    """把画布流式编码到 path(PNG 或 TIFF),返回 path;compress_level 为 None 时使用 6"""
+    with open(path, "wb") as f:
+        if image_format == "tiff":
+            write_tiff(canvas.array, f)
+        else:
+            write_png(canvas.array, f, 6 if compress_level is None else compress_level)
+    return path
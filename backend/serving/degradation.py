@@ -0,0 +1,178 @@
+"""
+负载感知的质量降级
+队列很深时,与其让请求等到超时,不如用更轻的模型返回稍差一些的结果。
+每个请求在排队之前按当前负载选择质量档位:
+
+- full: 默认模型(x4plus / LaMa)与默认编码设置
+- fast: 降级模型(如 anime_6B / x2plus、MI-GAN / OpenCV)与更快的编码设置(低 PNG 压缩级别)
+- fast-encode: 默认模型与更快的编码设置(大图模式按默认模型的原生倍数写入画布,只降低编码设置)
+
+排队请求数、预计等待时间、系统内存使用率任意一项达到阈值时降级。
+客户端可以用 quality=full 退出降级,或用 quality=fast 主动选择降级档位
+
+配置(环境变量):
+    DEGRADE_QUEUE_DEPTH        排队请求数达到该值时降级(默认 8,0 表示不按队列深度降级)
+    DEGRADE_PREDICTED_WAIT     预计等待秒数达到该值时降级(默认 30,0 表示不按等待时间降级)
+    DEGRADE_MEMORY_PERCENT     系统内存使用率(%)达到该值时降级(默认 90,0 表示不按内存降级)
+    DEGRADE_PNG_COMPRESS_LEVEL 降级档位的 PNG 压缩级别(默认 1)
+    DEGRADE_UPSCALE_MODEL      降级档位的超分权重(默认 RealESRGAN_x4plus_anime_6B)
+    DEGRADE_INPAINT_MODEL      降级档位的 Inpaint 模型 migan / opencv(默认 migan,缺少权重时使用 opencv)
+"""
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+TIER_FULL = "full"
+TIER_FAST = "fast"
+TIER_FAST_ENCODE = "fast-encode"
+# 客户端可选的 quality 参数:auto 按负载选择,full / fast 固定档位
+QUALITY_OPTIONS = ("auto", TIER_FULL, TIER_FAST)
+
+
+def tier_op(op: str, tier: str) -> str:
+    """
+    档位对应的成本模型操作名:降级档位为 "upscale:fast",组合操作的每一步分别加后缀
+    降级模型的耗时与完整模型差别很大,成本模型分开估计
+    """
+    if tier != TIER_FAST:
+        return op
+    return "+".join(f"{step}:{TIER_FAST}" for step in op.split("+"))
+
+
+def stage_name(op: str) -> str:
+    """成本模型操作名对应的流水线阶段名("upscale:fast" -> "upscale")"""
+    return op.split(":", 1)[0]
+
+
+def memory_pressure() -> Optional[float]:
+    """系统内存使用比例(0~1),优先使用 psutil,否则读取 /proc/meminfo;无法读取时返回 None"""
+    try:
+        import psutil
+        return psutil.virtual_memory().percent / 100
+    except ImportError:
+        pass
+    values = {}
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("MemTotal", "MemAvailable"):
+                    values[key] = int(value.split()[0])
+    except OSError:
+        return None
+    if not values.get("MemTotal") or "MemAvailable" not in values:
+        return None
+    return 1 - values["MemAvailable"] / values["MemTotal"]
+
+
+@dataclass
+class TierDecision:
+    """一个请求的质量档位"""
+    tier: str
+    reason: Optional[str] = None  # 降级原因,如 "queue=12>=8";客户端主动选择时为 "requested"
+    png_compress_level: Optional[int] = None  # None 表示默认编码设置
+
+    @property
+    def degraded(self) -> bool:
+        return self.tier != TIER_FULL
+
+    def op(self, op: str) -> str:
+        return tier_op(op, self.tier)
+
+    def headers(self) -> Dict[str, str]:
+        """返回给客户端的档位响应头"""
+        headers = {"X-Quality-Tier": self.tier}
+        if self.reason:
+            headers["X-Degrade-Reason"] = self.reason
+        return headers
+
+
+class DegradationPolicy:
+    """
+    按负载选择质量档位
+
+    Args:
+        queue_depth: 排队请求数达到该值时降级,0 表示不使用该项
+        predicted_wait: 预计等待秒数达到该值时降级,0 表示不使用该项
+        memory_percent: 系统内存使用率(%)达到该值时降级,0 表示不使用该项
+        png_compress_level: 降级档位的 PNG 压缩级别
+    """
+
+    def __init__(self, queue_depth: int = 8, predicted_wait: float = 30.0,
+                 memory_percent: float = 90.0, png_compress_level: int = 1):
+        self.queue_depth = queue_depth
+        self.predicted_wait = predicted_wait
+        self.memory_percent = memory_percent
+        self.png_compress_level = png_compress_level
+        self.decisions = {TIER_FULL: 0, TIER_FAST: 0, TIER_FAST_ENCODE: 0}
+        self.opted_out = 0  # 按负载本应降级,但客户端要求 full 的请求数
+
+    @classmethod
+    def from_env(cls) -> "DegradationPolicy":
+        return cls(
+            queue_depth=int(os.environ.get("DEGRADE_QUEUE_DEPTH", "8")),
+            predicted_wait=float(os.environ.get("DEGRADE_PREDICTED_WAIT", "30")),
+            memory_percent=float(os.environ.get("DEGRADE_MEMORY_PERCENT", "90")),
+            png_compress_level=int(os.environ.get("DEGRADE_PNG_COMPRESS_LEVEL", "1")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        """是否可能按负载降级(所有阈值为 0 时只有 quality=fast 的请求使用降级档位)"""
+        return self.queue_depth > 0 or self.predicted_wait > 0 or self.memory_percent > 0
+
+    def overload(self, queued: int, predicted_wait: float, memory: Optional[float]) -> Optional[str]:
+        """负载超过阈值时返回原因,否则返回 None"""
+        if self.queue_depth > 0 and queued >= self.queue_depth:
+            return f"queue={queued}>={self.queue_depth}"
+        if self.predicted_wait > 0 and predicted_wait >= self.predicted_wait:
+            return f"wait={predicted_wait:.0f}s>={self.predicted_wait:.0f}s"
+        if self.memory_percent > 0 and memory is not None and memory * 100 >= self.memory_percent:
+            return f"memory={memory * 100:.0f}%>={self.memory_percent:.0f}%"
+        return None
+
+    def decide(self, quality: str, queued: int, predicted_wait: float,
+               memory: Optional[float] = None) -> TierDecision:
+        """
+        选择档位,quality 不是 QUALITY_OPTIONS 之一时抛出 ValueError
+
+        Args:
+            quality: 客户端要求的档位(auto / full / fast)
+            queued: 当前排队请求数
+            predicted_wait: 新请求的预计等待秒数
+            memory: 系统内存使用比例(0~1),未知时为 None
+        """
+        if quality not in QUALITY_OPTIONS:
+            raise ValueError(f"不支持的 quality: {quality},可选: {list(QUALITY_OPTIONS)}")
+        if quality == TIER_FAST:
+            reason = "requested"
+        else:
+            reason = self.overload(queued, predicted_wait, memory)
+            if reason is not None and quality == TIER_FULL:
+                self.opted_out += 1
+                reason = None
+        if reason is None:
+            self.decisions[TIER_FULL] += 1
+            return TierDecision(TIER_FULL)
+        self.decisions[TIER_FAST] += 1
+        return TierDecision(TIER_FAST, reason, self.png_compress_level)
+
+    def encode_only(self, decision: TierDecision) -> TierDecision:
+        """不能换用降级模型的请求(大图模式):降级时只使用降级档位的编码设置,档位记为 fast-encode"""
+        if decision.tier != TIER_FAST:
+            return decision
+        self.decisions[TIER_FAST] -= 1
+        self.decisions[TIER_FAST_ENCODE] += 1
+        return TierDecision(TIER_FAST_ENCODE, decision.reason, decision.png_compress_level)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "thresholds": {
+                "queue_depth": self.queue_depth,
+                "predicted_wait": self.predicted_wait,
+                "memory_percent": self.memory_percent,
+            },
+            "png_compress_level": self.png_compress_level,
+            "decisions": dict(self.decisions),
+            "opted_out": self.opted_out,
+        }
@@ -0,0 +1,278 @@
+"""
+解码 -> 推理 -> 编码 分阶段流水线
+解码 / 预处理和后处理 / 编码各有独立的 CPU 线程池,与推理阶段之间通过有界队列连接:
+请求 N 推理的同时,请求 N+1 在解码、请求 N-1 在编码
+
+有界队列的实现方式是"交接式"占位:请求完成当前阶段后,先占到下一阶段的位置,
+再释放当前阶段的位置。下游阻塞时上游的位置不会释放,解码出的大图不会无限堆积
+
+配置(环境变量):
+    PIPELINE_DECODE_THREADS  解码线程数(默认 min(4, CPU 核数))
+    PIPELINE_ENCODE_THREADS  编码线程数(默认 min(4, CPU 核数))
+    PIPELINE_QUEUE_SIZE      每个阶段在执行之外最多排队的请求数(默认 4)
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Union
+
+from .cancel import CancelToken
+from .profiling import Trace
+
+# 利用率统计的滑动窗口(秒)
+UTILIZATION_WINDOW = 60.0
+
+
+class Stage:
+    """
+    流水线中的一个阶段
+
+    Args:
+        name: 阶段名
+        workers: 可同时执行的任务数(线程数 / 推理并发数)
+        queue_size: 执行之外最多占位等待的任务数
+        executor: 是否创建线程池;推理阶段在模型执行器或 Worker 池中运行,只做占位与计时
+    """
+
+    def __init__(self, name: str, workers: int, queue_size: int, executor: bool = True):
+        self.name = name
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self._slots = asyncio.Semaphore(self.workers + self.queue_size)  # 执行中 + 排队
+        self._run_slots = asyncio.Semaphore(self.workers)  # 执行中
+        self._executor = (
+            ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"pipeline-{name}")
+            if executor else None
+        )
+        self.waiting = 0      # 等待占位
+        self.held = 0         # 已占位(执行中或等待下游)
+        self.active = 0       # 执行中
+        self.processed = 0
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+        self._running: Dict[int, float] = {}
+        self._intervals = deque()  # 最近完成的 (开始, 结束),用于滑动窗口利用率
+
+    async def acquire(self) -> float:
+        """占位,返回等待时间(秒)"""
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - start
+        self.held += 1
+        self.wait_seconds += waited
+        return waited
+
+    def release(self):
+        self.held -= 1
+        self._slots.release()
+
+    @asynccontextmanager
+    async def busy(self):
+        """
+        等待空闲的执行位并记录忙碌时间(执行本身可以发生在其他线程 / 进程中)
+        占位后等待执行位的时间计入等待时间
+        """
+        token = object()
+        queued = time.perf_counter()
+        await self._run_slots.acquire()
+        start = time.perf_counter()
+        self.wait_seconds += start - queued
+        self.active += 1
+        self._running[id(token)] = start
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            del self._running[id(token)]
+            self.active -= 1
+            self.processed += 1
+            self.busy_seconds += end - start
+            self._intervals.append((start, end))
+            self._prune(end)
+            self._run_slots.release()
+
+    async def call(self, fn: Callable, *args):
+        """在本阶段线程池中执行 fn,不做统计"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def execute(self, fn: Callable, *args):
+        """在本阶段线程池中执行 fn 并计入忙碌时间(调用方需已占位)"""
+        async with self.busy():
+            return await self.call(fn, *args)
+
+    def _prune(self, now: float):
+        while self._intervals and self._intervals[0][1] < now - UTILIZATION_WINDOW:
+            self._intervals.popleft()
+
+    def utilization(self) -> float:
+        """最近 UTILIZATION_WINDOW 秒内的平均利用率(0~1)"""
+        now = time.perf_counter()
+        self._prune(now)
+        window_start = now - UTILIZATION_WINDOW
+        busy = sum(end - max(start, window_start) for start, end in self._intervals)
+        busy += sum(now - max(start, window_start) for start in self._running.values())
+        return min(1.0, busy / (UTILIZATION_WINDOW * self.workers))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "blocked": self.held - self.active,  # 已完成,等待下游阶段空位
+            "waiting": self.waiting,
+            "processed": self.processed,
+            "avg_busy_seconds": round(self.busy_seconds / self.processed, 4) if self.processed else None,
+            "avg_wait_seconds": round(self.wait_seconds / self.processed, 4) if self.processed else None,
+            "utilization": round(self.utilization(), 3),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+@dataclass
+class PipelineResult:
+    """一次流水线执行的结果与各阶段耗时(秒)"""
+    decoded: Any
+    output: Any
+    encoded: Any
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+class Pipeline:
+    """
+    解码 / 推理 / 编码三阶段流水线,推理阶段按操作(upscale / inpaint)区分
+
+    Args:
+        infer_workers: 各推理阶段的并发数,如 {"upscale": 1, "inpaint": 1}
+        decode_threads / encode_threads: 解码 / 编码线程数,0 表示自动
+        queue_size: 每个阶段的有界队列长度
+    """
+
+    def __init__(self, infer_workers: Dict[str, int], decode_threads: int = 0,
+                 encode_threads: int = 0, queue_size: int = 4):
+        default_threads = min(4, os.cpu_count() or 1)
+        self.stages: Dict[str, Stage] = {
+            "decode": Stage("decode", decode_threads or default_threads, queue_size),
+        }
+        for op, workers in infer_workers.items():
+            self.stages[op] = Stage(op, workers, queue_size, executor=False)
+        self.stages["encode"] = Stage("encode", encode_threads or default_threads, queue_size)
+
+    @classmethod
+    def from_env(cls, infer_workers: Dict[str, int]) -> "Pipeline":
+        return cls(
+            infer_workers,
+            decode_threads=int(os.environ.get("PIPELINE_DECODE_THREADS", "0")),
+            encode_threads=int(os.environ.get("PIPELINE_ENCODE_THREADS", "0")),
+            queue_size=int(os.environ.get("PIPELINE_QUEUE_SIZE", "4")),
+        )
+
+    async def run(
+        self,
+        op: Union[str, Sequence[str]],
+        decode: Callable[[], Any],
+        infer: Union[Callable[[Any], Awaitable], Sequence[Callable[[Any], Awaitable]]],
+        encode: Callable[[Any], Any],
+        on_decoded: Optional[Callable[[Any], None]] = None,
+        cancel: Optional[CancelToken] = None,
+        trace: Optional[Trace] = None,
+    ) -> PipelineResult:
+        """
+        执行一次 解码 -> 推理 -> 编码
+
+        Args:
+            op: 推理阶段名(upscale / inpaint);依次经过多个推理阶段时为阶段名列表
+            decode: 解码函数,在解码线程池中执行
+            infer: 推理协程函数,参数为解码结果;多个推理阶段时为与 op 一一对应的列表,
+                每个阶段的参数为上一阶段的结果(中间结果留在内存中,不编码)
+            encode: 编码函数,参数为(最后一个阶段的)推理结果,在编码线程池中执行
+            on_decoded: 解码完成后(等待推理之前)在事件循环中调用,如发送预览
+            cancel: 取消令牌,推理和编码之前检查,已取消时抛出 RequestCancelled
+            trace: 性能剖析 trace,记录各阶段的等待与执行区间
+
+        timings 中推理阶段记为 infer_wait / infer;多个推理阶段时按阶段名记为
+        <op>_wait / <op>,infer 为各推理阶段耗时之和
+        """
+        ops = [op] if isinstance(op, str) else list(op)
+        infers = [infer] if callable(infer) else list(infer)
+        if len(ops) != len(infers):
+            raise ValueError(f"推理阶段数 {len(ops)} 与推理函数数 {len(infers)} 不一致")
+        chained = len(ops) > 1
+        decode_stage, encode_stage = self.stages["decode"], self.stages["encode"]
+        infer_stages = [self.stages[name] for name in ops]
+        timings: Dict[str, float] = {}
+
+        def enter(stage: Stage):
+            if cancel is not None:
+                cancel.check()
+                cancel.stage = stage.name
+
+        def record(name: str, start: float):
+            end = time.perf_counter()
+            timings[name] = end - start
+            if trace is not None:
+                trace.add(name, start, end, "wait" if name.endswith("_wait") else "stage")
+
+        enter(decode_stage)
+        start = time.perf_counter()
+        await decode_stage.acquire()
+        record("decode_wait", start)
+        try:
+            async with decode_stage.busy():
+                start = time.perf_counter()
+                decoded = await decode_stage.call(decode)
+                record("decode", start)
+            if on_decoded is not None:
+                on_decoded(decoded)
+            start = time.perf_counter()
+            await infer_stages[0].acquire()
+            record(f"{ops[0]}_wait" if chained else "infer_wait", start)
+        finally:
+            decode_stage.release()
+
+        output = decoded
+        for i, (infer_stage, infer_fn) in enumerate(zip(infer_stages, infers)):
+            next_stage = infer_stages[i + 1] if i + 1 < len(infer_stages) else encode_stage
+            try:
+                enter(infer_stage)
+                async with infer_stage.busy():
+                    start = time.perf_counter()
+                    output = await infer_fn(output)
+                    record(infer_stage.name if chained else "infer", start)
+                start = time.perf_counter()
+                await next_stage.acquire()
+                record(f"{next_stage.name}_wait", start)
+            finally:
+                infer_stage.release()
+        if chained:
+            timings["infer"] = sum(timings[name] for name in ops)
+
+        try:
+            # 推理完成后再检查一次:客户端已断开时不再编码
+            enter(encode_stage)
+            async with encode_stage.busy():
+                start = time.perf_counter()
+                encoded = await encode_stage.call(encode, output)
+                record("encode", start)
+        finally:
+            encode_stage.release()
+
+        return PipelineResult(decoded, output, encoded, timings)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: stage.stats() for name, stage in self.stages.items()}
+
+    def shutdown(self):
+        for stage in self.stages.values():
+            stage.shutdown()
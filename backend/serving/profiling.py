@@ -0,0 +1,270 @@
+"""
+按请求采集性能剖析(Chrome trace)
+授权的调用方(X-Profile 头与 PROFILE_TOKEN 一致)或按比例抽样的请求会记录一份 trace:
+- 准入排队、解码、推理、编码各阶段的区间
+- 超分模型每个瓦片的推理区间(Worker 进程内推理时同样记录)
+- 推理后端自带的剖析结果:torch.profiler 或 ONNX Runtime profiling
+
+trace 保存为 Chrome trace JSON(chrome://tracing 或 https://ui.perfetto.dev 可直接打开),
+保存目录按文件数与总大小淘汰最旧的 trace
+
+时间戳统一使用 time.perf_counter(微秒):Linux / macOS / Windows 上都是系统范围的单调时钟,
+Worker 进程记录的区间可以直接与服务进程的区间合并
+
+配置(环境变量):
+    PROFILE_TOKEN        授权令牌,请求头 X-Profile 与之相同时采集(为空时只按比例抽样)
+    PROFILE_SAMPLE_RATE  按比例抽样的请求比例(0~1,默认 0)
+    PROFILE_DIR          trace 保存目录(默认 系统临时目录/inpaint-profiles)
+    PROFILE_MAX_TRACES   最多保留的 trace 数(默认 100)
+    PROFILE_MAX_BYTES    trace 总大小上限,如 "256M"(默认 256M)
+"""
+import hmac
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+_TRACE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def is_valid_trace_id(trace_id: str) -> bool:
+    return bool(_TRACE_ID_RE.match(trace_id))
+
+
+def _us(seconds: float) -> float:
+    return round(seconds * 1e6, 3)
+
+
+class Trace:
+    """
+    单个请求的 Chrome trace 事件
+
+    Args:
+        process_name: 本进程在 trace 中显示的名称
+    """
+
+    def __init__(self, process_name: str = "api"):
+        self.trace_id = uuid.uuid4().hex
+        self.pid = os.getpid()
+        self.events: List[Dict[str, Any]] = []
+        self.meta: Dict[str, Any] = {}
+        self._lock = threading.Lock()  # 区间可能在解码 / 推理 / 编码线程中记录
+        self._threads = set()
+        self._append({"name": "process_name", "ph": "M", "pid": self.pid, "tid": 0,
+                      "args": {"name": process_name}})
+
+    def _append(self, event: Dict[str, Any]):
+        with self._lock:
+            self.events.append(event)
+
+    def _tid(self) -> int:
+        thread = threading.current_thread()
+        tid = thread.native_id or 0
+        if tid not in self._threads:
+            self._threads.add(tid)
+            self._append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                          "args": {"name": thread.name}})
+        return tid
+
+    def add(self, name: str, start: float, end: float, cat: str = "stage",
+            args: Optional[Dict[str, Any]] = None):
+        """记录一个区间(start / end 为 time.perf_counter 秒),线程为当前线程"""
+        event = {"name": name, "cat": cat, "ph": "X", "pid": self.pid, "tid": self._tid(),
+                 "ts": _us(start), "dur": _us(end - start)}
+        if args:
+            event["args"] = args
+        self._append(event)
+
+    @contextmanager
+    def span(self, name: str, cat: str = "stage", **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter(), cat, args)
+
+    def on_tile(self, tile, start: float, end: float):
+        """超分模型的瓦片回调:每个瓦片推理完成后调用"""
+        self.add(f"tile {tile.index}", start, end, "tile", {
+            "x": tile.x0, "y": tile.y0, "width": tile.x1 - tile.x0, "height": tile.y1 - tile.y0,
+            "padded": f"{tile.pad_x1 - tile.pad_x0}x{tile.pad_y1 - tile.pad_y0}",
+        })
+
+    def merge(self, events: List[Dict[str, Any]], start: float):
+        """
+        合并推理后端自带 profiler 的事件
+        外部 profiler 使用各自的时钟,按最早的事件对齐到包裹它的区间起点 start
+        """
+        timed = [e for e in events if isinstance(e.get("ts"), (int, float))]
+        if not timed:
+            return
+        offset = _us(start) - min(e["ts"] for e in timed)
+        tid = self._tid()
+        with self._lock:
+            for event in events:
+                event = dict(event, pid=self.pid)
+                event.setdefault("tid", tid)
+                if isinstance(event.get("ts"), (int, float)):
+                    event["ts"] = round(event["ts"] + offset, 3)
+                self.events.append(event)
+
+    def extend(self, events: List[Dict[str, Any]]):
+        """合并其他进程(Worker)记录的事件,时间戳已是 perf_counter 微秒"""
+        with self._lock:
+            self.events.extend(events)
+
+    @contextmanager
+    def profile_model(self, model):
+        """
+        在区间内启用模型自带的 profiler(model.profiler(),没有时只记录区间)
+        profiler 为上下文管理器,退出后返回的列表中是 Chrome trace 事件
+        """
+        profiler = getattr(model, "profiler", None)
+        if profiler is None:
+            yield
+            return
+        start = time.perf_counter()
+        with profiler() as events:
+            yield
+        self.merge(events, start)
+
+    def to_json(self) -> Dict[str, Any]:
+        with self._lock:
+            events = list(self.events)
+        return {"traceEvents": events, "displayTimeUnit": "ms", "metadata": dict(self.meta)}
+
+
+def profile_model(trace: Optional[Trace], model):
+    """trace 为 None 时不做任何事"""
+    return trace.profile_model(model) if trace is not None else nullcontext()
+
+
+def trace_span(trace: Optional[Trace], name: str, cat: str = "stage", **args):
+    return trace.span(name, cat, **args) if trace is not None else nullcontext()
+
+
+class TraceStore:
+    """
+    trace 保存目录,按文件数与总大小淘汰最旧的 trace
+
+    Args:
+        directory: 保存目录
+        max_traces: 最多保留的 trace 数
+        max_bytes: 总大小上限
+    """
+
+    def __init__(self, directory: str, max_traces: int = 100, max_bytes: int = 256 * 1024 ** 2):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_traces = max(1, max_traces)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._files: "OrderedDict[str, int]" = OrderedDict()  # trace ID -> 文件大小,按保存时间排序
+        self._bytes = 0
+        self.saved = 0
+        self._scan()
+
+    def _path(self, trace_id: str) -> Path:
+        return self.directory / f"{trace_id}.json"
+
+    def _scan(self):
+        """启动时登记目录中已有的 trace(按修改时间排序)"""
+        entries = []
+        for path in self.directory.glob("*.json"):
+            if is_valid_trace_id(path.stem):
+                stat = path.stat()
+                entries.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, trace_id, size in sorted(entries):
+            self._files[trace_id] = size
+            self._bytes += size
+        with self._lock:
+            self._evict()
+
+    def save(self, trace: Trace) -> str:
+        """写入 trace(在线程池中调用),返回 trace ID"""
+        data = json.dumps(trace.to_json(), ensure_ascii=False).encode("utf-8")
+        path = self._path(trace.trace_id)
+        tmp_path = path.with_suffix(".part")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._files[trace.trace_id] = len(data)
+            self._bytes += len(data)
+            self.saved += 1
+            self._evict(keep=trace.trace_id)
+        return trace.trace_id
+
+    def path(self, trace_id: str) -> Optional[Path]:
+        """trace 文件路径,不存在(或已被淘汰)时返回 None"""
+        with self._lock:
+            if trace_id not in self._files:
+                return None
+        return self._path(trace_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{"id": trace_id, "bytes": size} for trace_id, size in reversed(self._files.items())]
+
+    def _evict(self, keep: str = None):
+        """淘汰最旧的 trace(调用方持有锁)"""
+        for trace_id in list(self._files):
+            if len(self._files) <= self.max_traces and self._bytes <= self.max_bytes:
+                break
+            if trace_id == keep:
+                continue
+            self._bytes -= self._files.pop(trace_id)
+            self._path(trace_id).unlink(missing_ok=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "traces": len(self._files),
+                "bytes": self._bytes,
+                "max_traces": self.max_traces,
+                "max_bytes": self.max_bytes,
+                "saved": self.saved,
+            }
+
+
+class ProfilingPolicy:
+    """
+    决定哪些请求采集 trace
+
+    Args:
+        token: 授权令牌,请求头 X-Profile 与之相同时采集;为空时不接受按请求开启
+        sample_rate: 按比例抽样的请求比例(0~1)
+    """
+
+    def __init__(self, token: str = "", sample_rate: float = 0.0):
+        self.token = token
+        self.sample_rate = min(1.0, max(0.0, sample_rate))
+
+    @classmethod
+    def from_env(cls) -> "ProfilingPolicy":
+        return cls(
+            token=os.environ.get("PROFILE_TOKEN", ""),
+            sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", "0")),
+        )
+
+    def authorized(self, value: Optional[str]) -> bool:
+        return bool(self.token and value and hmac.compare_digest(value, self.token))
+
+    def decide(self, value: Optional[str]) -> Optional[str]:
+        """返回采集原因("requested" / "sampled"),不采集时返回 None"""
+        if self.authorized(value):
+            return "requested"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+
+def default_profile_dir() -> str:
+    return os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "inpaint-profiles"))
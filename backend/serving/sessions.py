@@ -0,0 +1,155 @@
+"""
+增量 Inpaint 会话
+服务端保存每个会话的最新结果,客户端之后只上传新笔画的遮罩(增量),
+只对新笔画周围的区域重新推理并合成回最新结果
+
+配置(环境变量):
+    INPAINT_SESSION_TTL        会话空闲过期时间(秒,默认 600)
+    INPAINT_SESSION_MAX_BYTES  所有会话图片占用内存上限,如 "1G"(默认 1G)
+    INPAINT_SESSION_MAX        最大会话数(默认 64)
+"""
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# 推理区域在笔画外接矩形基础上向外扩展的比例与最小像素数,给模型足够的上下文
+CONTEXT_RATIO = 0.5
+MIN_CONTEXT = 32
+
+# 合成时遮罩的膨胀半径与羽化半径(像素),避免笔画边缘留下接缝
+DILATE_RADIUS = 4
+FEATHER_RADIUS = 4
+
+
+class SessionNotFoundError(KeyError):
+    """会话不存在或已过期"""
+
+
+@dataclass
+class InpaintSession:
+    """单个会话:最新的 RGB 结果图"""
+    session_id: str
+    image: np.ndarray
+    created_at: float = field(default_factory=time.time)
+    last_access: float = field(default_factory=time.time)
+    strokes: int = 0
+    # 同一会话的笔画必须按顺序应用
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    @property
+    def nbytes(self) -> int:
+        return self.image.nbytes
+
+
+class SessionStore:
+    """
+    会话存储(LRU),按空闲时间、总内存与会话数淘汰
+
+    Args:
+        ttl: 空闲过期时间(秒)
+        max_bytes: 所有会话图片占用内存上限
+        max_sessions: 最大会话数
+    """
+
+    def __init__(self, ttl: float = 600, max_bytes: int = 1024 ** 3, max_sessions: int = 64):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, InpaintSession]" = OrderedDict()
+        self.total_bytes = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def create(self, image: np.ndarray) -> InpaintSession:
+        if image.nbytes > self.max_bytes:
+            raise MemoryError(f"图片过大,超过会话内存上限 {self.max_bytes / 1024 ** 2:.0f}MB")
+        session = InpaintSession(session_id=uuid.uuid4().hex, image=np.ascontiguousarray(image))
+        self._sessions[session.session_id] = session
+        self.total_bytes += session.nbytes
+        self._evict(keep=session.session_id)
+        return session
+
+    def get(self, session_id: str) -> InpaintSession:
+        self._expire()
+        session = self._sessions.get(session_id)
+        if session is None:
+            raise SessionNotFoundError(session_id)
+        session.last_access = time.time()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self.total_bytes -= session.nbytes
+        return True
+
+    def _expire(self):
+        deadline = time.time() - self.ttl
+        for session_id in [s.session_id for s in self._sessions.values() if s.last_access < deadline]:
+            self.delete(session_id)
+            self.expired += 1
+
+    def _evict(self, keep: str):
+        """淘汰最久未使用的会话,直到满足内存与数量上限(不淘汰 keep)"""
+        self._expire()
+        while (self.total_bytes > self.max_bytes or len(self._sessions) > self.max_sessions) \
+                and len(self._sessions) > 1:
+            oldest = next(iter(self._sessions))
+            if oldest == keep:
+                self._sessions.move_to_end(oldest)
+                oldest = next(iter(self._sessions))
+            self.delete(oldest)
+            self.evicted += 1
+
+    def stats(self) -> Dict[str, Any]:
+        self._expire()
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "evicted": self.evicted,
+            "expired": self.expired,
+        }
+
+
+def stroke_region(mask: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+    """
+    计算增量遮罩需要重新推理的区域 (x0, y0, x1, y1):笔画外接矩形向外扩展上下文
+    遮罩为空时返回 None
+    """
+    ys, xs = np.nonzero(mask > 0)
+    if len(xs) == 0:
+        return None
+    height, width = mask.shape[:2]
+    x0, x1 = int(xs.min()), int(xs.max()) + 1
+    y0, y1 = int(ys.min()), int(ys.max()) + 1
+    margin = max(MIN_CONTEXT, int(max(x1 - x0, y1 - y0) * CONTEXT_RATIO))
+    return (max(0, x0 - margin), max(0, y0 - margin), min(width, x1 + margin), min(height, y1 + margin))
+
+
+def composite(base: np.ndarray, patch: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """
+    将推理结果按(膨胀、羽化后的)遮罩合成到原区域上,遮罩外的像素保持不变
+
+    Args:
+        base: 原区域 RGB uint8
+        patch: 推理结果 RGB uint8,与 base 同尺寸
+        mask: 该区域的遮罩 uint8
+    """
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * DILATE_RADIUS + 1,) * 2)
+    alpha = cv2.dilate(mask, kernel).astype(np.float32) / 255.0
+    alpha = cv2.GaussianBlur(alpha, (2 * FEATHER_RADIUS + 1,) * 2, 0)
+    # 原遮罩内必须完全替换
+    alpha = np.maximum(alpha, (mask > 0).astype(np.float32))[:, :, None]
+    blended = base.astype(np.float32) * (1 - alpha) + patch.astype(np.float32) * alpha
+    return blended.round().astype(np.uint8)
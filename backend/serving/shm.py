@@ -0,0 +1,209 @@
+"""
+共享内存 ndarray 池
+在 HTTP 前端进程与推理 Worker 之间传递解码后的输入数组和模型输出,
+大图只做内存拷贝,不经过 pickle 序列化和管道传输
+
+- 前端进程持有 SharedArrayPool,负责分配、引用计数和回收
+- 每个 slot 是一个 multiprocessing.shared_memory 段,释放后按容量复用
+- 所有段的总大小受 max_bytes 限制,空间不足时 try_allocate 返回 None,
+  调用方回退到普通序列化
+- Worker 进程通过 ShmDescriptor 按名称挂载,用完即关闭(不 unlink)
+"""
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+_MB = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class ShmDescriptor:
+    """可跨进程传递的共享内存数组描述(段名、形状、dtype)"""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+
+def _round_size(nbytes: int) -> int:
+    """段大小取整,便于复用:64MB 以下按 2 的幂,以上按 16MB 对齐"""
+    if nbytes <= _MB:
+        return _MB
+    if nbytes <= 64 * _MB:
+        return 1 << (nbytes - 1).bit_length()
+    return (nbytes + 16 * _MB - 1) // (16 * _MB) * (16 * _MB)
+
+
+class SharedArray:
+    """
+    共享内存中的 ndarray(前端进程侧)
+    引用计数归零时段回到池中等待复用
+    """
+
+    def __init__(self, pool: "SharedArrayPool", segment: shared_memory.SharedMemory,
+                 shape: Tuple[int, ...], dtype):
+        self._pool = pool
+        self._segment = segment
+        self.shape = tuple(int(d) for d in shape)
+        self.dtype = np.dtype(dtype)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=segment.buf)
+        self._refcount = 1
+
+    @property
+    def descriptor(self) -> ShmDescriptor:
+        return ShmDescriptor(self._segment.name, self.shape, self.dtype.str)
+
+    def retain(self) -> "SharedArray":
+        with self._pool._cond:
+            if self._refcount <= 0:
+                raise RuntimeError("SharedArray 已释放")
+            self._refcount += 1
+        return self
+
+    def release(self):
+        with self._pool._cond:
+            if self._refcount <= 0:
+                return
+            self._refcount -= 1
+            if self._refcount == 0:
+                # 先丢弃本进程内的视图,段才能被复用或关闭
+                self.array = None
+                self._pool._recycle(self._segment)
+
+    def __enter__(self) -> np.ndarray:
+        return self.array
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SharedArrayPool:
+    """有总大小上限、按容量复用的共享内存段池"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._cond = threading.Condition()
+        self._free: List[shared_memory.SharedMemory] = []
+        self._in_use: Dict[str, shared_memory.SharedMemory] = {}
+        self._total_bytes = 0
+        self._allocations = 0
+        self._reuses = 0
+        self._fallbacks = 0
+
+    def try_allocate(self, shape: Tuple[int, ...], dtype=np.uint8) -> Optional[SharedArray]:
+        """
+        分配共享内存数组,空间不足时返回 None(调用方应回退到普通传输)
+        """
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with self._cond:
+            segment = self._take_free(nbytes)
+            if segment is None:
+                size = _round_size(nbytes)
+                self._evict_free(size)
+                if self._total_bytes + size > self.max_bytes:
+                    self._fallbacks += 1
+                    return None
+                segment = shared_memory.SharedMemory(create=True, size=size)
+                self._total_bytes += segment.size
+            else:
+                self._reuses += 1
+            self._allocations += 1
+            self._in_use[segment.name] = segment
+        return SharedArray(self, segment, shape, dtype)
+
+    def from_array(self, value: np.ndarray) -> Optional[SharedArray]:
+        """将数组拷贝到共享内存(一次 memcpy),空间不足时返回 None"""
+        shared = self.try_allocate(value.shape, value.dtype)
+        if shared is not None:
+            np.copyto(shared.array, value)
+        return shared
+
+    def _take_free(self, nbytes: int) -> Optional[shared_memory.SharedMemory]:
+        fitting = [s for s in self._free if s.size >= nbytes and s.size <= 2 * _round_size(nbytes)]
+        if not fitting:
+            return None
+        segment = min(fitting, key=lambda s: s.size)
+        self._free.remove(segment)
+        return segment
+
+    def _evict_free(self, needed: int):
+        """释放空闲段,直到新段可以放入总大小上限"""
+        self._free.sort(key=lambda s: s.size, reverse=True)
+        while self._free and self._total_bytes + needed > self.max_bytes:
+            self._destroy(self._free.pop())
+
+    def _destroy(self, segment: shared_memory.SharedMemory):
+        self._total_bytes -= segment.size
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+        try:
+            segment.close()
+        except BufferError:
+            pass  # 仍有视图引用该段,映射随视图回收
+
+    def _recycle(self, segment: shared_memory.SharedMemory):
+        # 调用方已持有 self._cond
+        self._in_use.pop(segment.name, None)
+        self._free.append(segment)
+        self._cond.notify_all()
+
+    def close(self):
+        """关闭并删除所有共享内存段"""
+        with self._cond:
+            for segment in self._free + list(self._in_use.values()):
+                self._destroy(segment)
+            self._free.clear()
+            self._in_use.clear()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "max_bytes": self.max_bytes,
+                "total_bytes": self._total_bytes,
+                "in_use_segments": len(self._in_use),
+                "free_segments": len(self._free),
+                "allocations": self._allocations,
+                "reuses": self._reuses,
+                "fallbacks": self._fallbacks,
+            }
+
+
+@contextmanager
+def attach(descriptor: ShmDescriptor):
+    """
+    在 Worker 进程中按描述挂载共享内存数组
+    退出时只关闭映射,段的生命周期由前端进程的池管理
+    """
+    # Worker 由 spawn 启动,与前端进程共用 resource_tracker,挂载不会导致段被提前删除
+    segment = shared_memory.SharedMemory(name=descriptor.name)
+    array = np.ndarray(descriptor.shape, dtype=np.dtype(descriptor.dtype), buffer=segment.buf)
+    try:
+        yield array
+    finally:
+        del array
+        try:
+            segment.close()
+        except BufferError:
+            pass  # 异常路径上仍有视图存活,映射随垃圾回收释放
+
+
+@contextmanager
+def borrow(value):
+    """
+    以 ndarray 形式使用结果:若为 SharedArray,退出时释放引用
+    (退出后段可能被复用,期间创建的零拷贝视图不能继续使用)
+    """
+    if isinstance(value, SharedArray):
+        with value as array:
+            yield array
+    else:
+        yield value
@@ -0,0 +1,245 @@
+"""
+按内容寻址的上传存储
+客户端用 SHA-256 作为键 HEAD / PUT 一次图片,之后的请求只传哈希,不再重复上传。
+原始字节保存在磁盘(按总大小淘汰最久未使用的文件),解码后的图片保存在
+按字节预算淘汰的 LRU 缓存中,同一张图片重复编辑时不需要重复解码
+
+配置(环境变量):
+    UPLOAD_DIR          上传文件目录(默认 系统临时目录/inpaint-uploads)
+    UPLOAD_MAX_BYTES    磁盘上上传文件总大小上限,如 "2G"(默认 2G)
+    UPLOAD_CACHE_BYTES  解码后图片的内存缓存上限,如 "1G"(默认 1G)
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple
+
+from PIL import Image
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class UploadNotFoundError(KeyError):
+    """哈希对应的上传不存在(未上传或已被淘汰)"""
+
+
+class DigestMismatchError(ValueError):
+    """上传内容的 SHA-256 与声明的哈希不一致"""
+
+
+def is_valid_digest(digest: str) -> bool:
+    return bool(_DIGEST_RE.match(digest))
+
+
+class UploadStore:
+    """
+    上传存储
+
+    Args:
+        directory: 上传文件目录
+        max_bytes: 磁盘上上传文件总大小上限
+        cache_bytes: 解码后图片的 LRU 缓存字节预算
+        decoder: 解码函数 (bytes, mode) -> PIL Image
+    """
+
+    def __init__(self, directory: str, max_bytes: int, cache_bytes: int,
+                 decoder: Callable[[bytes, str], Image.Image]):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.cache_bytes = cache_bytes
+        self.decoder = decoder
+        # 解码缓存在解码线程池中访问,需要加锁
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, str], Image.Image]" = OrderedDict()
+        self._cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._files: "OrderedDict[str, int]" = OrderedDict()  # 哈希 -> 文件大小,按最近使用排序
+        self._disk_bytes = 0
+        self._scan()
+
+    def _path(self, digest: str) -> Path:
+        return self.directory / digest
+
+    def _scan(self):
+        """启动时登记目录中已有的上传文件(按修改时间排序)"""
+        entries = []
+        for path in self.directory.iterdir():
+            if path.is_file() and is_valid_digest(path.name):
+                stat = path.stat()
+                entries.append((stat.st_mtime, path.name, stat.st_size))
+            elif path.suffix == ".part":
+                path.unlink(missing_ok=True)
+        for _, digest, size in sorted(entries):
+            self._files[digest] = size
+            self._disk_bytes += size
+        self._evict_files()
+
+    def contains(self, digest: str) -> bool:
+        with self._lock:
+            if digest not in self._files:
+                return False
+            self._files.move_to_end(digest)
+            return True
+
+    def size(self, digest: str) -> int:
+        with self._lock:
+            if digest not in self._files:
+                raise UploadNotFoundError(digest)
+            return self._files[digest]
+
+    def image_pixels(self, digest: str) -> int:
+        """图片像素数(只读取文件头),无法识别时返回 0"""
+        if not self.contains(digest):
+            raise UploadNotFoundError(digest)
+        try:
+            with Image.open(self._path(digest)) as image:
+                return image.size[0] * image.size[1]
+        except FileNotFoundError:
+            raise UploadNotFoundError(digest)
+        except Exception:
+            return 0
+
+    def put(self, digest: str, data: bytes) -> bool:
+        """
+        保存上传内容,校验 SHA-256
+
+        Returns:
+            True 表示新保存,False 表示已存在
+        """
+        upload = self.begin(digest)
+        try:
+            upload.write(data)
+            return upload.commit()
+        finally:
+            upload.abort()
+
+    def begin(self, digest: str) -> "PendingUpload":
+        """开始一次流式上传,调用方逐块 write,最后 commit(失败时 abort)"""
+        return PendingUpload(self, digest)
+
+    def _commit(self, digest: str, tmp_path: Path, size: int) -> bool:
+        if self.contains(digest):
+            return False
+        os.replace(tmp_path, self._path(digest))
+        with self._lock:
+            if digest not in self._files:
+                self._files[digest] = size
+                self._disk_bytes += size
+            self._evict_files(keep=digest)
+        return True
+
+    def read(self, digest: str) -> bytes:
+        if not self.contains(digest):
+            raise UploadNotFoundError(digest)
+        try:
+            data = self._path(digest).read_bytes()
+        except FileNotFoundError:
+            raise UploadNotFoundError(digest)
+        os.utime(self._path(digest))
+        return data
+
+    def load_image(self, digest: str, mode: str = "RGB") -> Image.Image:
+        """
+        读取并解码图片,结果缓存在 LRU 中
+        返回的图片与缓存共享,调用方不能原地修改
+        """
+        key = (digest, mode)
+        with self._lock:
+            image = self._cache.get(key)
+            if image is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return image
+            self.misses += 1
+
+        image = self.decoder(self.read(digest), mode)
+        nbytes = image.size[0] * image.size[1] * len(image.getbands())
+        if nbytes <= self.cache_bytes:
+            with self._lock:
+                if key not in self._cache:
+                    self._cache[key] = image
+                    self._cached_bytes += nbytes
+                while self._cached_bytes > self.cache_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cached_bytes -= evicted.size[0] * evicted.size[1] * len(evicted.getbands())
+        return image
+
+    def _evict_files(self, keep: str = None):
+        """淘汰最久未使用的上传文件,直到满足磁盘上限(调用方持有锁或在初始化中)"""
+        for digest in list(self._files):
+            if self._disk_bytes <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            self._disk_bytes -= self._files.pop(digest)
+            self._path(digest).unlink(missing_ok=True)
+            for mode_key in [k for k in self._cache if k[0] == digest]:
+                image = self._cache.pop(mode_key)
+                self._cached_bytes -= image.size[0] * image.size[1] * len(image.getbands())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "files": len(self._files),
+                "disk_bytes": self._disk_bytes,
+                "max_bytes": self.max_bytes,
+                "cached_images": len(self._cache),
+                "cache_bytes": self._cached_bytes,
+                "max_cache_bytes": self.cache_bytes,
+                "cache_hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+class PendingUpload:
+    """
+    写入中的上传:边接收边写临时文件并计算 SHA-256,超过存储上限时立即报错,
+    请求体不需要整体读入内存。commit 时校验哈希并原子替换为正式文件,
+    避免并发读取到不完整的文件
+    """
+
+    def __init__(self, store: UploadStore, digest: str):
+        self.store = store
+        self.digest = digest
+        self.size = 0
+        self.path = store._path(digest).with_name(f"{digest}.{os.getpid()}.{id(self)}.part")
+        self._hash = hashlib.sha256()
+        self._file = open(self.path, "wb")
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > self.store.max_bytes:
+            raise MemoryError(f"文件超过上传存储上限 {self.store.max_bytes / 1024 ** 2:.0f}MB")
+        self._hash.update(data)
+        self._file.write(data)
+
+    def close(self):
+        """写入完成,之后可以从 path 读取已接收的内容"""
+        self._file.close()
+
+    def commit(self) -> bool:
+        """
+        校验哈希并保存
+
+        Returns:
+            True 表示新保存,False 表示已存在
+        """
+        self.close()
+        if self._hash.hexdigest() != self.digest:
+            raise DigestMismatchError("上传内容的 SHA-256 与 URL 中的哈希不一致")
+        return self.store._commit(self.digest, self.path, self.size)
+
+    def abort(self):
+        """关闭并删除临时文件(commit 成功后调用无副作用)"""
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+
+def default_upload_dir() -> str:
+    return os.environ.get("UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "inpaint-uploads"))
@@ -0,0 +1,609 @@
+"""
+多进程推理 Worker 池
+每个 Worker 是独立的 Python 进程(独立 GIL、独立模型实例),可绑定到指定
+CUDA 设备或 CPU 核心集合。前端进程只负责 HTTP、解码和编码,推理请求按
+负载和内存容量路由到 Worker
+
+配置(环境变量,也可通过 api_server.py 命令行参数设置):
+    INPAINT_WORKERS          Worker 数量,0 表示在前端进程内推理(默认)
+    INPAINT_WORKER_DEVICES   设备列表,逗号分隔并循环使用,如 "cuda:0,cuda:1" 或 "cpu"
+    INPAINT_WORKER_CPUSETS   CPU 核心集合,分号分隔,如 "0-3;4-7"
+    INPAINT_WORKER_MEMORY    每个 Worker 的内存容量,逗号分隔,如 "8G,8G"(默认自动探测)
+    INPAINT_SHM_BYTES        前端与 Worker 间共享内存池上限,如 "2G",0 表示禁用(默认 2G)
+"""
+import asyncio
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import traceback
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .canvas import DiskCanvas, release_rows
+from .degradation import TIER_FAST, DegradationPolicy
+from .profiling import Trace, profile_model, trace_span
+from .shm import SharedArrayPool, ShmDescriptor, attach
+
+# 每个输入像素的估算峰值内存(字节),用于按内存容量路由
+# upscale: 4x 输出的 float32 中间结果 + uint8 输出 + PIL 副本
+# inpaint: 输入 / 遮罩 / 输出及 OpenCV 中间结果
+BYTES_PER_PIXEL = {
+    "upscale": 320,
+    "inpaint": 64,
+}
+# 大图模式的超分输出写入磁盘画布,只需输入(及填充副本)和瓦片工作集
+LARGE_UPSCALE_BYTES_PER_PIXEL = 8
+
+# 小于该大小的数组直接随任务序列化,不值得占用共享内存段
+SHM_MIN_BYTES = 256 * 1024
+
+# Worker 已将结果写入前端预分配的共享内存输出段
+_SHM_RESULT = "__shm_result__"
+
+# 检查 Worker 进程是否存活的间隔(秒),与结果队列是否繁忙无关
+WORKER_CHECK_INTERVAL = 0.5
+
+
+class _TaskCancelled(Exception):
+    """Worker 内部:当前任务已被前端取消"""
+
+
+class NoCapableWorkerError(RuntimeError):
+    """没有内存容量足够的 Worker 可以处理该请求"""
+
+
+class WorkerCrashedError(RuntimeError):
+    """Worker 进程在处理请求期间退出"""
+
+
+@dataclass
+class WorkerSpec:
+    """单个 Worker 的配置"""
+    index: int
+    device: str = "cpu"  # 'cpu' / 'cuda' / 'cuda:N' / 'mps' / 'auto'
+    cpu_set: Optional[List[int]] = None
+    memory_bytes: Optional[int] = None  # 覆盖自动探测的内存容量
+
+
+def parse_cpu_sets(spec: str) -> List[List[int]]:
+    """
+    解析 CPU 核心集合,如 "0-3;4-7" -> [[0, 1, 2, 3], [4, 5, 6, 7]]
+    """
+    cpu_sets = []
+    for group in spec.split(";"):
+        group = group.strip()
+        if not group:
+            continue
+        cores = []
+        for part in group.split(","):
+            start, _, end = part.partition("-")
+            cores.extend(range(int(start), int(end or start) + 1))
+        cpu_sets.append(cores)
+    return cpu_sets
+
+
+def parse_size(value: str) -> int:
+    """解析内存大小,如 "8G" / "512M" / "1073741824" -> 字节"""
+    value = value.strip().upper()
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def build_worker_specs(
+    num_workers: int,
+    devices: str = "",
+    cpu_sets: str = "",
+    memory: str = ""
+) -> List[WorkerSpec]:
+    """
+    根据配置字符串生成 Worker 配置列表(设备 / 核心集合 / 内存按顺序循环分配)
+    """
+    device_list = [d.strip() for d in devices.split(",") if d.strip()] or ["auto"]
+    cpu_set_list = parse_cpu_sets(cpu_sets) if cpu_sets else []
+    memory_list = [parse_size(m) for m in memory.split(",") if m.strip()] if memory else []
+
+    specs = []
+    for index in range(num_workers):
+        specs.append(WorkerSpec(
+            index=index,
+            device=device_list[index % len(device_list)],
+            cpu_set=cpu_set_list[index % len(cpu_set_list)] if cpu_set_list else None,
+            memory_bytes=memory_list[index % len(memory_list)] if memory_list else None,
+        ))
+    return specs
+
+
+def _system_memory_bytes() -> Optional[int]:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _worker_main(spec: WorkerSpec, num_workers: int, task_queue, result_queue, cancel_queue):
+    """
+    Worker 进程入口
+    必须在导入 torch / 模型之前设置设备可见性和 CPU 亲和性
+    """
+    if spec.device.startswith("cuda:"):
+        os.environ["CUDA_VISIBLE_DEVICES"] = spec.device.split(":", 1)[1]
+    elif spec.device == "cpu":
+        os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+    if spec.cpu_set:
+        try:
+            os.sched_setaffinity(0, spec.cpu_set)
+        except (AttributeError, OSError) as e:
+            print(f"⚠️  Worker {spec.index} 无法绑定 CPU 核心 {spec.cpu_set}: {e}")
+        os.environ["OMP_NUM_THREADS"] = str(len(spec.cpu_set))
+
+    try:
+        from models import get_model, get_inpaint_model, get_fast_model, get_plans, DeviceDetector
+
+        if spec.cpu_set:
+            try:
+                import torch
+                torch.set_num_threads(len(spec.cpu_set))
+            except ImportError:
+                pass
+
+        device_info = DeviceDetector.get_device_info()
+        models = {"upscale": get_model()}
+        try:
+            models["inpaint"] = get_inpaint_model()
+        except Exception as e:
+            print(f"⚠️  Worker {spec.index} Inpaint 模型不可用: {e}")
+        if DegradationPolicy.from_env().enabled:
+            # 降级档位的轻量模型以 "upscale:fast" 形式登记,随 ops 上报给服务进程
+            for op in list(models):
+                try:
+                    models[f"{op}:{TIER_FAST}"] = get_fast_model(op)
+                except Exception as e:
+                    print(f"⚠️  Worker {spec.index} {op} 降级模型不可用: {e}")
+
+        memory_bytes = spec.memory_bytes
+        if memory_bytes is None:
+            if device_info["type"] == "cuda" and device_info.get("torch_version"):
+                import torch
+                memory_bytes = torch.cuda.get_device_properties(0).total_memory
+            else:
+                total = _system_memory_bytes()
+                memory_bytes = total // max(num_workers, 1) if total else None
+
+        result_queue.put(("ready", spec.index, {
+            "pid": os.getpid(),
+            "device": device_info,
+            "ops": sorted(models.keys()),
+            "memory_bytes": memory_bytes,
+            "plans": get_plans(),
+        }))
+    except Exception as e:
+        traceback.print_exc()
+        result_queue.put(("failed", spec.index, f"{type(e).__name__}: {e}"))
+        return
+
+    # 前端取消的任务 ID;任务按提交顺序执行,比当前任务早的 ID 不会再用到
+    cancelled = set()
+
+    def drain_cancelled():
+        while True:
+            try:
+                cancelled.add(cancel_queue.get_nowait())
+            except queue.Empty:
+                return
+
+    while True:
+        message = task_queue.get()
+        if message is None:
+            break
+        task_id, op, payload = message
+        drain_cancelled()
+        cancelled = {i for i in cancelled if i >= task_id}
+
+        def cancel_check():
+            drain_cancelled()
+            if task_id in cancelled:
+                raise _TaskCancelled()
+
+        try:
+            cancel_check()  # 排队期间已取消的任务直接跳过
+            value = _run_task(models, op, payload, cancel_check)
+            result_queue.put(("result", spec.index, task_id, True, value))
+        except _TaskCancelled:
+            result_queue.put(("cancelled", spec.index, task_id))
+        except Exception as e:
+            traceback.print_exc()
+            result_queue.put(("result", spec.index, task_id, False, f"{type(e).__name__}: {e}"))
+
+
+def _run_task(models: Dict[str, Any], op: str, payload: Dict[str, Any], cancel_check=None):
+    """
+    在 Worker 进程内执行一次推理,输入输出均为 RGB uint8 数组
+    payload 中的 ShmDescriptor 挂载为共享内存数组;若提供了 'out' 输出段且形状匹配,
+    结果直接写入共享内存并以 _SHM_RESULT 代替
+
+    Returns:
+        (结果, 附加信息),附加信息如人脸增强统计
+    """
+    with ExitStack() as stack:
+        arrays = {
+            key: stack.enter_context(attach(value)) if isinstance(value, ShmDescriptor) else value
+            for key, value in payload.items()
+        }
+        output, meta = _infer(models, op, arrays, cancel_check)
+        out = arrays.get("out")
+        if out is not None and out.shape == output.shape:
+            np.copyto(out, output)
+            del out, arrays
+            return _SHM_RESULT, meta
+        del out, arrays
+        return output, meta
+
+
+def _infer(models: Dict[str, Any], op: str, arrays: Dict[str, Any],
+           cancel_check=None) -> Tuple[np.ndarray, Dict[str, Any]]:
+    from PIL import Image
+
+    if op not in models:
+        raise RuntimeError(f"Worker 未加载 {op} 模型")
+
+    # 请求要求性能剖析时在 Worker 内记录推理区间与瓦片,随结果返回给服务进程合并
+    trace = Trace("worker") if arrays.get("profile") else None
+    meta: Dict[str, Any] = {}
+    # 降级档位使用轻量模型(未加载时使用默认模型)
+    model = models[op]
+    if arrays.get("tier") == TIER_FAST and f"{op}:{TIER_FAST}" in models:
+        model = models[f"{op}:{TIER_FAST}"]
+
+    if op == "upscale" and arrays.get("canvas"):
+        # 大图模式:结果直接写入服务进程创建的磁盘画布,写完的行刷盘并释放
+        out = DiskCanvas.open(arrays["canvas"])
+        with trace_span(trace, "upscale", "model"), profile_model(trace, model):
+            model.enhance_to(
+                arrays["image"], out, cancel_check=cancel_check,
+                on_tile=trace.on_tile if trace is not None else None,
+                on_rows=lambda y0, y1: release_rows(out, y0, y1)
+            )
+        out.flush()
+        del out
+        output = None
+    elif op == "upscale":
+        # .copy() 确保 PIL 图像不引用共享内存(L 模式的 fromarray 是零拷贝映射)
+        image = Image.fromarray(arrays["image"]).copy()
+        with trace_span(trace, "upscale", "model"), profile_model(trace, model):
+            output = np.asarray(model.enhance(
+                image, outscale=arrays.get("scale", 4), cancel_check=cancel_check,
+                on_tile=trace.on_tile if trace is not None else None, roi=arrays.get("roi")
+            ))
+        if arrays.get("face_enhance"):
+            from models import enhance_faces
+            if cancel_check is not None:
+                cancel_check()
+            original = arrays["image"]
+            if arrays.get("roi") is not None:
+                x, y, w, h = arrays["roi"]
+                original = original[y:y + h, x:x + w]
+            with trace_span(trace, "face_enhance", "model"):
+                output, meta["face"] = enhance_faces(original, output)
+    elif op == "inpaint":
+        image = Image.fromarray(arrays["image"]).copy()
+        mask = Image.fromarray(arrays["mask"]).copy()
+        with trace_span(trace, "inpaint", "model"), profile_model(trace, model):
+            output = np.asarray(model.inpaint(image, mask))
+    else:
+        raise ValueError(f"未知操作: {op}")
+
+    if op == "upscale":
+        # 瓦片缓存在 Worker 进程内,随结果带回最新统计
+        tile_cache = model.get_info().get("tile_cache")
+        if tile_cache is not None:
+            meta["tile_cache"] = tile_cache
+    if trace is not None:
+        meta["trace"] = trace.events
+    return output, meta
+
+
+@dataclass
+class _WorkerHandle:
+    spec: WorkerSpec
+    process: Any = None
+    task_queue: Any = None
+    cancel_queue: Any = None
+    ready: bool = False
+    info: Dict[str, Any] = field(default_factory=dict)
+    inflight: Dict[int, int] = field(default_factory=dict)  # task_id -> 估算内存占用
+    completed: int = 0
+    failed: int = 0
+    cancelled: int = 0
+    restarts: int = 0
+    tile_cache: Optional[Dict[str, Any]] = None  # 最近一次超分返回的瓦片缓存统计
+
+    @property
+    def pending_cost(self) -> int:
+        return sum(self.inflight.values())
+
+    @property
+    def capacity_bytes(self) -> Optional[int]:
+        return self.info.get("memory_bytes")
+
+
+class WorkerPool:
+    """
+    推理 Worker 池
+    请求路由到内存容量足够、且未完成任务估算开销最小的 Worker
+    """
+
+    def __init__(self, specs: List[WorkerSpec], shm_pool: Optional[SharedArrayPool] = None,
+                 start_timeout: float = 600.0):
+        self._ctx = mp.get_context("spawn")
+        self.shm_pool = shm_pool
+        self._result_queue = self._ctx.Queue()
+        self._workers = [_WorkerHandle(spec=spec) for spec in specs]
+        self._futures: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._stopping = False
+        self._reader = None
+        self.start_timeout = start_timeout
+
+    def _spawn(self, handle: _WorkerHandle):
+        handle.ready = False
+        handle.info = {}
+        handle.task_queue = self._ctx.Queue()
+        handle.cancel_queue = self._ctx.Queue()
+        handle.process = self._ctx.Process(
+            target=_worker_main,
+            args=(handle.spec, len(self._workers), handle.task_queue, self._result_queue, handle.cancel_queue),
+            name=f"inference-worker-{handle.spec.index}",
+            daemon=True,
+        )
+        handle.process.start()
+
+    def start(self):
+        """启动所有 Worker 进程和结果读取线程"""
+        for handle in self._workers:
+            self._spawn(handle)
+        self._reader = threading.Thread(target=self._read_results, name="worker-results", daemon=True)
+        self._reader.start()
+
+    async def wait_ready(self):
+        """等待至少一个 Worker 加载完模型"""
+        deadline = time.monotonic() + self.start_timeout
+        while time.monotonic() < deadline:
+            if any(w.ready for w in self._workers):
+                return
+            if all(w.process is not None and not w.process.is_alive() for w in self._workers):
+                raise RuntimeError("所有 Worker 均启动失败")
+            await asyncio.sleep(0.2)
+        raise TimeoutError(f"Worker 在 {self.start_timeout:.0f} 秒内未就绪")
+
+    def shutdown(self):
+        """停止所有 Worker"""
+        self._stopping = True
+        for handle in self._workers:
+            if handle.process is not None and handle.process.is_alive():
+                handle.task_queue.put(None)
+        for handle in self._workers:
+            if handle.process is not None:
+                handle.process.join(timeout=10)
+                if handle.process.is_alive():
+                    handle.process.terminate()
+        self._fail_all(WorkerCrashedError("Worker 池已关闭"))
+
+    def _select_worker(self, op: str, need: int) -> _WorkerHandle:
+        candidates = [
+            w for w in self._workers
+            if w.ready and op in w.info.get("ops", []) and w.process.is_alive()
+        ]
+        if not candidates:
+            raise RuntimeError(f"没有可处理 {op} 的 Worker")
+
+        capable = [w for w in candidates if w.capacity_bytes is None or w.capacity_bytes >= need]
+        if not capable:
+            largest = max(w.capacity_bytes for w in candidates)
+            raise NoCapableWorkerError(
+                f"图片过大: 预计需要 {need / 1024 ** 3:.1f}GB 内存,"
+                f"Worker 最大容量 {largest / 1024 ** 3:.1f}GB"
+            )
+        return min(capable, key=lambda w: (w.pending_cost, len(w.inflight), w.spec.index))
+
+    def _to_wire(self, payload: Dict[str, Any], output_shape: Optional[Tuple[int, ...]]):
+        """
+        大数组放入共享内存,其余参数随任务序列化;共享内存不足时回退到序列化
+        出错时释放已分配的共享内存段
+        """
+        wire, inputs, output = {}, [], None
+        try:
+            for key, value in payload.items():
+                if self.shm_pool is not None and isinstance(value, np.ndarray) and value.nbytes >= SHM_MIN_BYTES:
+                    shared = self.shm_pool.from_array(value)
+                    if shared is not None:
+                        inputs.append(shared)
+                        wire[key] = shared.descriptor
+                        continue
+                wire[key] = value
+            if self.shm_pool is not None and output_shape is not None \
+                    and int(np.prod(output_shape)) >= SHM_MIN_BYTES:
+                output = self.shm_pool.try_allocate(output_shape, np.uint8)
+                if output is not None:
+                    wire["out"] = output.descriptor
+        except BaseException:
+            for shared in inputs:
+                shared.release()
+            raise
+        return wire, inputs, output
+
+    async def run(self, op: str, payload: Dict[str, Any], pixels: int,
+                  output_shape: Optional[Tuple[int, ...]] = None, memory_bytes: Optional[int] = None):
+        """
+        提交推理任务并等待结果
+
+        Args:
+            op: 'upscale' 或 'inpaint'
+            payload: 任务参数(numpy 数组等可序列化对象)
+            pixels: 输入像素数,用于路由和负载估算
+            output_shape: 预期输出形状,提供时在共享内存中预分配输出段
+            memory_bytes: 预计内存占用,默认按 pixels 与 BYTES_PER_PIXEL 估算
+
+        Returns:
+            (结果, Worker 信息及附加信息);结果可能是 SharedArray,需用 shm.borrow() 使用并释放
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if memory_bytes is None:
+            memory_bytes = pixels * BYTES_PER_PIXEL.get(op, 0)
+        wire, inputs, output = self._to_wire(payload, output_shape)
+        try:
+            with self._lock:
+                handle = self._select_worker(op, memory_bytes)
+                task_id = next(self._task_ids)
+                handle.inflight[task_id] = memory_bytes
+                self._futures[task_id] = (future, loop, handle, inputs, output)
+        except BaseException:
+            for shared in inputs + ([output] if output is not None else []):
+                shared.release()
+            raise
+        handle.task_queue.put((task_id, op, wire))
+        try:
+            value, meta = await future
+        except asyncio.CancelledError:
+            # 调用方已取消(客户端断开等):通知 Worker 在下一个瓦片之前停止
+            with self._lock:
+                pending = task_id in self._futures
+            if pending:
+                handle.cancel_queue.put(task_id)
+            raise
+        return value, {
+            "worker": handle.spec.index,
+            "device": handle.info.get("device", {}).get("type", handle.spec.device),
+            **meta,
+        }
+
+    def _resolve(self, task_id: int, ok: bool, value, cancelled: bool = False):
+        with self._lock:
+            entry = self._futures.pop(task_id, None)
+            if entry is None:
+                return
+            future, loop, handle, inputs, output = entry
+            handle.inflight.pop(task_id, None)
+            if ok:
+                handle.completed += 1
+            elif cancelled:
+                handle.cancelled += 1
+            else:
+                handle.failed += 1
+
+        # Worker 已读完输入,输入段可以回收
+        for shared in inputs:
+            shared.release()
+        meta = {}
+        if ok:
+            value, meta = value
+            if "tile_cache" in meta:
+                handle.tile_cache = meta.pop("tile_cache")
+        if ok and isinstance(value, str) and value == _SHM_RESULT:
+            value = output  # 输出段的所有权转交给调用方
+        elif output is not None:
+            output.release()
+            output = None
+
+        def _set():
+            if future.done():
+                # 请求已取消,没有调用方会释放输出段
+                if output is not None:
+                    output.release()
+                return
+            if ok:
+                future.set_result((value, meta))
+            else:
+                future.set_exception(value if isinstance(value, Exception) else RuntimeError(value))
+
+        try:
+            loop.call_soon_threadsafe(_set)
+        except RuntimeError:
+            # 事件循环已关闭
+            if output is not None:
+                output.release()
+
+    def _fail_all(self, error: Exception, handle: Optional[_WorkerHandle] = None):
+        with self._lock:
+            task_ids = [
+                task_id for task_id, entry in self._futures.items()
+                if handle is None or entry[2] is handle
+            ]
+        for task_id in task_ids:
+            self._resolve(task_id, False, error)
+
+    def _read_results(self):
+        next_check = time.monotonic() + WORKER_CHECK_INTERVAL
+        while not self._stopping:
+            # 按固定间隔检查 Worker 是否存活:结果队列一直有消息时也要发现崩溃的 Worker
+            if time.monotonic() >= next_check:
+                self._check_workers()
+                next_check = time.monotonic() + WORKER_CHECK_INTERVAL
+            try:
+                message = self._result_queue.get(timeout=WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+
+            kind, index = message[0], message[1]
+            handle = self._workers[index]
+            if kind == "ready":
+                handle.info = message[2]
+                handle.ready = True
+                device = handle.info["device"]
+                print(f"✓ Worker {index} 就绪 (pid={handle.info['pid']}, "
+                      f"设备={device['type']}:{device['name']}, 功能={handle.info['ops']})")
+            elif kind == "failed":
+                print(f"❌ Worker {index} 启动失败: {message[2]}")
+            elif kind == "result":
+                _, _, task_id, ok, value = message
+                self._resolve(task_id, ok, value)
+            elif kind == "cancelled":
+                self._resolve(message[2], False, "任务已取消", cancelled=True)
+
+    def _check_workers(self):
+        """检测崩溃的 Worker:让其未完成的请求失败并重启进程"""
+        for handle in self._workers:
+            if self._stopping or handle.process is None or handle.process.is_alive():
+                continue
+            if not handle.ready:
+                continue  # 启动失败的 Worker 不自动重启,避免循环崩溃
+            print(f"⚠️  Worker {handle.spec.index} 已退出 (exitcode={handle.process.exitcode}),正在重启...")
+            self._fail_all(WorkerCrashedError(f"Worker {handle.spec.index} 异常退出"), handle)
+            handle.restarts += 1
+            self._spawn(handle)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """各 Worker 的状态(用于 /api/info)"""
+        with self._lock:
+            return [
+                {
+                    "index": w.spec.index,
+                    "device": w.spec.device,
+                    "cpu_set": w.spec.cpu_set,
+                    "ready": w.ready,
+                    "alive": w.process is not None and w.process.is_alive(),
+                    "pid": w.info.get("pid"),
+                    "ops": w.info.get("ops", []),
+                    "memory_bytes": w.capacity_bytes,
+                    "plans": w.info.get("plans", {}),
+                    "inflight": len(w.inflight),
+                    "completed": w.completed,
+                    "failed": w.failed,
+                    "cancelled": w.cancelled,
+                    "restarts": w.restarts,
+                    "tile_cache": w.tile_cache,
+                }
+                for w in self._workers
+            ]
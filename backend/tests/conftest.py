@@ -0,0 +1,10 @@
+"""
+后端测试:使用 Mock 模型,在只有 CPU、没有模型权重的环境中运行
+
+    cd backend && python -m pytest tests
+"""
+import os
+import sys
+
+os.environ.setdefault("INPAINT_MOCK_MODELS", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+import api_server
+from serving.admission import AdmissionController, CostModel
+from serving.cancel import CancelToken, RequestCancelled
+
+
+def _controller(max_active: int = 2) -> AdmissionController:
+    return AdmissionController(CostModel({"upscale": "cpu"}), max_active=max_active)
+
+
+def test_withdraw_queued_and_dispatched():
+    async def main():
+        controller = _controller(max_active=1)
+        dispatched = controller.submit("a", "upscale", 1000)
+        queued = controller.submit("a", "upscale", 1000)
+        assert controller.stats()["active"] == 1 and controller.stats()["queued"] == 1
+
+        controller.withdraw(queued)
+        controller.withdraw(queued)  # 可重复调用
+        assert controller.stats()["queued"] == 0
+        controller.withdraw(dispatched)
+        stats = controller.stats()
+        assert stats["active"] == 0 and stats["clients"] == 0
+
+    asyncio.run(main())
+
+
+def test_run_admitted_cancelled_before_start(monkeypatch):
+    """已取消的请求(批量任务的剩余项、已断开的客户端)不能占住执行位"""
+    async def main():
+        controller = _controller(max_active=2)
+        monkeypatch.setattr(api_server, "admission", controller)
+
+        # 调用 run_admitted 之前已取消
+        for _ in range(3):
+            ticket = controller.submit("a", "upscale", 1000)
+            token = CancelToken()
+            token.cancel("disconnect")
+            with pytest.raises(RequestCancelled):
+                await api_server.run_admitted(ticket, "upscale", token)
+
+        # 推理任务执行第一步之前被取消
+        for _ in range(3):
+            ticket = controller.submit("a", "upscale", 1000)
+            token = CancelToken()
+            task = asyncio.ensure_future(api_server.run_admitted(ticket, "upscale", token))
+            asyncio.get_running_loop().call_soon(token.cancel, "disconnect")
+            with pytest.raises(RequestCancelled):
+                await task
+
+        stats = controller.stats()
+        assert stats["active"] == 0
+        assert stats["queued"] == 0
+        assert stats["clients"] == 0
+        # 之后的请求仍能被放行
+        ticket = controller.submit("a", "upscale", 1000)
+        async with controller.admitted(ticket):
+            pass
+
+    asyncio.run(main())
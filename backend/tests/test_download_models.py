@@ -0,0 +1,101 @@
+"""download_models:本地 http.server 代替模型下载地址,覆盖断点续传与校验失败"""
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+import download_models
+from download_models import ChecksumMismatchError, download_all, download_file
+
+CONTENT = bytes(range(256)) * 4096  # 1MB
+DIGEST = hashlib.sha256(CONTENT).hexdigest()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """支持 Range 的静态文件服务;drop_after 设置时第一次请求只发送部分内容后断开"""
+    files = {}
+    ranges = []
+    drop_after = None
+
+    def do_GET(self):
+        data = self.files.get(self.path.lstrip("/"))
+        if data is None:
+            self.send_error(404)
+            return
+        header = self.headers.get("Range")
+        self.ranges.append(header)
+        start = int(header.split("=")[1].rstrip("-")) if header else 0
+        if start >= len(data):
+            self.send_error(416)
+            return
+        self.send_response(206 if header else 200)
+        self.send_header("Content-Length", str(len(data) - start))
+        self.end_headers()
+        body = data[start:]
+        if self.drop_after is not None:
+            body = body[:self.drop_after]
+            type(self).drop_after = None
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(download_models.time, "sleep", lambda seconds: None)  # 重试不等待
+    _Handler.files = {"model.pth": CONTENT}
+    _Handler.ranges = []
+    _Handler.drop_after = None
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_resumes_from_part_file(server, tmp_path: Path):
+    dest = tmp_path / "model.pth"
+    dest.with_name("model.pth.part").write_bytes(CONTENT[:300000])
+
+    assert download_file(f"{server}/model.pth", dest, DIGEST) == DIGEST
+    assert _Handler.ranges == ["bytes=300000-"]
+    assert dest.read_bytes() == CONTENT
+    assert not dest.with_name("model.pth.part").exists()
+
+
+def test_resumes_after_dropped_connection(server, tmp_path: Path):
+    _Handler.drop_after = 400000
+    dest = tmp_path / "model.pth"
+
+    assert download_file(f"{server}/model.pth", dest, DIGEST, timeout=5) == DIGEST
+    assert _Handler.ranges == [None, "bytes=400000-"]
+    assert dest.read_bytes() == CONTENT
+
+
+def test_checksum_mismatch(server, tmp_path: Path):
+    dest = tmp_path / "model.pth"
+
+    with pytest.raises(ChecksumMismatchError):
+        download_file(f"{server}/model.pth", dest, "0" * 64, max_retries=2)
+    # 内容错误不续传:每次都从头下载,失败后不留下目标文件和 .part
+    assert _Handler.ranges == [None, None]
+    assert not dest.exists()
+    assert not dest.with_name("model.pth.part").exists()
+
+
+def test_download_all_from_mirror_writes_checksums(server, tmp_path: Path):
+    _Handler.files["bad.pth"] = b"corrupted"
+    models = [
+        {"name": "model.pth", "url": "https://example.invalid/model.pth", "sha256": DIGEST},
+        {"name": "bad.pth", "url": "https://example.invalid/bad.pth", "sha256": DIGEST},
+    ]
+
+    with pytest.raises(RuntimeError, match="bad.pth"):
+        download_all(models, tmp_path, mirror=server, workers=2)
+    assert (tmp_path / "model.pth").read_bytes() == CONTENT
+    assert not (tmp_path / "bad.pth").exists()
+    assert (tmp_path / "SHA256SUMS").read_text() == f"{DIGEST}  model.pth\n"
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from models.face_enhance import FACE_SIZE, FACE_TEMPLATE, FaceEnhancer
+
+
+class _WhiteFaces(FaceEnhancer):
+    """模板位置上有一张人脸,修复结果为纯白"""
+
+    def _detect(self, image):
+        return FACE_TEMPLATE[None]
+
+    def _restore(self, faces):
+        return np.full_like(faces, 255)
+
+
+@pytest.mark.parametrize("weight, expected", [(0.0, 0), (0.5, 128), (1.0, 255)])
+def test_weight_blends_restored_with_original(weight, expected):
+    image = np.zeros((FACE_SIZE, FACE_SIZE, 3), np.uint8)
+    result, stats = _WhiteFaces(weight=weight).enhance(image, image)
+    assert stats["faces"] == 1
+    center = result[FACE_SIZE // 2, FACE_SIZE // 2]
+    assert np.all(np.abs(center.astype(int) - expected) <= 1)
@@ -0,0 +1,44 @@
+"""并行 Telea 修复与整图 cv2.inpaint 的一致性"""
+import cv2
+import numpy as np
+import pytest
+
+from models.telea import inpaint_telea
+
+
+def _image(height: int, width: int) -> np.ndarray:
+    """渐变 + 平滑噪声的测试图片"""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // width, y * 255 // height, (x + y) * 127 // (height + width)], -1)
+    noise = cv2.GaussianBlur(rng.normal(0, 40, (height, width, 3)).astype(np.float32), (0, 0), 3)
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("radius", [3, 5])
+def test_components_match_cv2(radius):
+    image = _image(600, 800)
+    mask = np.zeros(image.shape[:2], np.uint8)
+    cv2.rectangle(mask, (50, 50), (200, 180), 255, -1)
+    cv2.rectangle(mask, (205, 60), (260, 120), 255, -1)  # 与上一个相距小于 2 * radius,合并为一组
+    cv2.circle(mask, (600, 400), 70, 255, -1)
+    cv2.line(mask, (100, 500), (700, 550), 255, 9)
+    cv2.rectangle(mask, (780, 0), (800, 30), 255, -1)  # 贴边
+
+    expected = cv2.inpaint(image, mask, radius, cv2.INPAINT_TELEA)
+    assert np.array_equal(inpaint_telea(image, mask, radius, pyramid_min_area=0), expected)
+    # 默认不使用金字塔
+    assert np.array_equal(inpaint_telea(image, mask, radius), expected)
+
+
+def test_pyramid_approximates_cv2():
+    """金字塔是近似(默认关闭):遮罩外不变,遮罩内平均差异不超过 20 个灰度级"""
+    image = _image(1200, 1600)
+    mask = np.zeros(image.shape[:2], np.uint8)
+    cv2.rectangle(mask, (300, 300), (900, 800), 255, -1)
+
+    expected = cv2.inpaint(image, mask, 5, cv2.INPAINT_TELEA)
+    result = inpaint_telea(image, mask, 5, pyramid_min_area=65536)
+    diff = np.abs(result.astype(np.int16) - expected)
+    assert np.array_equal(result[mask == 0], image[mask == 0])
+    assert diff[mask > 0].mean() <= 20
@@ -0,0 +1,74 @@
+import asyncio
+import hashlib
+import io
+
+import pytest
+from PIL import Image
+
+import api_server
+from serving.uploads import DigestMismatchError, UploadStore
+
+
+def _png() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), (200, 10, 10)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _store(tmp_path, max_bytes: int = 1 << 20) -> UploadStore:
+    return UploadStore(str(tmp_path), max_bytes=max_bytes, cache_bytes=1 << 20,
+                       decoder=lambda data, mode: Image.open(io.BytesIO(data)).convert(mode))
+
+
+class _Request:
+    """只提供 put_upload 用到的 headers 与 stream()"""
+
+    def __init__(self, chunks, headers=None):
+        self.chunks = chunks
+        self.headers = headers or {}
+        self.consumed = 0
+
+    async def stream(self):
+        for chunk in self.chunks:
+            self.consumed += 1
+            yield chunk
+
+
+def _put(digest, request):
+    return asyncio.run(api_server.put_upload(digest, request))
+
+
+def test_streamed_upload_saved(tmp_path, monkeypatch):
+    monkeypatch.setattr(api_server, "upload_store", _store(tmp_path))
+    data = _png()
+    digest = hashlib.sha256(data).hexdigest()
+
+    response = _put(digest, _Request([data[:10], data[10:]]))
+    assert response.status_code == 201
+    assert (tmp_path / digest).read_bytes() == data
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_upload_cap_checked_before_and_while_reading(tmp_path, monkeypatch):
+    monkeypatch.setattr(api_server, "upload_store", _store(tmp_path, max_bytes=100))
+    digest = "0" * 64
+
+    # Content-Length 超限:不读取请求体
+    request = _Request([b"x" * 50] * 10, {"Content-Length": "500"})
+    with pytest.raises(api_server.HTTPException) as exc:
+        _put(digest, request)
+    assert exc.value.status_code == 413 and request.consumed == 0
+
+    # 没有 Content-Length(分块传输):累计超限时立即中止
+    request = _Request([b"x" * 50] * 10)
+    with pytest.raises(api_server.HTTPException) as exc:
+        _put(digest, request)
+    assert exc.value.status_code == 413 and request.consumed == 3
+    assert not list(tmp_path.iterdir())
+
+
+def test_digest_mismatch_leaves_no_file(tmp_path):
+    store = _store(tmp_path)
+    with pytest.raises(DigestMismatchError):
+        store.put("0" * 64, _png())
+    assert not list(tmp_path.iterdir())
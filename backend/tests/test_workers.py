@@ -0,0 +1,100 @@
+"""Worker 池:Mock 模型 + spawn 子进程,覆盖路由与崩溃后重启"""
+import asyncio
+import os
+import signal
+import time
+
+import numpy as np
+import pytest
+
+from serving.workers import NoCapableWorkerError, WorkerCrashedError, WorkerPool, build_worker_specs
+
+
+def _wait(condition, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("等待 Worker 超时")
+        time.sleep(0.1)
+
+
+@pytest.fixture(scope="module")
+def pool():
+    env = {
+        "INPAINT_MOCK_MODELS": "1",
+        "MOCK_UPSCALE_MPIX_PER_SEC": "0.05",  # 256x256 约 1.3 秒,两个请求同时在途
+        "MOCK_INPAINT_MPIX_PER_SEC": "0",
+        "DEGRADE_QUEUE_DEPTH": "0",  # 不加载降级模型,缩短启动时间
+        "DEGRADE_PREDICTED_WAIT": "0",
+        "DEGRADE_MEMORY_PERCENT": "0",
+    }
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)  # spawn 子进程继承启动时的环境变量
+    pool = WorkerPool(build_worker_specs(2, devices="cpu", memory="64M"))
+    pool.start()
+    try:
+        _wait(lambda: all(w["ready"] for w in pool.stats()))
+        yield pool
+    finally:
+        pool.shutdown()
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def _upscale(pool: WorkerPool, size: int = 256):
+    image = np.zeros((size, size, 3), np.uint8)
+    return pool.run("upscale", {"image": image, "scale": 4}, pixels=size * size)
+
+
+def test_routes_to_least_loaded_worker(pool):
+    async def main():
+        return await asyncio.gather(_upscale(pool), _upscale(pool))
+
+    results = asyncio.run(main())
+    assert sorted(meta["worker"] for _, meta in results) == [0, 1]
+    for output, _ in results:
+        assert output.shape == (1024, 1024, 3)
+
+
+def test_rejects_request_larger_than_worker_memory(pool):
+    async def main():
+        # 512x512 超分预计约 80MB,超过每个 Worker 的 64MB 容量
+        await _upscale(pool, 512)
+
+    with pytest.raises(NoCapableWorkerError):
+        asyncio.run(main())
+
+
+def test_restarts_crashed_worker(pool):
+    async def main():
+        task = asyncio.ensure_future(_upscale(pool))
+        await asyncio.sleep(0.5)
+        busy = [w for w in pool.stats() if w["inflight"]]
+        assert len(busy) == 1
+        os.kill(busy[0]["pid"], signal.SIGKILL)
+        with pytest.raises(WorkerCrashedError):
+            await task
+        return busy[0]["index"]
+
+    index = asyncio.run(main())
+    _wait(lambda: pool.stats()[index]["restarts"] == 1 and pool.stats()[index]["ready"])
+    assert pool.stats()[index]["inflight"] == 0
+
+    async def after_restart():
+        return await asyncio.gather(_upscale(pool), _upscale(pool))
+
+    results = asyncio.run(after_restart())
+    assert sorted(meta["worker"] for _, meta in results) == [0, 1]
+
+
+def test_failed_serialization_does_not_leak_inflight(pool, monkeypatch):
+    def fail(payload, output_shape):
+        raise MemoryError("共享内存不可用")
+
+    monkeypatch.setattr(pool, "_to_wire", fail)
+    with pytest.raises(MemoryError):
+        asyncio.run(_upscale(pool))
+    assert all(w["inflight"] == 0 for w in pool.stats())
@@ -3,7 +3,10 @@
 import { DownloadIcon, EyeIcon, ViewBoardsIcon } from '@heroicons/react/outline'
 import { useCallback, useEffect, useState, useRef, useMemo } from 'react'
 import { useWindowSize } from 'react-use'
-import { serverInpaint } from './adapters/serverInpainting'
+import {
+  closeInpaintSession,
+  serverInpaintIncremental,
+} from './adapters/serverInpainting'
 import Button from './components/Button'
 import Slider from './components/Slider'
 import { downloadImage, loadImage, useImage } from './utils'
@@ -101,6 +104,11 @@ export default function Editor(props: EditorProps) {
     checkBackendInpaint()
   }, [])
 
+  // 换图或关闭编辑器时结束增量 Inpaint 会话,释放服务端保存的图片
+  useEffect(() => {
+    return () => closeInpaintSession()
+  }, [file])
+
   const draw = useCallback(
     (index = -1) => {
       if (!context) {
@@ -217,7 +225,12 @@ export default function Editor(props: EditorProps) {
 
         // 直接调用服务器 GPU，不再检查 inpaintMode 状态
         // if (inpaintMode === 'server') {
-        res = await serverInpaint(newFile, maskCanvas.toDataURL())
+        // 增量模式:同一张结果上连续涂抹时只上传新笔画的遮罩
+        res = await serverInpaintIncremental(
+          newFile,
+          renders.slice(-1)[0] ?? original,
+          maskCanvas.toDataURL()
+        )
         // } else {
         //   throw new Error(
         //     'Inpaint 功能需要后端服务器支持,请检查后端服务是否正常运行'
@@ -511,7 +524,26 @@ export default function Editor(props: EditorProps) {
       console.log('superResolution_start (SERVER GPU)')
 
       const newFile = renders.slice(-1)[0] ?? file
-      const res = await serverSuperResolution(newFile, setGenerateProgress)
+      const res = await serverSuperResolution(
+        newFile,
+        setGenerateProgress,
+        async previewUrl => {
+          // 完整结果返回前先显示低成本预览(与当前图片宽高比一致,直接铺满画布)
+          if (!context) {
+            return
+          }
+          const preview = new Image()
+          await loadImage(preview, previewUrl)
+          context.drawImage(
+            preview,
+            0,
+            0,
+            context.canvas.width,
+            context.canvas.height
+          )
+          URL.revokeObjectURL(previewUrl)
+        }
+      )
 
       if (!res) {
         throw new Error('empty response')
@@ -534,7 +566,7 @@ export default function Editor(props: EditorProps) {
     } finally {
       setIsProcessingLoading(false)
     }
-  }, [file, lines, renders])
+  }, [context, file, lines, renders])
 
   return (
     <div
@@ -0,0 +1,128 @@
+/**
+ * multipart/mixed 流式响应解析
+ * 后端每个分段都带 Content-Length,按长度读取,不需要在正文中搜索分隔符
+ */
+
+export interface MultipartPart {
+  headers: Record<string, string>
+  body: Blob
+}
+
+const encoder = new TextEncoder()
+const decoder = new TextDecoder()
+
+function indexOfBytes(haystack: Uint8Array, needle: Uint8Array, from = 0) {
+  outer: for (let i = from; i <= haystack.length - needle.length; i++) {
+    for (let j = 0; j < needle.length; j++) {
+      if (haystack[i + j] !== needle[j]) {
+        continue outer
+      }
+    }
+    return i
+  }
+  return -1
+}
+
+function concatBytes(parts: Uint8Array[], length: number) {
+  const result = new Uint8Array(length)
+  let offset = 0
+  parts.forEach(part => {
+    result.set(part, offset)
+    offset += part.length
+  })
+  return result
+}
+
+/**
+ * 逐个读取 multipart/mixed 响应的分段,每读完一个分段立即回调
+ * 头部名称统一为小写
+ */
+export async function readMultipartStream(
+  response: Response,
+  onPart: (part: MultipartPart) => void | Promise<void>
+): Promise<void> {
+  const contentType = response.headers.get('Content-Type') || ''
+  const match = contentType.match(/boundary=([^;]+)/)
+  if (!match || !response.body) {
+    throw new Error('响应不是 multipart 流')
+  }
+  const delimiter = encoder.encode(`--${match[1]}`)
+  const headerEnd = encoder.encode('\r\n\r\n')
+
+  const reader = response.body.getReader()
+  let buffer = new Uint8Array(0)
+  let done = false
+
+  // 读取直到缓冲区至少有 size 字节,流结束时返回 false
+  // 网络块先收集到列表里,凑够后一次性拼接,避免大分段每来一块就整体复制一次
+  const fill = async (size: number) => {
+    const chunks = [buffer]
+    let length = buffer.length
+    while (length < size && !done) {
+      const chunk = await reader.read()
+      if (chunk.done) {
+        done = true
+      } else {
+        chunks.push(chunk.value)
+        length += chunk.value.length
+      }
+    }
+    if (chunks.length > 1) {
+      buffer = concatBytes(chunks, length)
+    }
+    return buffer.length >= size
+  }
+
+  for (;;) {
+    // 分段头: --boundary\r\n<headers>\r\n\r\n,结束标记: --boundary--
+    let end = indexOfBytes(buffer, headerEnd)
+    while (end === -1) {
+      if (
+        (await fill(delimiter.length + 2)) &&
+        decoder.decode(buffer.subarray(0, delimiter.length + 2)) ===
+          `--${match[1]}--`
+      ) {
+        return
+      }
+      if (done) {
+        throw new Error('multipart 流意外结束')
+      }
+      await fill(buffer.length + 1)
+      end = indexOfBytes(buffer, headerEnd)
+    }
+
+    if (indexOfBytes(buffer, delimiter) !== 0) {
+      throw new Error('multipart 分段格式错误')
+    }
+    const headers: Record<string, string> = {}
+    decoder
+      .decode(buffer.subarray(delimiter.length, end))
+      .split('\r\n')
+      .forEach(line => {
+        const colon = line.indexOf(':')
+        if (colon > 0) {
+          headers[line.slice(0, colon).trim().toLowerCase()] = line
+            .slice(colon + 1)
+            .trim()
+        }
+      })
+
+    const bodyStart = end + headerEnd.length
+    const length = parseInt(headers['content-length'] || '', 10)
+    if (Number.isNaN(length)) {
+      throw new Error('multipart 分段缺少 Content-Length')
+    }
+    // 正文后跟 \r\n
+    if (!(await fill(bodyStart + length + 2))) {
+      throw new Error('multipart 流意外结束')
+    }
+    // Blob 会复制数据,正文直接用视图
+    const body = buffer.subarray(bodyStart, bodyStart + length)
+    buffer = buffer.slice(bodyStart + length + 2)
+
+    await onPart({
+      headers,
+      body: new Blob([body], { type: headers['content-type'] }),
+    })
+  }
+}
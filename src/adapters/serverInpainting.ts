@@ -3,6 +3,8 @@
  * 使用后端 ONNX Runtime 进行 Inpaint 处理
  */
 
+import { postWithImage } from './uploadStore'
+
 const API_BASE_URL = import.meta.env.VITE_API_URL || ''
 
 /**
@@ -87,83 +89,18 @@ export async function serverInpaint(
   try {
     console.log('🚀 调用服务器 GPU 进行 Inpaint...')
 
-    // 处理不同类型的输入
-    let imageBlob: Blob
-    if (imageFile instanceof HTMLImageElement) {
-      console.log('  处理 HTMLImageElement...')
-      console.log(`    src 类型: ${imageFile.src.substring(0, 50)}...`)
-
-      // 检查 src 是否是 data URL，如果是，直接转换为 Blob（更可靠）
-      if (imageFile.src.startsWith('data:')) {
-        console.log('    src 是 data URL，直接转换为 Blob...')
-        try {
-          imageBlob = await dataURLToBlob(imageFile.src)
-          console.log(`    data URL 转换成功: ${imageBlob.size} bytes`)
-        } catch (e) {
-          console.warn('    data URL 转换失败，尝试 canvas 方式...')
-          imageBlob = await imageToBlob(imageFile)
-        }
-      } else if (imageFile.src.startsWith('blob:')) {
-        // blob URL，需要先 fetch 获取数据
-        console.log('    src 是 blob URL，尝试 fetch...')
-        try {
-          const response = await fetch(imageFile.src)
-          imageBlob = await response.blob()
-          console.log(`    blob URL fetch 成功: ${imageBlob.size} bytes`)
-        } catch (e) {
-          console.warn('    blob URL fetch 失败，尝试 canvas 方式...')
-          imageBlob = await imageToBlob(imageFile)
-        }
-      } else {
-        // 其他 URL（http/https），使用 canvas 方式
-        console.log('    使用 canvas 转换...')
-        imageBlob = await imageToBlob(imageFile)
-      }
-    } else {
-      // File 对象直接使用
-      imageBlob = imageFile
-      console.log(`  File 对象: ${imageBlob.size} bytes`)
-    }
-
-    // 验证 imageBlob 是否有效
-    if (!imageBlob || imageBlob.size === 0) {
-      throw new Error('图片数据无效（大小为 0）')
-    }
-    console.log(
-      `  最终图片 Blob: ${imageBlob.size} bytes, type: ${imageBlob.type}`
-    )
-
-    // 如果图片不是 PNG 格式，需要转换为 PNG 以确保后端兼容性
-    // 某些 JPEG 文件可能有特殊编码导致 PIL 无法识别
-    let finalImageBlob: Blob = imageBlob
-    if (imageBlob.type !== 'image/png') {
-      console.log('  图片非 PNG 格式，进行格式转换...')
-      try {
-        finalImageBlob = await convertToPng(imageBlob)
-        console.log(
-          `  转换后 Blob: ${finalImageBlob.size} bytes, type: ${finalImageBlob.type}`
-        )
-      } catch (e) {
-        console.warn('  PNG 转换失败，使用原始数据:', e)
-        finalImageBlob = imageBlob
-      }
-    }
+    const finalImageBlob = await prepareImageBlob(imageFile)
 
     // 将 mask dataURL 转换为 Blob
     const maskBlob = await dataURLToBlob(maskDataUrl)
 
-    // 构建 FormData
-    // 根据实际类型设置正确的文件扩展名
-    const imageExt = finalImageBlob.type === 'image/png' ? 'png' : 'jpg'
-    const formData = new FormData()
-    formData.append('image', finalImageBlob, `image.${imageExt}`)
-    formData.append('mask', maskBlob, 'mask.png')
-
-    // 调用后端 API
-    const response = await fetch(`${API_BASE_URL}/api/inpaint`, {
-      method: 'POST',
-      body: formData,
-    })
+    // 调用后端 API(图片已按哈希上传过时只传哈希)
+    const response = await postWithImage(
+      `${API_BASE_URL}/api/inpaint`,
+      'image',
+      finalImageBlob,
+      formData => formData.append('mask', maskBlob, 'mask.png')
+    )
 
     if (!response.ok) {
       const errorText = await response.text()
@@ -190,6 +127,229 @@ export async function serverInpaint(
   }
 }
 
+// 同一张图片只转换一次,转换结果的哈希也因此保持不变,可以复用已上传的图片
+const preparedBlobs = new WeakMap<File | HTMLImageElement, Blob>()
+
+/**
+ * 将输入图片统一转换为后端可识别的 Blob(优先 PNG)
+ */
+async function prepareImageBlob(
+  imageFile: File | HTMLImageElement
+): Promise<Blob> {
+  const cached = preparedBlobs.get(imageFile)
+  if (cached) {
+    return cached
+  }
+  const blob = await convertImageBlob(imageFile)
+  preparedBlobs.set(imageFile, blob)
+  return blob
+}
+
+async function convertImageBlob(
+  imageFile: File | HTMLImageElement
+): Promise<Blob> {
+  // 处理不同类型的输入
+  let imageBlob: Blob
+  if (imageFile instanceof HTMLImageElement) {
+    console.log('  处理 HTMLImageElement...')
+    console.log(`    src 类型: ${imageFile.src.substring(0, 50)}...`)
+
+    // 检查 src 是否是 data URL，如果是，直接转换为 Blob（更可靠）
+    if (imageFile.src.startsWith('data:')) {
+      console.log('    src 是 data URL，直接转换为 Blob...')
+      try {
+        imageBlob = await dataURLToBlob(imageFile.src)
+        console.log(`    data URL 转换成功: ${imageBlob.size} bytes`)
+      } catch (e) {
+        console.warn('    data URL 转换失败，尝试 canvas 方式...')
+        imageBlob = await imageToBlob(imageFile)
+      }
+    } else if (imageFile.src.startsWith('blob:')) {
+      // blob URL，需要先 fetch 获取数据
+      console.log('    src 是 blob URL，尝试 fetch...')
+      try {
+        const response = await fetch(imageFile.src)
+        imageBlob = await response.blob()
+        console.log(`    blob URL fetch 成功: ${imageBlob.size} bytes`)
+      } catch (e) {
+        console.warn('    blob URL fetch 失败，尝试 canvas 方式...')
+        imageBlob = await imageToBlob(imageFile)
+      }
+    } else {
+      // 其他 URL（http/https），使用 canvas 方式
+      console.log('    使用 canvas 转换...')
+      imageBlob = await imageToBlob(imageFile)
+    }
+  } else {
+    // File 对象直接使用
+    imageBlob = imageFile
+    console.log(`  File 对象: ${imageBlob.size} bytes`)
+  }
+
+  // 验证 imageBlob 是否有效
+  if (!imageBlob || imageBlob.size === 0) {
+    throw new Error('图片数据无效（大小为 0）')
+  }
+  console.log(
+    `  最终图片 Blob: ${imageBlob.size} bytes, type: ${imageBlob.type}`
+  )
+
+  // 如果图片不是 PNG 格式，需要转换为 PNG 以确保后端兼容性
+  // 某些 JPEG 文件可能有特殊编码导致 PIL 无法识别
+  let finalImageBlob: Blob = imageBlob
+  if (imageBlob.type !== 'image/png') {
+    console.log('  图片非 PNG 格式，进行格式转换...')
+    try {
+      finalImageBlob = await convertToPng(imageBlob)
+      console.log(
+        `  转换后 Blob: ${finalImageBlob.size} bytes, type: ${finalImageBlob.type}`
+      )
+    } catch (e) {
+      console.warn('  PNG 转换失败，使用原始数据:', e)
+      finalImageBlob = imageBlob
+    }
+  }
+
+  return finalImageBlob
+}
+
+/**
+ * 增量 Inpaint 会话
+ * 服务端保存最新结果,每一笔只上传新笔画的遮罩,只返回重新修复的区域
+ */
+interface InpaintSession {
+  sessionId: string
+  width: number
+  height: number
+  // 会话当前对应的前端结果(上一次返回的 data URL),不一致时需要重建会话
+  resultUrl: string
+}
+
+let currentSession: InpaintSession | null = null
+
+async function createInpaintSession(
+  imageFile: File | HTMLImageElement
+): Promise<InpaintSession> {
+  const response = await postWithImage(
+    `${API_BASE_URL}/api/inpaint/session`,
+    'image',
+    await prepareImageBlob(imageFile)
+  )
+  if (!response.ok) {
+    const errorText = await response.text()
+    throw new Error(`HTTP ${response.status}: ${errorText}`)
+  }
+  const data = await response.json()
+  console.log(
+    `✓ 创建 Inpaint 会话 ${data.session_id.slice(0, 8)} (${data.width}x${data.height})`
+  )
+  return {
+    sessionId: data.session_id,
+    width: data.width,
+    height: data.height,
+    resultUrl: '',
+  }
+}
+
+/**
+ * 结束当前会话,释放服务端保存的图片
+ */
+export function closeInpaintSession() {
+  if (currentSession) {
+    fetch(`${API_BASE_URL}/api/inpaint/session/${currentSession.sessionId}`, {
+      method: 'DELETE',
+      // 组件卸载可能发生在页面关闭时,keepalive 保证请求仍能发出
+      keepalive: true,
+    }).catch(() => {})
+    currentSession = null
+  }
+}
+
+/**
+ * 将服务端返回的修复区域合成到当前结果上
+ */
+async function applyPatch(
+  baseImage: HTMLImageElement,
+  patch: Blob,
+  region: string,
+  session: InpaintSession
+): Promise<string> {
+  const [x, y] = region.split(',').map(Number)
+  const canvas = document.createElement('canvas')
+  canvas.width = session.width
+  canvas.height = session.height
+  const ctx = canvas.getContext('2d')
+  if (!ctx) {
+    throw new Error('无法获取 Canvas 上下文')
+  }
+  ctx.drawImage(baseImage, 0, 0, session.width, session.height)
+  const bitmap = await createImageBitmap(patch)
+  ctx.drawImage(bitmap, x, y)
+  bitmap.close()
+  return canvas.toDataURL('image/png')
+}
+
+/**
+ * 增量 Inpaint
+ *
+ * 同一张结果上连续涂抹时只上传新笔画的遮罩;图片不是上一次的结果
+ * (首次、撤销、放大等)或会话过期时自动重建会话
+ *
+ * @param imageFile 当前图片 (File 或 HTMLImageElement)
+ * @param baseImage 当前显示的图片元素,用于合成修复区域
+ * @param maskDataUrl 新笔画的遮罩 Data URL (白色=需要修复的区域)
+ * @returns 修复后的图片 Data URL
+ */
+export async function serverInpaintIncremental(
+  imageFile: File | HTMLImageElement,
+  baseImage: HTMLImageElement,
+  maskDataUrl: string
+): Promise<string> {
+  const maskBlob = await dataURLToBlob(maskDataUrl)
+
+  for (let attempt = 0; attempt < 2; attempt++) {
+    if (!currentSession || currentSession.resultUrl !== baseImage.src) {
+      closeInpaintSession()
+      currentSession = await createInpaintSession(imageFile)
+    }
+    const session = currentSession
+
+    const formData = new FormData()
+    formData.append('mask', maskBlob, 'mask.png')
+    const response = await fetch(
+      `${API_BASE_URL}/api/inpaint/session/${session.sessionId}`,
+      { method: 'POST', body: formData }
+    )
+
+    if (response.status === 404) {
+      // 会话已过期,重建后重试一次
+      console.warn('⚠️ Inpaint 会话已过期,重新创建...')
+      currentSession = null
+      continue
+    }
+    if (!response.ok && response.status !== 204) {
+      const errorText = await response.text()
+      throw new Error(`HTTP ${response.status}: ${errorText}`)
+    }
+
+    let resultUrl = baseImage.src
+    if (response.status === 200) {
+      const region = response.headers.get('X-Region') || '0,0'
+      const processTime = response.headers.get('X-Process-Time')
+      console.log(`✓ 增量 Inpaint 完成 (${processTime}秒, 区域: ${region})`)
+      resultUrl = await applyPatch(
+        baseImage,
+        await response.blob(),
+        region,
+        session
+      )
+    }
+    session.resultUrl = resultUrl
+    return resultUrl
+  }
+  throw new Error('Inpaint 会话创建失败')
+}
+
 /**
  * 将 Blob 转换为 PNG 格式
  * 通过 Image + Canvas 重新编码图片，确保格式兼容性
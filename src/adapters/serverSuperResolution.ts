@@ -3,6 +3,9 @@
  * 调用后端 GPU API 进行图像放大
  */
 
+import { readMultipartStream } from './multipartStream'
+import { postWithImage } from './uploadStore'
+
 // 配置:API 基础 URL
 // 空字符串表示使用相对路径 (通过 Nginx 反向代理访问后端)
 // 本地开发时可设置为 http://localhost:8888
@@ -32,31 +35,37 @@ export async function getBackendInfo(): Promise<any> {
   return response.json()
 }
 
+const convertedFiles = new WeakMap<File | HTMLImageElement, File>()
+
 /**
  * 服务器端超分辨率（GPU 加速）
+ *
+ * 传入 onPreview 时使用渐进式接口:后端解码后立即返回一张低成本预览
+ * (双三次插值),模型推理完成后再返回完整结果
  */
 export async function serverSuperResolution(
   imageFile: File | HTMLImageElement,
-  callback: (progress: number) => void
+  callback: (progress: number) => void,
+  onPreview?: (previewUrl: string) => void
 ): Promise<string> {
   // 并不是所有 File 都能被 PIL 直接识别，为了稳妥起见，
   // 我们统一将所有图片（无论是 File 还是 HTMLImageElement）
   // 都先绘制到 Canvas 上再转为标准 PNG File
-  let file: File
-
-  if (imageFile instanceof HTMLImageElement) {
-    file = await htmlImageToFile(imageFile)
-  } else {
-    // 如果是 File，先转为 Image 元素加载，再转回 PNG File
-    // 这样可以确保格式统一为 PNG，解决兼容性问题
-    const img = await fileToImage(imageFile)
-    file = await htmlImageToFile(img)
+  // 同一张图片只转换一次,转换结果的哈希不变,可以复用已上传的图片
+  let file = convertedFiles.get(imageFile)
+
+  if (!file) {
+    if (imageFile instanceof HTMLImageElement) {
+      file = await htmlImageToFile(imageFile)
+    } else {
+      // 如果是 File，先转为 Image 元素加载，再转回 PNG File
+      // 这样可以确保格式统一为 PNG，解决兼容性问题
+      const img = await fileToImage(imageFile)
+      file = await htmlImageToFile(img)
+    }
+    convertedFiles.set(imageFile, file)
   }
 
-  // 创建 FormData
-  const formData = new FormData()
-  formData.append('file', file)
-
   // 模拟进度（因为后端不支持实时进度）
   let progress = 0
   const progressInterval = setInterval(() => {
@@ -69,10 +78,20 @@ export async function serverSuperResolution(
   try {
     console.log('🚀 调用服务器 GPU 进行超分辨率处理...')
 
-    const response = await fetch(`${API_BASE_URL}/api/upscale`, {
-      method: 'POST',
-      body: formData,
-    })
+    const endpoint = onPreview ? '/api/upscale/progressive' : '/api/upscale'
+    // 图片已按哈希上传过时只传哈希
+    const response = await postWithImage(
+      `${API_BASE_URL}${endpoint}`,
+      'file',
+      file
+    )
+
+    if (onPreview && response.ok) {
+      const url = await readProgressive(response, onPreview)
+      clearInterval(progressInterval)
+      callback(100)
+      return url
+    }
 
     clearInterval(progressInterval)
 
@@ -100,6 +119,35 @@ export async function serverSuperResolution(
   }
 }
 
+/**
+ * 读取渐进式接口的 multipart 流:preview 分段回调预览,final 分段返回完整结果
+ */
+async function readProgressive(
+  response: Response,
+  onPreview: (previewUrl: string) => void
+): Promise<string> {
+  let resultUrl = ''
+  await readMultipartStream(response, async part => {
+    const stage = part.headers['x-stage']
+    if (stage === 'preview') {
+      console.log(`✓ 收到预览 (${part.headers['x-preview-size']})`)
+      onPreview(URL.createObjectURL(part.body))
+    } else if (stage === 'final') {
+      const processTime = part.headers['x-process-time']
+      const device = part.headers['x-device']
+      console.log(`✓ 处理完成 (${processTime}秒, 设备: ${device})`)
+      resultUrl = URL.createObjectURL(part.body)
+    } else if (stage === 'error') {
+      const error = JSON.parse(await part.body.text())
+      throw new Error(error.error || '服务器处理失败')
+    }
+  })
+  if (!resultUrl) {
+    throw new Error('服务器未返回处理结果')
+  }
+  return resultUrl
+}
+
 /**
  * 将 HTMLImageElement 转换为 File
  */
@@ -0,0 +1,100 @@
+/**
+ * 按内容寻址上传
+ * 图片按 SHA-256 只上传一次(HEAD / PUT /api/uploads/<hash>),
+ * 之后的请求只传 <字段名>_hash,不再重复上传整张图片
+ */
+
+const API_BASE_URL = import.meta.env.VITE_API_URL || ''
+
+// 已确认在服务端存在的哈希
+const uploaded = new Set<string>()
+// 同一个 Blob 只计算一次哈希
+const digests = new WeakMap<Blob, string>()
+
+async function sha256Hex(blob: Blob): Promise<string> {
+  const cached = digests.get(blob)
+  if (cached) {
+    return cached
+  }
+  const buffer = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer())
+  const hex = Array.from(new Uint8Array(buffer))
+    .map(b => b.toString(16).padStart(2, '0'))
+    .join('')
+  digests.set(blob, hex)
+  return hex
+}
+
+/**
+ * 确保图片已上传到服务端,返回其 SHA-256
+ * 浏览器不支持 crypto.subtle(非 HTTPS 环境)或上传失败时返回 null,调用方直接上传文件
+ */
+export async function ensureUploaded(blob: Blob): Promise<string | null> {
+  if (!globalThis.crypto?.subtle) {
+    return null
+  }
+  try {
+    const digest = await sha256Hex(blob)
+    if (uploaded.has(digest)) {
+      return digest
+    }
+    const url = `${API_BASE_URL}/api/uploads/${digest}`
+    const head = await fetch(url, { method: 'HEAD' })
+    if (!head.ok) {
+      const put = await fetch(url, {
+        method: 'PUT',
+        body: blob,
+        headers: { 'Content-Type': blob.type || 'application/octet-stream' },
+      })
+      if (!put.ok) {
+        console.warn(`⚠️ 上传失败 (HTTP ${put.status}),改为直接上传`)
+        return null
+      }
+      console.log(`✓ 已上传图片 ${digest.slice(0, 12)} (${blob.size} bytes)`)
+    }
+    uploaded.add(digest)
+    return digest
+  } catch (error) {
+    console.warn('⚠️ 按哈希上传失败,改为直接上传:', error)
+    return null
+  }
+}
+
+/**
+ * POST 一个包含图片的表单:图片已上传时只传哈希
+ * 服务端报告哈希已过期(404 + X-Upload-Missing)时重新上传并重试一次
+ *
+ * @param url 接口地址
+ * @param field 图片字段名,哈希字段为 `${field}_hash`
+ * @param blob 图片
+ * @param fill 追加其他表单字段
+ */
+export async function postWithImage(
+  url: string,
+  field: string,
+  blob: Blob,
+  fill: (formData: FormData) => void = () => {}
+): Promise<Response> {
+  for (let attempt = 0; ; attempt++) {
+    const digest = await ensureUploaded(blob)
+    const formData = new FormData()
+    if (digest) {
+      formData.append(`${field}_hash`, digest)
+    } else {
+      const ext = blob.type === 'image/png' ? 'png' : 'jpg'
+      formData.append(field, blob, `${field}.${ext}`)
+    }
+    fill(formData)
+
+    const response = await fetch(url, { method: 'POST', body: formData })
+    if (
+      digest &&
+      attempt === 0 &&
+      response.status === 404 &&
+      response.headers.get('X-Upload-Missing')
+    ) {
+      uploaded.delete(digest)
+      continue
+    }
+    return response
+  }
+}